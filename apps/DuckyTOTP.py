@@ -3,15 +3,19 @@ import curses
 import json
 import base64
 import hmac
+import os
 import struct
 import sys
 import time
-import json
-import colorama
 
 
-def hotp(key, counter, digits=6, digest='sha1'):
-    key = base64.b32decode(key.upper() + '=' * ((8 - len(key)) % 8))
+def decode_key(key):
+    """Base32 secret (any case, padding optional) to raw key bytes."""
+    return base64.b32decode(key.upper() + '=' * ((8 - len(key)) % 8))
+
+
+def hotp_raw(key, counter, digits=6, digest='sha1'):
+    """hotp() for an already decoded key."""
     counter = struct.pack('>Q', counter)
     mac = hmac.new(key, counter, digest).digest()
     offset = mac[-1] & 0x0f
@@ -19,17 +23,236 @@ def hotp(key, counter, digits=6, digest='sha1'):
     return str(binary)[-digits:].zfill(digits)
 
 
+def hotp(key, counter, digits=6, digest='sha1'):
+    return hotp_raw(decode_key(key), counter, digits, digest)
+
+
 def totp(key, time_step=30, digits=6, digest='sha1'):
     return hotp(key, int(time.time() / time_step), digits, digest)
 
+
+# Headless batch API. A secret is decoded and keyed into an HMAC object once;
+# every counter in its drift window then starts from a copy of that state
+# instead of decoding and re-keying for each step.
+
+def prepare(secret, digest='sha1'):
+    """HMAC state keyed with a base32 secret, ready to copy() for each counter."""
+    return hmac.new(decode_key(secret), digestmod=digest)
+
+
+def code_at(prepared, counter, digits=6):
+    mac = prepared.copy()
+    mac.update(struct.pack('>Q', counter))
+    mac = mac.digest()
+    offset = mac[-1] & 0x0f
+    binary = struct.unpack('>L', mac[offset:offset+4])[0] & 0x7fffffff
+    return str(binary)[-digits:].zfill(digits)
+
+
+def generate(secrets, now=None, time_step=30, digits=6, digest='sha1', window=0):
+    """Yield (secret, codes) for each secret; codes runs from `window` steps back to `window` ahead."""
+    counter = int((time.time() if now is None else now) / time_step)
+    for secret in secrets:
+        prepared = prepare(secret, digest)
+        yield secret, [code_at(prepared, counter + d, digits) for d in range(-window, window + 1)]
+
+
+def verify(pairs, now=None, time_step=30, digits=6, digest='sha1', window=1):
+    """Yield (secret, code, drift) for each (secret, code) pair.
+
+    drift is the step offset the code matched at, closest to now first, or
+    None if it matched nowhere within +-window steps."""
+    counter = int((time.time() if now is None else now) / time_step)
+    offsets = sorted(range(-window, window + 1), key=abs)
+    for secret, code in pairs:
+        prepared = prepare(secret, digest)
+        drift = None
+        for d in offsets:
+            if hmac.compare_digest(code_at(prepared, counter + d, digits), code):
+                drift = d
+                break
+        yield secret, code, drift
+
+
+def _process(mode, lines, options):
+    if mode == 'generate':
+        secrets = [line.split()[0] for line in lines]
+        return [secret + "\t" + " ".join(codes) for secret, codes in generate(secrets, **options)]
+    pairs = []
+    for line in lines:
+        fields = line.split()
+        if len(fields) < 2:
+            raise ValueError("expected 'SECRET CODE'")
+        pairs.append((fields[0], fields[1]))
+    return [f"{secret}\t{code}\t" + ("fail" if drift is None else f"ok\t{drift:+d}")
+            for secret, code, drift in verify(pairs, **options)]
+
+
+def _run_chunk(job):
+    mode, lines, options = job
+    try:
+        return _process(mode, lines, options)
+    except Exception:
+        pass
+    out = []  # something in here is bad: go line by line so it only fails itself
+    for line in lines:
+        try:
+            out.extend(_process(mode, [line], options))
+        except Exception as e:
+            out.append(f"{line.split()[0]}\terror\t{str(e) or type(e).__name__}")
+    return out
+
+
+def _chunks(lines, size):
+    chunk = []
+    for line in lines:
+        if line.strip():
+            chunk.append(line)
+            if len(chunk) == size:
+                yield chunk
+                chunk = []
+    if chunk:
+        yield chunk
+
+
+def run_batch(mode, lines, options, jobs=1, chunk_size=1000):
+    """Yield output lines for `lines` in order, as they are ready.
+
+    With jobs > 1 the chunks go to a process pool, keeping only a few per
+    worker in flight so input and output both stream."""
+    if jobs <= 1:
+        for chunk in _chunks(lines, chunk_size):
+            yield from _run_chunk((mode, chunk, options))
+        return
+    from collections import deque
+    from concurrent.futures import ProcessPoolExecutor
+    with ProcessPoolExecutor(jobs) as pool:
+        pending = deque()
+        for chunk in _chunks(lines, chunk_size):
+            pending.append(pool.submit(_run_chunk, (mode, chunk, options)))
+            if len(pending) >= jobs * 2:
+                yield from pending.popleft().result()
+        while pending:
+            yield from pending.popleft().result()
+
+
+def bench(count, window, digest, jobs):
+    """Verify `count` random secrets, naively and through run_batch(), and print the rates."""
+    import random
+    rng = random.Random(1)
+    alphabet = 'ABCDEFGHIJKLMNOPQRSTUVWXYZ234567'
+    now = time.time()
+    secrets = [''.join(rng.choice(alphabet) for _ in range(32)) for _ in range(count)]
+    pairs = [(s, c[0]) for s, c in generate(secrets, now - 30, digest=digest)]  # one step of drift
+    lines = [f"{s} {c}" for s, c in pairs]
+    checks = count * (2 * window + 1)
+
+    start = time.perf_counter()
+    counter = int(now / 30)
+    for secret, code in pairs:
+        for d in sorted(range(-window, window + 1), key=abs):
+            if hotp(secret, counter + d, 6, digest) == code:
+                break
+    naive = time.perf_counter() - start
+    print(f"naive hotp():        {count / naive:12.0f} verifies/s")
+
+    options = {'now': now, 'digest': digest, 'window': window}
+    start = time.perf_counter()
+    ok = sum(1 for out in run_batch('verify', lines, options) if "\tok\t" in out)
+    prepared = time.perf_counter() - start
+    print(f"prepared, 1 process: {count / prepared:12.0f} verifies/s")
+    if jobs > 1:
+        start = time.perf_counter()
+        ok = sum(1 for out in run_batch('verify', lines, options, jobs) if "\tok\t" in out)
+        pooled = time.perf_counter() - start
+        print(f"prepared, {jobs} procs: {count / pooled:12.0f} verifies/s")
+    print(f"{count} codes, window +-{window} (up to {checks} HMACs), {ok} verified")
+
+
+def headless(argv):
+    """`DuckyTOTP.py generate|verify|bench ...`: bulk codes without the curses UI."""
+    import argparse
+    parser = argparse.ArgumentParser(prog="DuckyTOTP.py", description="Generate or verify TOTP codes in bulk.")
+    parser.add_argument("mode", choices=["generate", "verify", "bench"])
+    parser.add_argument("file", nargs="?", help="input file, one 'SECRET' (generate) or 'SECRET CODE' (verify) per line; default stdin")
+    parser.add_argument("--time-step", type=int, default=30)
+    parser.add_argument("--digits", type=int, default=6)
+    parser.add_argument("--digest", default="sha1")
+    parser.add_argument("--window", type=int, default=None, help="steps of drift either side (default 0 for generate, 1 for verify)")
+    parser.add_argument("--at", type=float, default=None, help="unix time to use instead of now")
+    parser.add_argument("--jobs", type=int, default=1, help="worker processes for large batches")
+    parser.add_argument("--count", type=int, default=20000, help="secrets to use for bench")
+    args = parser.parse_args(argv)
+    window = args.window if args.window is not None else (0 if args.mode == "generate" else 1)
+    if args.mode == "bench":
+        bench(args.count, window, args.digest, max(args.jobs, 1))
+        return 0
+    options = {'now': args.at, 'time_step': args.time_step, 'digits': args.digits,
+               'digest': args.digest, 'window': window}
+    if options['now'] is None:
+        options['now'] = time.time()  # one clock for every chunk and worker
+    source = open(args.file) if args.file else sys.stdin
+    failed = False
+    try:
+        for line in run_batch(args.mode, source, options, args.jobs):
+            failed = failed or line.endswith("\tfail") or "\terror\t" in line
+            print(line, flush=source is sys.stdin and sys.stdin.isatty())
+    finally:
+        if source is not sys.stdin:
+            source.close()
+    return 1 if failed else 0
+
 def addpad(s, width):
     """Pad or truncate string s to exactly width characters."""
     return s[:width].ljust(width)
+
+class Entry:
+    """One key from totp.json, decoded once, with the code for its current step."""
+    __slots__ = ("name", "key", "time_step", "digits", "digest", "counter", "code", "error")
+
+    def __init__(self, key):
+        self.name = key.get('name', '?')
+        self.time_step = key.get('time_step', 30)
+        self.digits = key.get('digits', 6)
+        self.digest = key.get('digest', 'sha1')
+        self.counter = None
+        self.code = None
+        try:
+            self.key = decode_key(key['secret'])
+            self.error = None
+        except Exception as e:
+            self.key = None
+            self.error = str(e) or type(e).__name__
+
+    def update(self, now):
+        """Recompute the code if a new step started. Returns True if it did."""
+        counter = int(now / self.time_step)
+        if counter == self.counter:
+            return False
+        self.counter = counter
+        if self.key is not None:
+            try:
+                self.code = hotp_raw(self.key, counter, self.digits, self.digest)
+            except Exception as e:
+                self.code = None
+                self.error = str(e) or type(e).__name__
+        return True
+
+    def remaining(self, now):
+        return int((self.counter + 1) * self.time_step - now + 0.999)
+
+
+def load_entries(path='totp.json'):
+    with open(path) as f:
+        data = json.load(f)
+    return [Entry(key) for key in data['keys']]
+
+
 def main():
     try:
         with open('totp.json') as f:
             data = json.load(f)
-    except Exception as e:
+    except Exception:
         example = {
             "keys": [
                 {
@@ -91,16 +314,56 @@ def main():
     
     def wrapperythingy(stdscr):
         curses.curs_set(0)
-        width = stdscr.getmaxyx()[1]
+        entries = [Entry(key) for key in data['keys']]
+        try:
+            mtime = os.stat('totp.json').st_mtime_ns
+        except OSError:
+            mtime = None
+        shown = {}  # row -> text on screen, so only lines that changed get drawn
+        size = None
         try:
             while True:
-                stdscr.clear()
-                stdscr.addstr(0, 0, addpad("Ducky TOTP -  ^C to exit",width)+"\n\n",curses.A_REVERSE)
-                for key in data['keys']:
-                    stdscr.addstr(key['name'], curses.A_BOLD)
-                    stdscr.addstr(": " + totp(key['secret'], key.get('time_step', 30), key.get('digits', 6), key.get('digest', 'sha1')) + "\n")
+                try:
+                    new_mtime = os.stat('totp.json').st_mtime_ns
+                except OSError:
+                    new_mtime = mtime
+                if new_mtime != mtime:
+                    mtime = new_mtime
+                    try:
+                        entries = load_entries()
+                    except Exception:
+                        pass  # half-written or broken; keep the old keys until it's fixed
+                    size = None
+                if stdscr.getmaxyx() != size:
+                    size = stdscr.getmaxyx()
+                    stdscr.erase()
+                    shown = {}
+                    stdscr.addstr(0, 0, addpad("Ducky TOTP -  ^C to exit", size[1]), curses.A_REVERSE)
+                now = time.time()
+                for row, entry in enumerate(entries, start=2):
+                    if row >= size[0]:
+                        break
+                    entry.update(now)
+                    if entry.error is not None:
+                        code = "error: " + entry.error
+                    else:
+                        code = f"{entry.code}  ({entry.remaining(now)}s)"
+                    if shown.get(row) != (entry.name, code):
+                        shown[row] = (entry.name, code)
+                        try:
+                            stdscr.move(row, 0)
+                            stdscr.clrtoeol()
+                            stdscr.addstr(row, 0, entry.name[:size[1] - 1], curses.A_BOLD)
+                            stdscr.addstr(": " + code[:max(0, size[1] - len(entry.name) - 3)])
+                        except curses.error:
+                            pass
                 stdscr.refresh()
-                time.sleep(0.1)
+                # Wake for the next code change or countdown tick, whichever comes first,
+                # or a resize: curses only notices one (KEY_RESIZE) inside getch().
+                now = time.time()
+                wake = min([now + 1.0 - now % 1.0] + [(e.counter + 1) * e.time_step for e in entries if e.counter is not None])
+                stdscr.timeout(max(0, int((wake - now) * 1000)))
+                stdscr.getch()
         except KeyboardInterrupt:
             pass
         except Exception as e:
@@ -110,12 +373,8 @@ def main():
             sys.exit(1)
     curses.wrapper(wrapperythingy)
 
-    """commented
-    args = [int(x) if x.isdigit() else x for x in sys.argv[1:]]
-    for key in sys.stdin:
-        print(totp(key.strip(), *args))
-    """
-
 
 if __name__ == '__main__':
+    if len(sys.argv) > 1:
+        sys.exit(headless(sys.argv[1:]))
     main()
\ No newline at end of file
@@ -0,0 +1,488 @@
+#!/usr/bin/env python3
+"""Headless benchmarks for Duckymux.
+
+Runs main.py on a pty in a scratch directory full of synthetic apps, drives it
+with scripted keystrokes and mouse events, and writes the results as JSON so two
+commits can be compared:
+
+    python3 bench.py -o before.json
+    (change things)
+    python3 bench.py -o after.json --compare before.json
+"""
+import argparse
+import json
+import os
+import platform
+import pty
+import select
+import shutil
+import signal
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+MAIN = os.path.join(HERE, "main.py")
+
+# Apps are listed sorted by name, so the prefixes fix their row in the list.
+SYNTHETIC_APPS = {
+    "a_echo.py": """
+import sys
+print("ECHO>", flush=True)
+for line in sys.stdin:
+    pass
+""",
+    "b_launch.py": """
+import time
+print("LAUNCHED", flush=True)
+while True:
+    time.sleep(1)
+""",
+    "c_reattach.py": """
+import sys, time
+line = "x" * 79 + "\\n"
+sys.stdout.write(line * %(reattach_lines)d)
+sys.stdout.write("REATTACH-END\\n")
+sys.stdout.flush()
+while True:
+    time.sleep(1)
+""",
+    "d_flood.py": """
+import sys
+line = "flood " * 13 + "\\n"
+block = line * 64
+while True:
+    sys.stdout.write(block)
+""",
+    "e_redraw.py": """
+import curses, time
+def run(stdscr):
+    n = 0
+    while True:
+        n += 1
+        stdscr.erase()
+        for row in range(20):
+            stdscr.addstr(row, 0, f"redraw {n} row {row}")
+        stdscr.refresh()
+        time.sleep(0.01)
+curses.wrapper(run)
+""",
+}
+# Steady ~1 MB/s each; ten of these make the flood for the *_flood10 benchmarks.
+RATE_FLOOD_APP = """
+import sys, time
+block = ("flood " * 13 + "\\n") * 200
+while True:
+    sys.stdout.write(block)
+    sys.stdout.flush()
+    time.sleep(0.016)
+"""
+FLOOD_APPS = 10
+IDLE_APP = """
+import time
+while True:
+    time.sleep(1)
+"""
+APP_ORDER = ["a_echo.py", "b_launch.py", "c_reattach.py", "d_flood.py", "e_redraw.py"]
+
+
+class Session:
+    """One Duckymux process on a pty, with the keystroke helpers the benchmarks need."""
+
+    def __init__(self, workdir, rows=40, cols=120):
+        self.index = 0
+        self.pid, self.fd = pty.fork()
+        if self.pid == 0:
+            os.chdir(workdir)
+            os.environ["TERM"] = "xterm"
+            os.execvp(sys.executable, [sys.executable, MAIN])
+        import fcntl, struct, termios
+        fcntl.ioctl(self.fd, termios.TIOCSWINSZ, struct.pack("HHHH", rows, cols, 0, 0))
+        self.output = bytearray()
+
+    def read(self, timeout):
+        """Read whatever arrives within timeout seconds. Returns the bytes read."""
+        got = bytearray()
+        end = time.perf_counter() + timeout
+        while True:
+            left = end - time.perf_counter()
+            if left <= 0:
+                break
+            readable, _, _ = select.select([self.fd], [], [], left)
+            if not readable:
+                break
+            try:
+                data = os.read(self.fd, 65536)
+            except OSError:
+                break
+            if not data:
+                break
+            got.extend(data)
+        self.output.extend(got)
+        return got
+
+    def settle(self, quiet=0.2, limit=5.0):
+        """Read until the screen has been quiet for `quiet` seconds."""
+        end = time.perf_counter() + limit
+        while time.perf_counter() < end:
+            if not self.read(quiet):
+                return
+
+    def send(self, data):
+        os.write(self.fd, data)
+
+    def wait_for(self, marker, timeout=10.0):
+        """Seconds until marker shows up in fresh output, or None on timeout."""
+        start = time.perf_counter()
+        seen = bytearray()
+        while time.perf_counter() - start < timeout:
+            seen.extend(self.read(0.01))
+            if marker in seen:
+                return time.perf_counter() - start
+        return None
+
+    def first_output(self, data, timeout=2.0):
+        """Send data and time how long until anything at all is drawn."""
+        start = time.perf_counter()
+        self.send(data)
+        readable, _, _ = select.select([self.fd], [], [], timeout)
+        if not readable:
+            return None
+        elapsed = time.perf_counter() - start
+        self.read(0.02)
+        return elapsed
+
+    def goto(self, index):
+        while self.index < index:
+            self.send(b"j")
+            self.index += 1
+        while self.index > index:
+            self.send(b"k")
+            self.index -= 1
+        self.settle(0.1)
+
+    def click(self, x, y, button=0):
+        """SGR (1006) mouse press + release at 0-based screen position x, y."""
+        self.send(f"\x1b[<{button};{x + 1};{y + 1}M".encode())
+        self.send(f"\x1b[<{button};{x + 1};{y + 1}m".encode())
+
+    def detach(self):
+        self.send(b"\x04\x18")
+        self.settle()
+
+    def cpu_seconds(self):
+        """utime + stime of the Duckymux process itself, children excluded."""
+        with open(f"/proc/{self.pid}/stat") as f:
+            fields = f.read().rsplit(")", 1)[1].split()
+        return (int(fields[11]) + int(fields[12])) / os.sysconf("SC_CLK_TCK")
+
+    def cpu_over(self, seconds):
+        before = self.cpu_seconds()
+        self.read(seconds)
+        return self.cpu_seconds() - before
+
+    def close(self):
+        try:
+            self.send(b"q")
+            self.read(1.0)
+        except OSError:
+            pass
+        try:
+            os.kill(self.pid, signal.SIGKILL)
+        except ProcessLookupError:
+            pass
+        os.waitpid(self.pid, 0)
+        os.close(self.fd)
+
+
+def make_workdir(idle_apps, reattach_lines):
+    workdir = tempfile.mkdtemp(prefix="duckymux-bench-")
+    apps_dir = os.path.join(workdir, "apps")
+    os.mkdir(apps_dir)
+    for name, source in SYNTHETIC_APPS.items():
+        with open(os.path.join(apps_dir, name), "w") as f:
+            f.write(source % {"reattach_lines": reattach_lines} if "%(" in source else source)
+    for i in range(FLOOD_APPS):
+        with open(os.path.join(apps_dir, f"y_flood_{i:02d}.py"), "w") as f:
+            f.write(RATE_FLOOD_APP)
+    for i in range(idle_apps):
+        with open(os.path.join(apps_dir, f"z_idle_{i:03d}.py"), "w") as f:
+            f.write(IDLE_APP)
+    return workdir
+
+
+def summarize(samples, unit):
+    samples = [s for s in samples if s is not None]
+    if not samples:
+        return {"value": None, "unit": unit, "samples": 0}
+    samples.sort()
+    return {
+        "value": statistics.median(samples),
+        "p95": samples[min(len(samples) - 1, int(len(samples) * 0.95))],
+        "mean": statistics.fmean(samples),
+        "unit": unit,
+        "samples": len(samples),
+    }
+
+
+def run_benchmarks(args):
+    results = {}
+    workdir = make_workdir(args.idle_apps, args.reattach_lines)
+    start = time.perf_counter()
+    session = Session(workdir)
+    try:
+        results["startup"] = summarize([session.wait_for(b"Duckymux")], "s")
+        session.settle()
+
+        # Keyboard navigation and mouse clicks on an idle list.
+        samples = []
+        for i in range(args.repeat):
+            samples.append(session.first_output(b"j" if i % 2 == 0 else b"k"))
+            session.index += 1 if i % 2 == 0 else -1
+            session.settle(0.05)
+        results["nav_latency"] = summarize(samples, "s")
+        samples = []
+        for i in range(args.repeat):
+            row = 2 + i % 2
+            start_click = time.perf_counter()
+            session.click(0, row)
+            readable, _, _ = select.select([session.fd], [], [], 2.0)
+            samples.append(time.perf_counter() - start_click if readable else None)
+            session.index = row - 1
+            session.settle(0.05)
+        results["click_latency"] = summarize(samples, "s")
+
+        # Keystroke to echo through an open app.
+        session.goto(APP_ORDER.index("a_echo.py"))
+        session.send(b"o")
+        session.wait_for(b"ECHO>")
+        session.settle(0.1)
+        samples = []
+        for i in range(args.repeat):
+            char = bytes([ord("a") + i % 26])
+            session.send(char)
+            samples.append(session.wait_for(char, 2.0))
+        results["keystroke_echo"] = summarize(samples, "s")
+        session.send(b"\n")
+        session.detach()
+
+        # Launch: 'o' on a stopped app until its first line is on screen.
+        session.goto(APP_ORDER.index("b_launch.py"))
+        start_launch = time.perf_counter()
+        session.send(b"o")
+        found = session.wait_for(b"LAUNCHED")
+        results["launch_latency"] = summarize([found and time.perf_counter() - start_launch], "s")
+        session.detach()
+
+        # Reattach: replay a large backlog that built up in the background.
+        session.goto(APP_ORDER.index("c_reattach.py"))
+        session.send(b"r")
+        session.settle(0.5)
+        session.read(args.reattach_wait)
+        start_attach = time.perf_counter()
+        session.send(b"o")
+        found = session.wait_for(b"REATTACH-END")
+        results["reattach_time"] = summarize([found and time.perf_counter() - start_attach], "s")
+        results["reattach_bytes"] = {"value": args.reattach_lines * 80, "unit": "bytes"}
+        session.detach()
+
+        # Throughput while attached to a flooder.
+        session.goto(APP_ORDER.index("d_flood.py"))
+        session.send(b"o")
+        session.wait_for(b"flood")
+        got = session.read(args.duration)
+        results["attached_throughput"] = {"value": len(got) / args.duration, "unit": "bytes/s"}
+        session.detach()
+
+        # Flooder in the background, nobody watching.
+        cpu = session.cpu_over(args.duration)
+        results["flood_background_cpu"] = {"value": cpu / args.duration, "unit": "cpu"}
+        session.send(b"s")
+        session.settle()
+
+        # CPU cost of idle apps.
+        baseline = session.cpu_over(args.duration)
+        first_idle = len(APP_ORDER) + FLOOD_APPS
+        session.goto(first_idle)
+        launch_start = time.perf_counter()
+        for i in range(args.idle_apps):
+            session.send(b"r")
+            if i < args.idle_apps - 1:
+                session.send(b"j")
+                session.index += 1
+        session.settle(0.5)
+        results["bulk_launch"] = {"value": time.perf_counter() - launch_start, "unit": "s",
+                                  "apps": args.idle_apps}
+        loaded = session.cpu_over(args.duration)
+        results["idle_cpu_baseline"] = {"value": baseline / args.duration, "unit": "cpu"}
+        results["idle_cpu_per_app"] = {
+            "value": (loaded - baseline) / args.duration / max(1, args.idle_apps), "unit": "cpu"}
+
+        # Busy: a curses redrawer in the background while navigating.
+        session.goto(APP_ORDER.index("e_redraw.py"))
+        session.send(b"r")
+        session.settle(0.5)
+        samples = []
+        for i in range(args.repeat):
+            samples.append(session.first_output(b"k" if i % 2 == 0 else b"j"))
+            session.index += -1 if i % 2 == 0 else 1
+            session.settle(0.05)
+        results["nav_latency_busy"] = summarize(samples, "s")
+        results["busy_cpu"] = {"value": session.cpu_over(args.duration) / args.duration, "unit": "cpu"}
+
+        # Ten apps flooding in the background.
+        session.goto(len(APP_ORDER))
+        for i in range(FLOOD_APPS):
+            session.send(b"r")
+            if i < FLOOD_APPS - 1:
+                session.send(b"j")
+                session.index += 1
+        session.settle(0.2, limit=0.5)
+        samples = []
+        for i in range(args.repeat):
+            samples.append(session.first_output(b"k" if i % 2 == 0 else b"j"))
+            session.index += -1 if i % 2 == 0 else 1
+            session.read(0.05)
+        results["nav_latency_flood10"] = summarize(samples, "s")
+        results["flood10_cpu"] = {"value": session.cpu_over(args.duration) / args.duration, "unit": "cpu"}
+        session.goto(APP_ORDER.index("a_echo.py"))
+        session.send(b"o")
+        session.wait_for(b"ECHO>")
+        session.read(0.1)
+        samples = []
+        for i in range(args.repeat):
+            char = bytes([ord("a") + i % 26])
+            session.send(char)
+            samples.append(session.wait_for(char, 2.0))
+        results["keystroke_echo_flood10"] = summarize(samples, "s")
+        session.send(b"\n")
+        session.detach()
+    finally:
+        session.close()
+        shutil.rmtree(workdir, ignore_errors=True)
+    results["app_record_bytes"] = {"value": app_record_bytes(), "unit": "bytes"}
+    for channel in ("pty", "shm"):
+        rate, cpu = output_channel(channel, args.duration)
+        results[f"{channel}_throughput"] = {"value": rate, "unit": "bytes/s"}
+        results[f"{channel}_cpu_per_mb"] = {"value": cpu, "unit": "cpu s"}
+    results["total_time"] = {"value": time.perf_counter() - start, "unit": "s"}
+    return results
+
+
+def app_record_bytes(count=1000):
+    """Memory per stopped app in the Mux's app table, measured with tracemalloc."""
+    import tracemalloc
+    sys.path.insert(0, HERE)
+    from duckymux import App
+    names = [f"z_idle_{i:05d}.py" for i in range(count)]
+    paths = [os.path.join("apps", name) for name in names]
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    table = [App(i, names[i], paths[i]) for i in range(count)]
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del table
+    return (after - before) / count
+
+
+CHANNEL_APP = """
+import functools, os
+if %(shm)r:
+    import duckyshm
+    write = duckyshm.connect().write
+else:
+    write = functools.partial(os.write, 1)
+block = b"sample " * 9362 + b"\\n"
+while True:
+    write(block)
+"""
+
+
+def output_channel(channel, duration):
+    """Bytes a second a Mux takes in from one app printing 64kB writes as fast
+    as it can, through its pty or a shared-memory ring, and the Mux's CPU
+    seconds per MB of it."""
+    sys.path.insert(0, HERE)
+    from duckymux import Mux
+    workdir = tempfile.mkdtemp(prefix="duckymux-bench-")
+    try:
+        os.mkdir(os.path.join(workdir, "apps"))
+        with open(os.path.join(workdir, "apps", "producer.py"), "w") as f:
+            f.write(CHANNEL_APP % {"shm": channel == "shm"})
+        mux = Mux(os.path.join(workdir, "apps"))
+        if channel == "shm":
+            mux.ring_sizes["producer.py"] = 4 << 20
+        app = mux.start_app("producer.py")
+        received = 0
+        cpu_start = time.process_time()
+        end = time.perf_counter() + duration
+        while time.perf_counter() < end:
+            mux.poll()
+            received += len(app.buffer)
+            app.buffer.clear()
+            time.sleep(0.001)
+        cpu = time.process_time() - cpu_start
+        mux.stop_app("producer.py")
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+    return received / duration, cpu / max(received / 1e6, 1e-9)
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=HERE,
+                              capture_output=True, text=True, timeout=5).stdout.strip() or None
+    except Exception:
+        return None
+
+
+def compare(old, new):
+    """Print a table of new results against an older run."""
+    print(f"{'benchmark':28} {'old':>14} {'new':>14} {'change':>9}")
+    for name, result in new["results"].items():
+        before = old["results"].get(name, {}).get("value")
+        after = result.get("value")
+        change = ""
+        if before and after is not None:
+            change = f"{(after - before) / before * 100:+.1f}%"
+        fmt = lambda v: "-" if v is None else f"{v:.6g}"
+        print(f"{name:28} {fmt(before):>14} {fmt(after):>14} {change:>9}  {result.get('unit', '')}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("-o", "--output", help="write JSON results here (default: stdout)")
+    parser.add_argument("--compare", help="earlier JSON results to compare against")
+    parser.add_argument("--repeat", type=int, default=30, help="samples per latency benchmark")
+    parser.add_argument("--idle-apps", type=int, default=50, help="idle sleepers to start")
+    parser.add_argument("--duration", type=float, default=3.0, help="seconds per CPU/throughput sample")
+    parser.add_argument("--reattach-lines", type=int, default=20000, help="backlog lines for reattach")
+    parser.add_argument("--reattach-wait", type=float, default=2.0, help="seconds to let the backlog build")
+    args = parser.parse_args()
+
+    report = {
+        "meta": {
+            "commit": git_commit(),
+            "time": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+            "python": platform.python_version(),
+            "machine": platform.machine(),
+            "cpus": os.cpu_count(),
+            "args": vars(args),
+        },
+        "results": run_benchmarks(args),
+    }
+    text = json.dumps(report, indent=4)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+    if args.compare:
+        with open(args.compare) as f:
+            compare(json.load(f), report)
+
+
+if __name__ == "__main__":
+    main()
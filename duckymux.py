@@ -0,0 +1,1901 @@
+"""Duckymux core: runs apps on their own ptys and collects their output.
+
+Each app is an App record in Mux.table. main.py's curses UI calls
+start_pipeline() so worker threads read and buffer the ptys, and then only
+collects their results with poll() once per loop. Without the pipeline poll()
+does the reading itself. Anything else can embed it through the asyncio API,
+which uses the event loop's fd readers instead of polling:
+
+    mux = Mux("apps")
+    await mux.start("echo.py")
+    await mux.write("echo.py", b"hello\\n")
+    async for chunk in mux.output("echo.py"):
+        ...
+    await mux.stop("echo.py")
+
+Every app runs in a session of its own with its pty as the controlling
+terminal, so signals (stop, freeze, kill, SIGWINCH, ^C typed into it) reach
+the helpers it starts too, and usage() adds up the whole session.
+"""
+# asyncio, subprocess, py_compile, ctypes, ast and the pty modules (pty, fcntl, termios)
+# are imported where they're first needed, so importing this module stays cheap for
+# the first frame of the UI. selectors and threading are needed by Mux() itself, and
+# logging has imported threading already anyway.
+import codecs
+import errno
+import json
+import logging
+import os
+import queue
+import selectors
+import signal
+import struct
+import threading
+import time
+
+
+class Histogram:
+    """Latency histogram with power-of-two microsecond buckets.
+
+    add() is a couple of integer ops so it can sit on the hot path."""
+    __slots__ = ("buckets", "count", "total", "max")
+
+    def __init__(self):
+        self.buckets = [0] * 32
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def add(self, seconds):
+        self.buckets[min(int(seconds * 1000000).bit_length(), 31)] += 1
+        self.count += 1
+        self.total += seconds
+        if seconds > self.max:
+            self.max = seconds
+
+    def percentile(self, p):
+        """Upper bound of the bucket holding the p-th percentile, in seconds."""
+        if not self.count:
+            return 0.0
+        target = self.count * p / 100
+        seen = 0
+        for i, n in enumerate(self.buckets):
+            seen += n
+            if seen >= target:
+                return min((1 << i) / 1000000, self.max)
+        return self.max
+
+    def to_dict(self):
+        return {
+            "count": self.count,
+            "mean": self.total / self.count if self.count else 0.0,
+            "p50": self.percentile(50),
+            "p95": self.percentile(95),
+            "p99": self.percentile(99),
+            "max": self.max,
+            "buckets_us": {str(1 << i): n for i, n in enumerate(self.buckets) if n},
+        }
+
+
+def log_event(event, level=logging.INFO, **fields):
+    """Log a structured event, e.g. log_event("app_exit", app="echo.py", code=0)."""
+    logger = logging.getLogger()
+    if logger.isEnabledFor(level):
+        logger.log(level, event, extra={"event": event, "fields": fields})
+
+
+class Recorder:
+    """Tees output streams into asciicast v2 files, one per stream, in one directory.
+
+    write() only queues the chunk; a background thread encodes it and writes it
+    through a buffered file, so recording costs the reading threads a queue put.
+    Every file shares the recorder's start time, so their timestamps line up."""
+
+    def __init__(self, directory, width=80, height=24):
+        self.directory = directory
+        self.width = width
+        self.height = height
+        self.start = time.time()
+        self._t0 = time.monotonic()
+        self._queue = queue.SimpleQueue()
+        self._files = {}  # stream -> (file, incremental utf-8 decoder)
+        os.makedirs(directory, exist_ok=True)
+        self._thread = threading.Thread(target=self._writer, name="duckymux-recorder", daemon=True)
+        self._thread.start()
+
+    def write(self, stream, data):
+        self._queue.put((stream, time.monotonic() - self._t0, bytes(data)))
+
+    def close(self):
+        self._queue.put(None)
+        self._thread.join()
+
+    def _open(self, stream):
+        f = open(os.path.join(self.directory, f"{stream}.cast"), "w", encoding="utf-8", buffering=65536)
+        f.write(json.dumps({"version": 2, "width": self.width, "height": self.height,
+                            "timestamp": int(self.start), "title": stream}) + "\n")
+        entry = self._files[stream] = (f, codecs.getincrementaldecoder("utf-8")("replace"))
+        return entry
+
+    def _writer(self):
+        while True:
+            try:
+                item = self._queue.get(timeout=1.0)
+            except queue.Empty:
+                for f, _ in self._files.values():
+                    f.flush()
+                continue
+            if item is None:
+                break
+            stream, t, data = item
+            f, decoder = self._files.get(stream) or self._open(stream)
+            text = decoder.decode(data)
+            if text:
+                f.write(json.dumps([round(t, 6), "o", text]) + "\n")
+        for f, _ in self._files.values():
+            f.close()
+
+
+def _label(value):
+    return str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+
+class MetricsExporter:
+    """Writes the Mux's state to an OpenMetrics textfile, for node_exporter's textfile collector.
+
+    A background thread renders the metrics every `interval` seconds and only
+    rewrites the file when they changed, through a temporary file and a rename
+    so a scrape never sees half of it. `histograms` is a function returning
+    {name: Histogram} to export besides the Mux's own, e.g. the UI loop's."""
+
+    def __init__(self, mux, path, interval=15.0, histograms=None):
+        self.mux = mux
+        self.path = path
+        self.interval = interval
+        self.histograms = histograms or (lambda: mux.metrics)
+        self.writes = 0
+        self._last = None
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._exporter, name="duckymux-metrics", daemon=True)
+        self._thread.start()
+
+    def close(self):
+        """Stop the thread after one last write, so the file shows what was left running."""
+        self._stop.set()
+        self._thread.join()
+
+    def render(self):
+        lines = []
+
+        def family(name, kind, text, samples):
+            lines.append(f"# HELP {name} {text}")
+            lines.append(f"# TYPE {name} {kind}")
+            suffix = "_total" if kind == "counter" else ""
+            for app, value in samples:
+                lines.append(f'{name}{suffix}{{app="{_label(app.name)}"}} {value}')
+
+        now = time.monotonic()
+        wall = time.time()
+        apps = self.mux.all_apps()
+        usage = {app: self.mux.usage(app) for app in apps if app.state == RUNNING}
+        family("duckymux_app_up", "gauge", "Whether the app is running.",
+               [(app, int(app.state == RUNNING)) for app in apps])
+        family("duckymux_app_frozen", "gauge", "Whether the app is stopped with SIGSTOP.",
+               [(app, int(app.frozen)) for app in apps if app.state == RUNNING])
+        family("duckymux_app_healthy", "gauge", "0 while a liveness probe finds the app hung.",
+               [(app, int(app.health in (None, "ok"))) for app in apps if app.state == RUNNING])
+        family("duckymux_app_starts", "counter", "Times the app was started.",
+               [(app, app.starts) for app in apps])
+        family("duckymux_app_exit_code", "gauge", "Exit code of the app's last run (negative: killed by that signal).",
+               [(app, app.returncode) for app in apps if app.state != RUNNING and app.returncode is not None])
+        family("duckymux_app_cpu_seconds", "gauge", "CPU time of the processes in the app's session.",
+               [(app, round(u["cpu"], 2)) for app, u in usage.items() if u])
+        family("duckymux_app_resident_bytes", "gauge", "Resident memory of the processes in the app's session.",
+               [(app, u["rss_kb"] * 1024) for app, u in usage.items() if u])
+        family("duckymux_app_processes", "gauge", "Processes in the app's session.",
+               [(app, len(u["pids"])) for app, u in usage.items() if u])
+        family("duckymux_app_read_bytes", "counter", "Bytes of output read from the app.",
+               [(app, app.bytes_read) for app in apps])
+        family("duckymux_app_reads", "counter", "Reads of the app's output.",
+               [(app, app.reads) for app in apps])
+        family("duckymux_app_last_output_timestamp_seconds", "gauge", "When the app last printed (or started).",
+               [(app, round(wall - (now - app.last_output), 3)) for app in apps if app.state == RUNNING])
+        for name, h in dict(self.histograms(), **self.mux.metrics).items():
+            name = f"duckymux_{name}_seconds"
+            lines.append(f"# HELP {name} Duckymux latency histogram.")
+            lines.append(f"# TYPE {name} histogram")
+            seen = 0
+            for i, n in enumerate(h.buckets[:31]):
+                seen += n
+                lines.append(f'{name}_bucket{{le="{(1 << i) / 1000000}"}} {seen}')
+            lines.append(f'{name}_bucket{{le="+Inf"}} {h.count}')
+            lines.append(f"{name}_count {h.count}")
+            lines.append(f"{name}_sum {h.total}")
+        lines.append("# EOF\n")
+        return "\n".join(lines)
+
+    def write(self):
+        """Render the metrics and replace the file if they changed. Returns True if it wrote."""
+        text = self.render()
+        if text == self._last:
+            return False
+        tmp = f"{self.path}.{os.getpid()}.tmp"  # not *.prom, so the collector skips it
+        try:
+            with open(tmp, "w") as f:
+                f.write(text)
+            os.replace(tmp, self.path)
+        except OSError as e:
+            log_event("metrics_write_failed", level=logging.ERROR, path=self.path, error=str(e))
+            return False
+        self._last = text
+        self.writes += 1
+        return True
+
+    def _exporter(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self.write()
+            except Exception as e:  # an app table changing under us; try again next time
+                log_event("metrics_failed", level=logging.WARNING, error=str(e))
+        try:
+            self.write()
+        except Exception:
+            pass
+
+
+def read_cast(path):
+    """Load an asciicast v2 file. Returns (header, [(time, bytes), ...]) for its output events."""
+    events = []
+    with open(path, encoding="utf-8") as f:
+        header = json.loads(f.readline())
+        for line in f:
+            if not line.strip():
+                continue
+            t, kind, text = json.loads(line)
+            if kind == "o":
+                events.append((t, text.encode("utf-8")))
+    return header, events
+
+
+class Timer:
+    __slots__ = ("tick", "callback", "args")
+
+    def __init__(self, tick, callback, args):
+        self.tick = tick
+        self.callback = callback
+        self.args = args
+
+    def cancel(self):
+        self.callback = None
+
+
+class TimerWheel:
+    """Many timers, one check per tick.
+
+    A stack of wheels: the first has a slot per tick, each one above a slot
+    per lap of the one below (6.4s, 6.8min, 7.3h and 19.4 days with the
+    defaults). A timer goes into the lowest wheel whose lap reaches the tick
+    it's due at and drops a wheel whenever the clock reaches its slot there,
+    so advance() only touches the timers that are due or dropping, however
+    many are waiting and however far out, and skips the stretches of ticks
+    where nothing can happen (a long sleep costs a few steps, not one a tick).
+    Timers past the top wheel's lap wait there and get re-filed each lap."""
+
+    def __init__(self, tick=0.1, slots=64, levels=4):
+        self.tick = tick
+        self.wheels = [[[] for _ in range(slots)] for _ in range(levels)]
+        self.spans = [slots ** level for level in range(levels)]  # ticks per slot of each wheel
+        self.current = int(time.monotonic() / tick)
+        self.filed = [0] * levels  # timers in each wheel, cancelled ones until their slot comes round
+        self.count = 0  # all of them
+
+    def schedule(self, delay, callback, *args):
+        """Call callback(*args) from advance() once delay seconds have passed. Returns a Timer."""
+        tick = max(self.current + 1, int((time.monotonic() + delay) / self.tick + 0.999999))
+        timer = Timer(tick, callback, args)
+        self._file(timer)
+        self.count += 1
+        return timer
+
+    def _file(self, timer):
+        delta = timer.tick - self.current
+        level = 0
+        while level + 1 < len(self.wheels) and delta >= self.spans[level + 1]:
+            level += 1
+        wheel = self.wheels[level]
+        wheel[timer.tick // self.spans[level] % len(wheel)].append(timer)
+        self.filed[level] += 1
+
+    def advance(self, now=None):
+        """Run every timer that's due. Returns how many ran."""
+        target = int((time.monotonic() if now is None else now) / self.tick)
+        if target <= self.current:
+            return 0
+        ran = 0
+        slots = len(self.wheels[0])
+        while self.current < target:
+            if not self.count:
+                self.current = target
+                break
+            level = 0
+            while not self.filed[level]:
+                level += 1
+            if level:
+                # Nothing happens in the wheels below until this one's next slot.
+                span = self.spans[level]
+                self.current = min(target, (self.current // span + 1) * span - 1)
+                if self.current == target:
+                    break
+            self.current += 1
+            tick = self.current
+            for level in range(1, len(self.wheels)):
+                span = self.spans[level]
+                if tick % span:
+                    break
+                slot = self.wheels[level][tick // span % slots]
+                if slot:
+                    dropping = slot[:]
+                    slot.clear()
+                    self.filed[level] -= len(dropping)
+                    for timer in dropping:
+                        if timer.callback is None:
+                            self.count -= 1
+                        else:
+                            self._file(timer)
+            slot = self.wheels[0][tick % slots]
+            if slot:
+                due = slot[:]
+                slot.clear()
+                self.filed[0] -= len(due)
+                self.count -= len(due)
+                for timer in due:
+                    if timer.callback is not None:
+                        timer.callback(*timer.args)
+                        ran += 1
+        return ran
+
+
+class Cron:
+    """A five-field cron schedule, "minute hour day-of-month month day-of-week".
+
+    Fields take *, numbers, ranges (1-5), lists (1,15) and steps (*/10, 8-18/2);
+    weekdays count from 0 = Sunday (7 is Sunday too). As in cron, when both
+    day fields are restricted a day matching either one will do.
+    Raises ValueError for anything else."""
+    __slots__ = ("minutes", "hours", "days", "months", "weekdays", "any_day", "any_weekday")
+
+    FIELDS = ((0, 59), (0, 23), (1, 31), (1, 12), (0, 7))
+
+    def __init__(self, expr):
+        fields = expr.split()
+        if len(fields) != 5:
+            raise ValueError(f"cron expression needs 5 fields: {expr!r}")
+        sets = []
+        for field, (low, high) in zip(fields, self.FIELDS):
+            values = set()
+            for part in field.split(","):
+                span, slash, step = part.partition("/")
+                try:
+                    step = int(step) if slash else 1
+                    if span == "*":
+                        start, end = low, high
+                    elif "-" in span:
+                        start, end = (int(value) for value in span.split("-", 1))
+                    else:
+                        start = int(span)
+                        end = high if slash else start
+                except ValueError:
+                    raise ValueError(f"bad cron field {field!r} in {expr!r}") from None
+                if not low <= start <= end <= high or step < 1:
+                    raise ValueError(f"cron field {field!r} out of range {low}-{high} in {expr!r}")
+                values.update(range(start, end + 1, step))
+            sets.append(values)
+        self.minutes, self.hours, self.days, self.months, weekdays = sets
+        self.weekdays = {day % 7 for day in weekdays}
+        self.any_day = fields[2] == "*"
+        self.any_weekday = fields[4] == "*"
+
+    def _day_matches(self, t):
+        day = t.day in self.days
+        weekday = t.isoweekday() % 7 in self.weekdays
+        if self.any_day or self.any_weekday:
+            return day and weekday
+        return day or weekday
+
+    def next_after(self, when):
+        """The unix time of the first matching minute after `when`, in local time,
+        or None if there isn't one in the next five years (e.g. "0 0 30 2 *")."""
+        import datetime
+        minute = datetime.timedelta(minutes=1)
+        t = datetime.datetime.fromtimestamp(when).replace(second=0, microsecond=0) + minute
+        limit = t + datetime.timedelta(days=5 * 366)
+        while t < limit:
+            if t.month not in self.months:
+                t = (t.replace(day=1, hour=0, minute=0) + datetime.timedelta(days=32)).replace(day=1)
+            elif not self._day_matches(t):
+                t = t.replace(hour=0, minute=0) + datetime.timedelta(days=1)
+            elif t.hour not in self.hours:
+                t = t.replace(minute=0) + datetime.timedelta(hours=1)
+            elif t.minute not in self.minutes:
+                t += minute
+            else:
+                return t.timestamp()
+        return None
+
+
+IN_CLOSE_WRITE = 0x8
+IN_MOVED_TO = 0x80
+IN_DELETE = 0x200
+IN_IGNORED = 0x8000
+INOTIFY_EVENT = struct.Struct("iIII")  # wd, mask, cookie, length of the name after it
+
+
+class Watcher:
+    """Which of a set of files changed, for restarting apps when their source does.
+
+    Each key (an app name, say) watches a list of paths. changed() never blocks
+    and returns {key: paths} for what was saved, replaced or deleted since the
+    last call. With inotify that is one read() of the directories' events;
+    without it every file is stat()ed at most every poll_interval seconds.
+    Directories are watched rather than files, so editors that save by writing
+    a new file and renaming it over the old one are seen too."""
+
+    def __init__(self, poll_interval=1.0):
+        self.poll_interval = poll_interval
+        self.paths = {}  # key -> [absolute paths]
+        self._keys = {}  # path -> set of keys watching it
+        self._fd = -1
+        self._libc = None
+        self._dirs = {}  # directory -> inotify watch descriptor
+        self._wds = {}  # watch descriptor -> directory
+        self._stamps = {}  # path -> (mtime_ns, size), without inotify
+        self._next_poll = 0.0
+        try:
+            import ctypes
+            libc = ctypes.CDLL(None, use_errno=True)
+            fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+            if fd < 0:
+                raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+            self._fd, self._libc = fd, libc
+        except (OSError, AttributeError) as e:
+            log_event("inotify_unavailable", level=logging.WARNING, error=str(e))
+
+    @property
+    def inotify(self):
+        return self._fd >= 0
+
+    def watch(self, key, paths):
+        """Watch these paths for key, instead of whatever it watched before."""
+        self.unwatch(key)
+        paths = sorted({os.path.abspath(path) for path in paths})
+        self.paths[key] = paths
+        for path in paths:
+            self._keys.setdefault(path, set()).add(key)
+            self._stamps[path] = self._stamp(path)
+            directory = os.path.dirname(path)
+            if self._fd >= 0 and directory not in self._dirs:
+                wd = self._libc.inotify_add_watch(self._fd, os.fsencode(directory),
+                                                  IN_CLOSE_WRITE | IN_MOVED_TO | IN_DELETE)
+                if wd >= 0:
+                    self._dirs[directory] = wd
+                    self._wds[wd] = directory
+
+    def unwatch(self, key):
+        for path in self.paths.pop(key, ()):
+            keys = self._keys[path]
+            keys.discard(key)
+            if keys:
+                continue
+            del self._keys[path]
+            del self._stamps[path]
+            directory = os.path.dirname(path)
+            if self._fd >= 0 and not any(os.path.dirname(p) == directory for p in self._keys):
+                wd = self._dirs.pop(directory, None)
+                if wd is not None:
+                    self._libc.inotify_rm_watch(self._fd, wd)
+                    self._wds.pop(wd, None)
+
+    def close(self):
+        if self._fd >= 0:
+            os.close(self._fd)
+            self._fd = -1
+
+    def changed(self):
+        paths = self._read_events() if self._fd >= 0 else self._poll_stamps()
+        changed = {}
+        for path in paths:
+            for key in self._keys.get(path, ()):
+                changed.setdefault(key, []).append(path)
+        return changed
+
+    def _read_events(self):
+        paths = set()
+        while True:
+            try:
+                data = os.read(self._fd, 65536)
+            except BlockingIOError:
+                return paths
+            pos = 0
+            while pos < len(data):
+                wd, mask, _, length = INOTIFY_EVENT.unpack_from(data, pos)
+                name = data[pos + INOTIFY_EVENT.size:pos + INOTIFY_EVENT.size + length].rstrip(b"\0")
+                pos += INOTIFY_EVENT.size + length
+                if mask & IN_IGNORED:  # the directory itself went away
+                    self._dirs.pop(self._wds.pop(wd, None), None)
+                    continue
+                directory = self._wds.get(wd)
+                if directory is not None and name:
+                    paths.add(os.path.join(directory, os.fsdecode(name)))
+
+    @staticmethod
+    def _stamp(path):
+        try:
+            st = os.stat(path)
+        except OSError:
+            return None
+        return (st.st_mtime_ns, st.st_size)
+
+    def _poll_stamps(self):
+        now = time.monotonic()
+        if now < self._next_poll:
+            return ()
+        self._next_poll = now + self.poll_interval
+        paths = []
+        for path, stamp in self._stamps.items():
+            new = self._stamp(path)
+            if new != stamp:
+                self._stamps[path] = new
+                paths.append(path)
+        return paths
+
+
+def local_modules(path):
+    """The modules next to a script that it imports, directly or through each other.
+
+    Only plain `import x` / `from x import y` of files in the script's own
+    directory (x.py, or x/ with its __init__.py and x/y.py) count; the rest is
+    installed code that doesn't change while you work on an app."""
+    import ast
+    base = os.path.dirname(os.path.abspath(path))
+    found = []
+    todo = [os.path.abspath(path)]
+    seen = set(todo)
+    while todo:
+        try:
+            with open(todo.pop(), "rb") as f:
+                tree = ast.parse(f.read())
+        except (OSError, SyntaxError, ValueError):
+            continue
+        names = []
+        for node in ast.walk(tree):
+            if isinstance(node, ast.Import):
+                names.extend(alias.name for alias in node.names)
+            elif isinstance(node, ast.ImportFrom) and node.module and not node.level:
+                names.append(node.module)
+                names.extend(f"{node.module}.{alias.name}" for alias in node.names)
+        for name in names:
+            parts = name.split(".")
+            module = os.path.join(base, *parts)
+            # importing a.b runs a/__init__.py too
+            candidates = [module + ".py"] + [os.path.join(base, *parts[:i], "__init__.py")
+                                             for i in range(len(parts), 0, -1)]
+            for candidate in candidates:
+                if candidate not in seen and os.path.isfile(candidate):
+                    seen.add(candidate)
+                    found.append(candidate)
+                    todo.append(candidate)
+    return found
+
+
+STOPPED = 0
+RUNNING = 1
+ORPHAN_GRACE = 2.0  # seconds a process left behind by an exited app gets between SIGTERM and SIGKILL
+
+
+def _append(app, data):
+    app.buffer.extend(data)
+
+
+def read_pty(app, ingest=_append):
+    """Read whatever is waiting on app.fd without blocking and hand it to
+    ingest(app, data), by default onto app.buffer. Mux.read_app() is this with
+    the Mux's bookkeeping; replaying a recording uses it bare.
+
+    Returns False once the pty has hung up."""
+    try:
+        while True:
+            data = os.read(app.fd, 4096)
+            app.reads += 1
+            if not data:
+                return False
+            app.bytes_read += len(data)
+            ingest(app, data)
+    except BlockingIOError:
+        return True
+    except OSError:
+        return False
+
+
+def find_program(name, path=None):
+    """The path of an executable on $PATH (or `path`), or None (shutil.which() costs a lot to import)."""
+    for directory in (path or os.environ.get("PATH", os.defpath)).split(os.pathsep):
+        path = os.path.join(directory, name)
+        if os.access(path, os.X_OK) and not os.path.isdir(path):
+            return path
+    return None
+
+
+class Profile:
+    """How to launch an app: the interpreter and its flags, environment and working directory.
+
+    Everything is looked up when the profile is made (the interpreter on $PATH
+    or in the venv, the merged environment), so starting an app only copies
+    the finished argv. Raises ValueError if the interpreter or directory
+    isn't there."""
+    __slots__ = ("name", "argv", "env", "cwd")
+
+    def __init__(self, name, interpreter=None, flags=(), env=None, cwd=None, venv=None):
+        self.name = name
+        search = None
+        if venv:
+            venv = os.path.abspath(os.path.expanduser(venv))
+            search = os.path.join(venv, "bin")
+            interpreter = interpreter or "python"
+        interpreter = os.path.expanduser(interpreter or "python3")
+        if os.sep in interpreter:
+            found = os.path.abspath(interpreter) if os.access(interpreter, os.X_OK) else None
+        else:
+            found = find_program(interpreter, search)
+        if found is None:
+            raise ValueError(f"profile {name}: no interpreter {interpreter}" + (f" in {search}" if search else ""))
+        self.argv = [found, *flags]
+        self.env = None  # None inherits Duckymux's environment
+        if venv or env:
+            self.env = dict(os.environ)
+            if venv:
+                self.env["VIRTUAL_ENV"] = venv
+                self.env["PATH"] = search + os.pathsep + self.env.get("PATH", os.defpath)
+                self.env.pop("PYTHONHOME", None)
+            self.env.update({key: str(value) for key, value in (env or {}).items()})
+        self.cwd = None
+        if cwd:
+            self.cwd = os.path.abspath(os.path.expanduser(cwd))
+            if not os.path.isdir(self.cwd):
+                raise ValueError(f"profile {name}: no directory {self.cwd}")
+
+    def command(self, path):
+        """The argv that runs the script at path."""
+        return [*self.argv, os.path.abspath(path) if self.cwd else path]
+
+
+def read_sessions():
+    """Resource use per session id, from one pass over /proc.
+
+    Maps session id -> {"pids": [...], "cpu": seconds (including reaped
+    children's), "rss_kb": resident memory, "d_state": whether any process is
+    in uninterruptible sleep}. Only live processes count; zombies are left out."""
+    sessions = {}
+    page_kb = os.sysconf("SC_PAGE_SIZE") // 1024
+    ticks = os.sysconf("SC_CLK_TCK")
+    for entry in os.listdir("/proc"):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f"/proc/{entry}/stat") as f:
+                fields = f.read().rsplit(")", 1)[1].split()
+        except (OSError, IndexError):
+            continue
+        if fields[0] == "Z":
+            continue
+        usage = sessions.setdefault(int(fields[3]), {"pids": [], "cpu": 0.0, "rss_kb": 0, "d_state": False})
+        usage["pids"].append(int(entry))
+        usage["cpu"] += sum(int(field) for field in fields[11:15]) / ticks
+        usage["rss_kb"] += int(fields[21]) * page_kb
+        usage["d_state"] = usage["d_state"] or fields[0] == "D"
+    return sessions
+
+
+class App:
+    """One row of the app table: the script, and its process while it runs."""
+    __slots__ = ("index", "name", "path", "state", "proc", "pid", "fd",
+                 "buffer", "bytes_read", "reads", "returncode", "error", "compiled",
+                 "last_output", "health", "replica", "group", "replicas", "cpus", "frozen",
+                 "started", "last_duration", "profile", "ring", "starts")
+
+    def __init__(self, index, name, path):
+        self.index = index
+        self.name = name
+        self.path = path
+        self.state = STOPPED
+        self.proc = None
+        self.pid = None
+        self.fd = -1
+        self.buffer = None  # bytearray of output while running
+        self.bytes_read = 0
+        self.reads = 0
+        self.returncode = None
+        self.error = None  # compile error, if the script doesn't compile
+        self.compiled = None  # (mtime_ns, size) of the source last compiled
+        self.last_output = 0.0  # time.monotonic() of the last output, or of the start
+        self.health = None  # None if unprobed, "ok", or why a liveness probe failed
+        self.replica = 0  # which instance of the script this is; 0 is the one in Mux.table
+        self.group = None  # for replicas 1..n-1: the App of replica 0
+        self.replicas = []  # for replica 0: the Apps of replicas 1..n-1
+        self.cpus = None  # CPUs to pin the process to, or None for any
+        self.frozen = False  # stopped with SIGSTOP by freeze_app()
+        self.started = 0.0  # time.monotonic() it last started
+        self.last_duration = None  # seconds its last run lasted, once one has ended
+        self.profile = None  # the Profile it's launched with; None for plain python3
+        self.ring = None  # its duckyshm.Ring while it runs with one
+        self.starts = 0  # times it was started
+
+    @property
+    def running(self):
+        return self.state == RUNNING
+
+
+ROUTE_BUFFER = 65536  # bytes a copying route holds for a slow destination before it stops reading
+
+
+def _tty_flags(fd, iflag=0, oflag=0, lflag=0, on=False):
+    """Clear (or, with on, set) termios bits on fd's terminal.
+    Returns the (iflag, oflag, lflag) bits that actually changed."""
+    import termios
+    try:
+        attrs = termios.tcgetattr(fd)
+        changed = []
+        for i, bits in ((0, iflag), (1, oflag), (3, lflag)):
+            was = attrs[i]
+            attrs[i] = was | bits if on else was & ~bits
+            changed.append(was ^ attrs[i])
+        termios.tcsetattr(fd, termios.TCSANOW, attrs)
+    except (termios.error, OSError):
+        return (0, 0, 0)
+    return tuple(changed)
+
+
+class Route:
+    """One app's output fed into another app's terminal, see Mux.add_route().
+
+    While both apps run the route is active and its source's pty belongs to the
+    router thread. Without tee the bytes go pty -> pipe -> pty with os.splice()
+    and never reach Python; with tee (or where splice isn't supported) they are
+    read, appended to the source's buffer and written on.
+
+    Meanwhile both terminals pass the bytes through as they are: the source's
+    without OPOST (which would turn "\n" into "\r\n"), the destination's
+    without ICRNL (which would turn that "\r" into another "\n") and ECHO
+    (which would copy everything routed in to the destination's own output)."""
+    __slots__ = ("src", "dst", "tee", "active", "eof", "full", "spliced", "pipe_r", "pipe_w",
+                 "capacity", "queued", "pending", "bytes", "moves", "stalls", "dropped",
+                 "since", "active_time", "src_flags", "dst_flags")
+
+    def __init__(self, src, dst, tee=False):
+        self.src = src
+        self.dst = dst
+        self.tee = tee
+        self.active = False
+        self.eof = False  # the source hung up; deliver what's left, then stop
+        self.full = False  # the pipe took no more, though under capacity (it counts pages, not bytes)
+        self.spliced = False
+        self.pipe_r = self.pipe_w = -1
+        self.capacity = ROUTE_BUFFER
+        self.queued = 0  # bytes sitting in the pipe, when spliced
+        self.pending = bytearray()  # bytes waiting for the destination, when copying
+        self.bytes = 0  # delivered to the destination
+        self.moves = 0  # splice()/write() calls that delivered them
+        self.stalls = 0  # times the destination fell behind and reading the source stopped
+        self.dropped = 0  # bytes lost because an app stopped with them in flight
+        self.since = None  # time.monotonic() it last became active
+        self.active_time = 0.0  # seconds active before that
+        self.src_flags = self.dst_flags = (0, 0, 0)  # termios bits cleared while active, to set again
+
+    def backlog(self):
+        return self.queued if self.spliced else len(self.pending)
+
+    def room(self):
+        return not self.eof and not self.full and self.backlog() < self.capacity
+
+    def stats(self):
+        seconds = self.active_time + (time.monotonic() - self.since if self.active else 0.0)
+        return {
+            "from": self.src.name,
+            "to": self.dst.name,
+            "tee": self.tee,
+            "active": self.active,
+            "mode": ("splice" if self.spliced else "copy") if self.active else None,
+            "bytes": self.bytes,
+            "bytes_per_sec": self.bytes / seconds if seconds else 0.0,
+            "moves": self.moves,
+            "stalls": self.stalls,
+            "backlog": self.backlog(),
+            "dropped": self.dropped,
+        }
+
+
+class Mux:
+    """The table of apps in one directory, indexed by position, name and pty fd."""
+
+    def __init__(self, apps_dir="apps", index_path=None):
+        self.apps_dir = apps_dir
+        self.index_path = index_path  # where list_apps() may cache the directory listing
+        self.table = [App(i, name, os.path.join(apps_dir, name)) for i, name in enumerate(self.list_apps())]
+        self.by_name = {app.name: app for app in self.table}
+        self.by_fd = {}  # master_fd -> App, running apps only
+        self.metrics = {"spawn": Histogram()}
+        self.recorder = None  # a Recorder to tee every app's output into
+        self.winsize = None  # (rows, cols) every app's pty is set to
+        self._selector = selectors.DefaultSelector()
+        self._next_sweep = 0.0
+        self.lock = threading.Lock()  # held while touching ptys and buffers the pipeline also uses
+        self.changed = set()  # apps that got output between the last two poll() calls
+        self._changed = set()
+        self._pipeline = False
+        self._chunks = None
+        self._hungup = []
+        self._wake_r = self._wake_w = -1
+        self._loop = None
+        self._subscribers = {}  # app_name -> list of asyncio.Queue fed by output()
+        self._exit_waiters = {}  # app_name -> list of futures resolved with the exit code
+        self._compiling = False
+        self.routes = []  # Routes, in the order they were added
+        self._route_sel = None  # what the router thread waits on, once there are routes
+        self._route_wake_r = self._route_wake_w = -1
+        self._paused = set()  # apps whose output goes to an attached terminal, not their routes
+        self._setsid = None  # the setsid program that gives apps their pty as controlling terminal
+        self._orphans = {}  # pid -> when to SIGKILL it, for processes exited apps left behind
+        self._stopping = {}  # App -> when to SIGKILL it, for stop_app(wait=False)
+        self.exit_hooks = []  # called with each app that exited or was stopped (not by terminate_all())
+        self._sessions = None  # read_sessions() as of _sessions_at, shared by usage() calls
+        self._sessions_at = 0.0
+        self.ring_sizes = {}  # app name -> bytes of shared-memory ring to start it with, see duckyshm
+        self._rings = set()  # running apps with a ring
+
+    def list_apps(self):
+        """The app scripts in apps_dir, sorted.
+
+        With an index_path the list is cached there and only re-read when the
+        directory's mtime (which changes when files are added, removed or
+        renamed) no longer matches."""
+        try:
+            mtime = os.stat(self.apps_dir).st_mtime_ns
+        except FileNotFoundError:
+            return []
+        if self.index_path is not None:
+            try:
+                with open(self.index_path) as f:
+                    index = json.load(f)
+                if index["dir"] == os.path.abspath(self.apps_dir) and index["mtime"] == mtime:
+                    return index["apps"]
+            except Exception:
+                pass
+        try:
+            names = sorted(f for f in os.listdir(self.apps_dir) if f.endswith('.py'))
+        except FileNotFoundError:
+            return []
+        if self.index_path is not None:
+            try:
+                with open(self.index_path, "w") as f:
+                    json.dump({"dir": os.path.abspath(self.apps_dir), "mtime": mtime, "apps": names}, f)
+            except OSError:
+                pass
+        return names
+
+    def app_path(self, app_name):
+        return self.by_name[app_name].path
+
+    def is_running(self, app_name):
+        app = self.by_name.get(app_name)
+        return app is not None and app.state == RUNNING
+
+    def running(self):
+        """The running apps, without walking the whole table."""
+        return list(self.by_fd.values())
+
+    def all_apps(self):
+        """Every App, replicas right after the app they belong to."""
+        return [member for app in self.table for member in (app, *app.replicas)]
+
+    def scale(self, app_name, count, pin=None, start=True, wait=True):
+        """Make an app a set of `count` replicas, each with its own pty and buffer.
+
+        Replica i is named "<app>#i" (replica 0 keeps the plain name) and gets
+        DUCKYMUX_REPLICA=i and DUCKYMUX_REPLICAS=count in its environment.
+        Missing replicas are started (unless start is False), extra ones stopped
+        and dropped; count 0 stops them all. pin=True pins replica i to the
+        i-th allowed CPU, round robin; pin=False unpins; None leaves it as it was.
+        wait is passed on to stop_app().
+        Returns the replicas that are running."""
+        base = self.by_name[app_name]
+        base = base.group or base
+        keep = max(count, 1) - 1
+        for replica in base.replicas[keep:]:
+            if replica.state == RUNNING:
+                self.stop_app(replica.name, wait)
+            del self.by_name[replica.name]
+        del base.replicas[keep:]
+        for i in range(len(base.replicas) + 1, count):
+            replica = App(base.index, f"{base.name}#{i}", base.path)
+            replica.replica = i
+            replica.group = base
+            base.replicas.append(replica)
+            self.by_name[replica.name] = replica
+        members = [base, *base.replicas]
+        if pin is not None:
+            cpus = sorted(os.sched_getaffinity(0))
+            for i, member in enumerate(members):
+                member.cpus = {cpus[i % len(cpus)]} if pin else None
+                if member.state == RUNNING:
+                    try:
+                        os.sched_setaffinity(member.pid, member.cpus or cpus)
+                    except OSError:
+                        pass
+        if count == 0:
+            if base.state == RUNNING:
+                self.stop_app(base.name, wait)
+        elif start:
+            for member in members:
+                if member.state != RUNNING:
+                    self.start_app(member.name)
+        log_event("app_scale", app=base.name, replicas=count,
+                  cpus=[sorted(m.cpus) if m.cpus else None for m in members] if base.cpus else None)
+        return [member for member in members if member.state == RUNNING]
+
+    def set_profile(self, app_name, profile):
+        """Launch an app (and its replicas) with a Profile from its next start on; None for plain python3."""
+        app = self.by_name[app_name]
+        (app.group or app).profile = profile
+
+    def start_app(self, app_name):
+        """Start an app in the background. An app that is already running is left alone.
+
+        Returns its App, or None if it failed to start. An app that doesn't
+        compile is not started."""
+        app = self.by_name[app_name]
+        if app.state == RUNNING:
+            return app
+        source = app.group or app
+        if source.error is not None and self.compile_app(source):
+            log_event("app_start_refused", level=logging.WARNING, app=app_name, error=source.error)
+            return None
+        profile = source.profile
+        command = profile.command(app.path) if profile else ["python3", app.path]
+        env = profile.env if profile else None
+        if source.replicas:
+            env = dict(env or os.environ, DUCKYMUX_REPLICA=str(app.replica), DUCKYMUX_REPLICAS=str(1 + len(source.replicas)))
+        import fcntl
+        import pty
+        import subprocess
+        import termios
+        if self._setsid is None:
+            self._setsid = self._find_setsid()
+            self._become_subreaper()
+        if self._setsid:
+            # setsid(1) starts the session in place (Popen's child isn't a group
+            # leader, so it doesn't fork) and makes the pty on stdin its terminal.
+            args = [self._setsid, "-c", *command]
+        else:
+            args = command
+        ring = None
+        if self.ring_sizes.get(source.name) and self._loop is None:
+            import duckyshm
+            try:
+                ring = duckyshm.Ring.create(self.ring_sizes[source.name])
+            except OSError as e:
+                log_event("ring_failed", level=logging.WARNING, app=app_name, error=str(e))
+            else:
+                env = dict(env or os.environ, **ring.env())
+                # so the app can import duckyshm wherever it runs from
+                here = os.path.dirname(os.path.abspath(__file__))
+                env["PYTHONPATH"] = os.pathsep.join(filter(None, (here, env.get("PYTHONPATH"))))
+        spawn_start = time.perf_counter()
+        try:
+            master_fd, slave_fd = pty.openpty()
+            if self.winsize is not None:
+                fcntl.ioctl(slave_fd, termios.TIOCSWINSZ, struct.pack("HHHH", *self.winsize, 0, 0))
+
+            flags = fcntl.fcntl(master_fd, fcntl.F_GETFL)
+            fcntl.fcntl(master_fd, fcntl.F_SETFL, flags | os.O_NONBLOCK)
+
+            proc = subprocess.Popen(
+                args,
+                stdin=slave_fd,
+                stdout=slave_fd,
+                stderr=slave_fd,
+                close_fds=True,
+                start_new_session=not self._setsid,
+                env=env,
+                cwd=profile.cwd if profile else None,
+                pass_fds=ring.child_fds() if ring else ()
+            )
+
+            os.close(slave_fd)
+        except Exception as e:
+            log_event("app_start_failed", level=logging.ERROR, app=app_name, error=str(e))
+            if ring is not None:
+                ring.close()
+            return None
+        self.metrics["spawn"].add(time.perf_counter() - spawn_start)
+        log_event("app_start", app=app_name, pid=proc.pid, profile=profile.name if profile else None)
+        if app.cpus:
+            try:
+                os.sched_setaffinity(proc.pid, app.cpus)
+            except OSError:
+                pass
+
+        with self.lock:
+            app.state = RUNNING
+            app.proc = proc
+            app.pid = proc.pid
+            app.fd = master_fd
+            app.buffer = bytearray()
+            app.returncode = None
+            app.last_output = time.monotonic()
+            app.health = None
+            app.frozen = False
+            app.started = time.monotonic()
+            app.starts += 1
+            self.by_fd[master_fd] = app
+            if self._loop is not None:
+                self._loop.add_reader(master_fd, self._on_readable, app)
+            else:
+                self._selector.register(master_fd, selectors.EVENT_READ, app)
+            if ring is not None:
+                app.ring = ring
+                self._rings.add(app)
+                self._selector.register(ring.bell_r, selectors.EVENT_READ, app)
+            self._activate_routes(app)
+        self._wake()
+        return app
+
+    def set_winsize(self, rows, cols):
+        """Resize every running app's pty in one pass, and use the size for apps started later."""
+        if self.winsize == (rows, cols):
+            return
+        self.winsize = (rows, cols)
+        running = self.running()
+        if not running:
+            return  # nothing to resize, e.g. before the first frame
+        import fcntl
+        import termios
+        packed = struct.pack("HHHH", rows, cols, 0, 0)
+        for app in running:
+            try:
+                fcntl.ioctl(app.fd, termios.TIOCSWINSZ, packed)
+                if not self._setsid:
+                    # The pty isn't the app's controlling terminal, so the kernel won't tell it.
+                    self.signal_app(app, signal.SIGWINCH)
+            except OSError:
+                pass
+
+    def signal_app(self, app, sig):
+        """Send a signal to the app's whole process group."""
+        try:
+            os.killpg(app.pid, sig)
+        except ProcessLookupError:
+            pass
+        except PermissionError:
+            app.proc.send_signal(sig)  # the app handed its group over to something else
+
+    def stop_app(self, app_name, wait=True):
+        """Terminate an app and its process group, waiting up to 2 seconds before killing them.
+
+        With wait=False this only sends SIGTERM and returns; poll() reports the
+        app among the exited ones once it's gone, and SIGKILLs it after 2 seconds."""
+        app = self.by_name[app_name]
+        proc = app.proc
+        if not wait:
+            if app.state == RUNNING and app not in self._stopping:
+                self.signal_app(app, signal.SIGTERM)
+                if app.frozen:
+                    self.signal_app(app, signal.SIGCONT)
+                self._stopping[app] = time.monotonic() + 2.0
+            return
+        try:
+            self.signal_app(app, signal.SIGTERM)
+            if app.frozen:
+                self.signal_app(app, signal.SIGCONT)
+            proc.wait(timeout=2)
+        except:
+            try:
+                self.signal_app(app, signal.SIGKILL)
+                proc.wait(timeout=1)
+            except:
+                pass
+        self._forget(app)
+        self._exited(app, "app_stop")
+
+    def freeze_app(self, app_name):
+        """SIGSTOP the app's process group, or SIGCONT it if it's frozen. Returns app.frozen."""
+        app = self.by_name[app_name]
+        if app.state != RUNNING:
+            return False
+        app.frozen = not app.frozen
+        self.signal_app(app, signal.SIGSTOP if app.frozen else signal.SIGCONT)
+        log_event("app_freeze" if app.frozen else "app_thaw", app=app_name, pid=app.pid)
+        return app.frozen
+
+    def terminate_all(self):
+        """Send every app's process group SIGTERM and let go of them without waiting."""
+        for app in self.running():
+            self.signal_app(app, signal.SIGTERM)
+            if app.frozen:
+                self.signal_app(app, signal.SIGCONT)
+            self._forget(app)
+
+    def write_app(self, app_name, data):
+        os.write(self.by_name[app_name].fd, data)
+
+    def read_app(self, app):
+        """Move whatever the app has printed into its buffer without blocking.
+
+        Returns False once the pty has hung up."""
+        return read_pty(app, self._ingest)
+
+    def check_exited(self, app):
+        """Forget the app if its process has exited. Returns True if it did."""
+        if app.proc.poll() is None:
+            return False
+        stopped = self._stopping.pop(app, None) is not None
+        self._forget(app)
+        self._exited(app, "app_stop" if stopped else "app_exit")
+        return True
+
+    def _exited(self, app, event):
+        """After _forget(): log the exit, clear up the session and run the exit hooks."""
+        log_event(event, app=app.name, pid=app.pid, code=app.returncode)
+        self._collect_orphans(app)
+        for hook in self.exit_hooks:
+            hook(app)
+
+    # process trees
+
+    def usage(self, app, max_age=0.5):
+        """CPU seconds, resident kB and pids of everything in the app's session.
+
+        Returns a dict like read_sessions()'s, or None if the app isn't running.
+        The /proc scan is shared by calls less than max_age seconds apart."""
+        if app.state != RUNNING:
+            return None
+        now = time.monotonic()
+        if self._sessions is None or now - self._sessions_at > max_age:
+            self._sessions = read_sessions()
+            self._sessions_at = now
+        return self._sessions.get(app.pid)
+
+    def _find_setsid(self):
+        """The setsid program, if it can make the pty on stdin the controlling
+        terminal, else "" (apps then get a session without one). util-linux and
+        busybox both spell that -c; whatever is on $PATH is tried once, on a pty."""
+        import pty
+        import subprocess
+        setsid = find_program("setsid")
+        if not setsid:
+            return ""
+        master_fd, slave_fd = pty.openpty()
+        try:
+            works = subprocess.run([setsid, "-c", "true"], stdin=slave_fd, stdout=slave_fd, stderr=slave_fd,
+                                   close_fds=True, timeout=5).returncode == 0
+        except (OSError, subprocess.SubprocessError):
+            works = False
+        finally:
+            os.close(slave_fd)
+            os.close(master_fd)
+        if not works:
+            log_event("setsid_unusable", level=logging.WARNING, path=setsid)
+            return ""
+        return setsid
+
+    def _become_subreaper(self):
+        """Have orphaned descendants of apps reparent to Duckymux instead of init, so
+        they can be reaped (see _reap_orphans()) rather than outlive their app unseen."""
+        try:
+            import ctypes
+            libc = ctypes.CDLL(None, use_errno=True)
+            if libc.prctl(36, 1, 0, 0, 0) != 0:  # PR_SET_CHILD_SUBREAPER
+                raise OSError(ctypes.get_errno(), "prctl(PR_SET_CHILD_SUBREAPER) failed")
+        except (OSError, AttributeError) as e:
+            log_event("subreaper_failed", level=logging.WARNING, error=str(e))
+
+    def _collect_orphans(self, app):
+        """SIGTERM whatever is left of an exited app's session, and SIGKILL it
+        ORPHAN_GRACE seconds later if it's still there."""
+        pids = read_sessions().get(app.pid, {}).get("pids", [])
+        if not pids:
+            return
+        log_event("app_orphans", level=logging.WARNING, app=app.name, pid=app.pid, orphans=pids)
+        deadline = time.monotonic() + ORPHAN_GRACE
+        for pid in pids:
+            try:
+                os.kill(pid, signal.SIGTERM)
+                os.kill(pid, signal.SIGCONT)
+            except OSError:
+                continue
+            self._orphans[pid] = deadline
+
+    def _reap_orphans(self):
+        """Kill orphans past their grace period and reap the ones that reparented to us."""
+        now = time.monotonic()
+        for pid, deadline in list(self._orphans.items()):
+            try:
+                if now >= deadline:
+                    os.kill(pid, signal.SIGKILL)
+                    del self._orphans[pid]
+                else:
+                    os.kill(pid, 0)
+            except OSError:
+                del self._orphans[pid]
+        # Only waitpid() children from other sessions that aren't app processes,
+        # so subprocess still gets the exit codes of everything it started. So
+        # whatever Duckymux runs besides apps stays in its session: a process
+        # group of its own (process_group=0) is fine, start_new_session isn't.
+        own_sid = os.getsid(0)
+        app_pids = {app.pid for app in self.running()}
+        while True:
+            try:
+                info = os.waitid(os.P_ALL, 0, os.WEXITED | os.WNOHANG | os.WNOWAIT)
+            except ChildProcessError:
+                return
+            if info is None or info.si_pid in app_pids:
+                return
+            try:
+                with open(f"/proc/{info.si_pid}/stat") as f:
+                    sid = int(f.read().rsplit(")", 1)[1].split()[3])
+            except (OSError, IndexError, ValueError):
+                return
+            if sid == own_sid:
+                return
+            try:
+                os.waitpid(info.si_pid, os.WNOHANG)
+            except ChildProcessError:
+                return
+            self._orphans.pop(info.si_pid, None)
+            log_event("orphan_reaped", pid=info.si_pid, code=info.si_status)
+
+    def poll(self):
+        """Read the apps that have output waiting and reap the ones that exited.
+
+        Only apps whose pty is ready are touched, plus a sweep of every running app
+        once a second for exits the pty can't show (a helper still holding it open).
+        With the pipeline running the reading already happened on the worker
+        threads, and this only picks up what they published.
+        Returns the apps that exited since the last call."""
+        exited = []
+        if self._pipeline:
+            with self.lock:
+                self.changed, self._changed = self._changed, set()
+                hungup, self._hungup = self._hungup, []
+            for app in hungup:
+                if not app.running:
+                    continue
+                if self.check_exited(app):
+                    exited.append(app)
+                else:
+                    self._hungup.append(app)
+        else:
+            with self.lock:
+                self.changed, self._changed = self._changed, set()  # teed by routes
+            for key, _ in self._selector.select(0):
+                app = key.data
+                if app.ring is not None and key.fd == app.ring.bell_r:
+                    continue  # read below with the other rings
+                self.changed.add(app)
+                if not self.read_app(app) and self.check_exited(app):
+                    exited.append(app)
+            for app in list(self._rings):
+                if self._read_ring(app):
+                    self.changed.add(app)
+        now = time.monotonic()
+        for app, kill_at in list(self._stopping.items()):
+            if self.check_exited(app):
+                exited.append(app)
+            elif now >= kill_at:
+                self._stopping[app] = float("inf")
+                self.signal_app(app, signal.SIGKILL)
+        if now >= self._next_sweep:
+            self._next_sweep = now + 1.0
+            for app in self.running():
+                if self.check_exited(app):
+                    exited.append(app)
+            self._reap_orphans()
+        return exited
+
+    def _ingest(self, app, data):
+        app.buffer.extend(data)
+        app.last_output = time.monotonic()
+        if self.recorder is not None:
+            self.recorder.write(app.name, data)
+        for q in self._subscribers.get(app.name, ()):
+            q.put_nowait(data)
+
+    def _read_ring(self, app):
+        """Move what the app put in its ring into its buffer. Returns True if there was any."""
+        data = app.ring.drain()
+        if data:
+            app.reads += 1
+            app.bytes_read += len(data)
+            self._ingest(app, data)
+        return bool(data)
+
+    def _forget(self, app):
+        self._stopping.pop(app, None)
+        with self.lock:
+            if app.state != RUNNING:
+                return
+            if app.ring is not None:
+                data = app.ring.read()  # the last records, written before it exited
+                if data:
+                    self._ingest(app, data)
+                try:
+                    self._selector.unregister(app.ring.bell_r)
+                except KeyError:
+                    pass
+                app.ring.close()
+                app.ring = None
+                self._rings.discard(app)
+            for route in self.routes:
+                if route.src is app or route.dst is app:
+                    self._deactivate(route)
+            del self.by_fd[app.fd]
+            if self._loop is not None:
+                self._loop.remove_reader(app.fd)
+            else:
+                try:
+                    self._selector.unregister(app.fd)
+                except KeyError:
+                    pass  # the reader thread already dropped it on hangup
+            try:
+                os.close(app.fd)
+            except:
+                pass
+            app.state = STOPPED
+            app.last_duration = time.monotonic() - app.started
+            app.fd = -1
+            app.buffer = None
+            app.returncode = app.proc.returncode
+        for q in self._subscribers.pop(app.name, ()):
+            q.put_nowait(None)
+        for fut in self._exit_waiters.pop(app.name, ()):
+            if not fut.done():
+                fut.set_result(app.returncode)
+
+    # precompilation
+
+    def compile_app(self, app):
+        """Byte-compile an app into __pycache__ if its source changed since last time.
+
+        Sets app.error to a one-line description if it doesn't compile.
+        Returns True if app.error is set."""
+        import py_compile
+        try:
+            st = os.stat(app.path)
+        except OSError:
+            return app.error is not None
+        stamp = (st.st_mtime_ns, st.st_size)
+        if stamp == app.compiled:
+            return app.error is not None
+        try:
+            py_compile.compile(app.path, doraise=True,
+                               invalidation_mode=py_compile.PycInvalidationMode.CHECKED_HASH)
+            error = None
+        except py_compile.PyCompileError as e:
+            lineno = getattr(e.exc_value, "lineno", None)
+            error = f"{e.exc_type_name}: {getattr(e.exc_value, 'msg', e.exc_value)}"
+            if lineno:
+                error += f" (line {lineno})"
+        except OSError:
+            error = None  # read-only apps dir: nothing cached, but nothing wrong either
+        app.compiled = stamp
+        if error != app.error:
+            if error is not None:
+                log_event("app_compile_failed", level=logging.WARNING, app=app.name, error=error)
+            elif app.error is not None:
+                log_event("app_compile_fixed", app=app.name)
+            app.error = error
+        return error is not None
+
+    def start_compiler(self, interval=2.0):
+        """Compile every app now and again whenever its source changes, on a thread."""
+        if self._compiling:
+            return
+        self._compiling = True
+        threading.Thread(target=self._compile_worker, args=(interval,),
+                         name="duckymux-compiler", daemon=True).start()
+
+    def stop_compiler(self):
+        self._compiling = False
+
+    def _compile_worker(self, interval):
+        while self._compiling:
+            for app in self.table:
+                if not self._compiling:
+                    return
+                self.compile_app(app)
+            time.sleep(interval)
+
+    # worker-thread pipeline
+
+    def start_pipeline(self, queue_size=256):
+        """Read and buffer app output on worker threads instead of in poll().
+
+        A reader thread waits on every pty at once and hands each chunk through a
+        bounded queue to a processing thread, which appends it to the app's buffer
+        and marks the app in self.changed. If processing falls behind, the queue
+        fills, the reader blocks and the apps block on their full ptys, so a flood
+        costs neither the UI thread nor unbounded memory."""
+        if self._pipeline:
+            return
+        if self._loop is not None:
+            raise RuntimeError("the worker pipeline can't be mixed with the asyncio API")
+        self._chunks = queue.Queue(queue_size)
+        self._wake_r, self._wake_w = os.pipe()
+        os.set_blocking(self._wake_r, False)
+        os.set_blocking(self._wake_w, False)
+        self._selector.register(self._wake_r, selectors.EVENT_READ, None)
+        self._pipeline = True
+        threading.Thread(target=self._read_worker, name="duckymux-reader", daemon=True).start()
+        threading.Thread(target=self._process_worker, name="duckymux-processor", daemon=True).start()
+
+    def stop_pipeline(self):
+        if not self._pipeline:
+            return
+        self._pipeline = False
+        self._wake()
+        self._chunks.put(None)
+
+    def pause_reading(self, app):
+        """Take an app's pty away from the pipeline and its route, e.g. while a terminal is attached.
+
+        Everything read so far is in app.buffer when this returns."""
+        with self.lock:
+            self._paused.add(app)
+            for route in self.routes:
+                if route.src is app:
+                    self._deactivate(route)
+            if self._pipeline:
+                try:
+                    self._selector.unregister(app.fd)
+                except KeyError:
+                    pass
+        if self._pipeline:
+            self._chunks.join()
+
+    def resume_reading(self, app):
+        with self.lock:
+            self._paused.discard(app)
+            if self._pipeline and app.state == RUNNING:
+                try:
+                    self._selector.register(app.fd, selectors.EVENT_READ, app)
+                except KeyError:
+                    pass
+            self._activate_routes(app)
+        self._wake()
+        self._wake_router()
+
+    def _wake(self):
+        if self._wake_w >= 0:
+            try:
+                os.write(self._wake_w, b"x")
+            except BlockingIOError:
+                pass
+
+    def _read_worker(self):
+        while self._pipeline:
+            # Apps with a ring only ring its doorbell when the reader is idle, so
+            # while there are rings the reader looks at them every 50ms too.
+            for key, _ in self._selector.select(0.05 if self._rings else None):
+                app = key.data
+                if app is None:
+                    try:
+                        os.read(self._wake_r, 4096)
+                    except BlockingIOError:
+                        pass
+                    continue
+                if app.ring is not None and key.fd == app.ring.bell_r:
+                    continue  # read below with the other rings
+                with self.lock:
+                    if app.state != RUNNING or app.fd != key.fd or key.fd not in self._selector.get_map():
+                        continue  # stopped, or handed to an attached terminal or a route meanwhile
+                    try:
+                        data = os.read(key.fd, 65536)
+                    except BlockingIOError:
+                        continue
+                    except OSError:
+                        data = b""
+                    if not data:
+                        self._selector.unregister(key.fd)
+                    proc = app.proc
+                self._chunks.put((app, proc, data))
+            if self._rings:
+                with self.lock:
+                    drained = [(app, app.proc, app.ring.drain()) for app in list(self._rings)]
+                for item in drained:  # not under the lock: a full queue waits on the processor, which takes it
+                    if item[2]:
+                        self._chunks.put(item)
+
+    def _process_worker(self):
+        while True:
+            item = self._chunks.get()
+            if item is None:
+                self._chunks.task_done()
+                return
+            app, proc, data = item
+            with self.lock:
+                if app.proc is proc and app.state == RUNNING:
+                    if data:
+                        app.reads += 1
+                        app.bytes_read += len(data)
+                        self._ingest(app, data)
+                        self._changed.add(app)
+                    else:
+                        self._hungup.append(app)
+            self._chunks.task_done()
+
+    # app-to-app routes
+
+    def add_route(self, src_name, dst_name, tee=False):
+        """Feed everything src prints into dst's terminal, as if it were typed there.
+
+        The route carries bytes whenever both apps run; meanwhile src's output
+        only reaches its own buffer if tee is True. When dst reads slower than
+        src prints, the route stops reading src once ROUTE_BUFFER bytes (or a
+        pipe's worth) are waiting, and src blocks on its full pty. An app's output
+        feeds one route; adding a route for the same pair replaces it.
+        Returns the Route. Raises KeyError or ValueError for a bad route."""
+        src, dst = self.by_name[src_name], self.by_name[dst_name]
+        if src is dst:
+            raise ValueError(f"{src_name} can't be routed to itself")
+        if self._loop is not None:
+            raise RuntimeError("routes can't be mixed with the asyncio API")
+        for route in self.routes:
+            if route.src is src and route.dst is not dst:
+                raise ValueError(f"{src_name} is already routed to {route.dst.name}")
+        self.remove_route(src_name, dst_name)
+        route = Route(src, dst, tee)
+        if self._route_sel is None:
+            self._route_sel = selectors.DefaultSelector()
+            self._route_wake_r, self._route_wake_w = os.pipe()
+            os.set_blocking(self._route_wake_r, False)
+            os.set_blocking(self._route_wake_w, False)
+            self._route_sel.register(self._route_wake_r, selectors.EVENT_READ)
+            threading.Thread(target=self._route_worker, name="duckymux-router", daemon=True).start()
+        with self.lock:
+            self.routes.append(route)
+            self._activate(route)
+        self._wake_router()
+        log_event("route_add", src=src_name, dst=dst_name, tee=tee)
+        return route
+
+    def remove_route(self, src_name, dst_name):
+        """Stop feeding src into dst. Returns the Route, or None if there was none."""
+        with self.lock:
+            for route in self.routes:
+                if route.src.name == src_name and route.dst.name == dst_name:
+                    self._deactivate(route)
+                    self.routes.remove(route)
+                    break
+            else:
+                return None
+        self._wake_router()
+        log_event("route_del", src=src_name, dst=dst_name, bytes=route.bytes, dropped=route.dropped)
+        return route
+
+    def _activate_routes(self, app):
+        for route in self.routes:
+            if route.src is app or route.dst is app:
+                self._activate(route)
+
+    def _activate(self, route):
+        """Hand a route's source pty to the router thread, if both ends run. Needs self.lock."""
+        import fcntl
+        import termios
+        src, dst = route.src, route.dst
+        if route.active or src.state != RUNNING or dst.state != RUNNING or src in self._paused:
+            return
+        try:
+            self._selector.unregister(src.fd)
+        except KeyError:
+            pass
+        route.spliced = not route.tee and hasattr(os, "splice")
+        if route.spliced:
+            route.pipe_r, route.pipe_w = os.pipe()
+            os.set_blocking(route.pipe_r, False)
+            os.set_blocking(route.pipe_w, False)
+            try:
+                route.capacity = fcntl.fcntl(route.pipe_w, fcntl.F_GETPIPE_SZ)
+            except (AttributeError, OSError):
+                route.capacity = ROUTE_BUFFER
+        else:
+            route.capacity = ROUTE_BUFFER
+        route.queued = 0
+        route.pending = bytearray()
+        route.eof = route.full = False
+        route.src_flags = _tty_flags(src.fd, oflag=termios.OPOST)
+        route.dst_flags = _tty_flags(dst.fd, iflag=termios.ICRNL, lflag=termios.ECHO)
+        route.active = True
+        route.since = time.monotonic()
+        self._route_watch(src.fd)
+        self._route_watch(dst.fd)
+
+    def _deactivate(self, route):
+        """Take a route's source pty back to the normal readers. Needs self.lock."""
+        if not route.active:
+            return
+        route.active = False
+        route.active_time += time.monotonic() - route.since
+        route.dropped += route.backlog()
+        self._close_route_pipe(route)
+        route.queued = 0
+        route.pending = bytearray()
+        for other in self.routes:
+            if other.active and other.dst is route.dst:
+                # it still needs them cleared; it sets them again when it stops
+                other.dst_flags = tuple(a | b for a, b in zip(other.dst_flags, route.dst_flags))
+                route.dst_flags = (0, 0, 0)
+        _tty_flags(route.src.fd, *route.src_flags, on=True)
+        _tty_flags(route.dst.fd, *route.dst_flags, on=True)
+        route.src_flags = route.dst_flags = (0, 0, 0)
+        self._route_watch(route.src.fd)
+        self._route_watch(route.dst.fd)
+        src = route.src
+        if src.state == RUNNING and src not in self._paused:
+            try:
+                self._selector.register(src.fd, selectors.EVENT_READ, src)
+            except KeyError:
+                pass
+            self._wake()
+            self._next_sweep = 0.0  # it may have hung up, which the readers notice
+
+    def _close_route_pipe(self, route):
+        for fd in (route.pipe_r, route.pipe_w):
+            if fd >= 0:
+                os.close(fd)
+        route.pipe_r = route.pipe_w = -1
+        route.spliced = False
+
+    def _route_watch(self, fd):
+        """Wait for whatever the active routes need from fd: reading a source with
+        room, writing a destination with a backlog. Needs self.lock."""
+        events = 0
+        for route in self.routes:
+            if not route.active:
+                continue
+            if route.src.fd == fd and route.room():
+                events |= selectors.EVENT_READ
+            if route.dst.fd == fd and route.backlog():
+                events |= selectors.EVENT_WRITE
+        try:
+            if not events:
+                self._route_sel.unregister(fd)
+            elif fd in self._route_sel.get_map():
+                self._route_sel.modify(fd, events)
+            else:
+                self._route_sel.register(fd, events)
+        except (KeyError, ValueError):
+            pass
+
+    def _wake_router(self):
+        if self._route_wake_w >= 0:
+            try:
+                os.write(self._route_wake_w, b"x")
+            except BlockingIOError:
+                pass
+
+    def _route_worker(self):
+        while True:
+            ready = self._route_sel.select()
+            with self.lock:
+                touched = set()
+                for key, mask in ready:
+                    if key.fd == self._route_wake_r:
+                        try:
+                            os.read(self._route_wake_r, 4096)
+                        except BlockingIOError:
+                            pass
+                        continue
+                    for route in self.routes:
+                        if route.active and mask & selectors.EVENT_READ and route.src.fd == key.fd:
+                            self._route_pull(route)
+                            touched.add(route)
+                        if route.active and mask & selectors.EVENT_WRITE and route.dst.fd == key.fd:
+                            self._route_push(route)
+                            touched.add(route)
+                for route in touched:
+                    if route.active and route.eof and not route.backlog():
+                        self._deactivate(route)
+                    elif route.active:
+                        self._route_watch(route.src.fd)
+                        self._route_watch(route.dst.fd)
+
+    def _route_pull(self, route):
+        """Take what the source printed into the pipe or the pending bytes."""
+        src = route.src
+        if route.spliced:
+            try:
+                n = os.splice(src.fd, route.pipe_w, route.capacity - route.queued,
+                              flags=os.SPLICE_F_MOVE | os.SPLICE_F_NONBLOCK)
+            except BlockingIOError:
+                if route.queued:
+                    route.full = True
+                    route.stalls += 1
+                return
+            except OSError as e:
+                if e.errno == errno.EINVAL:
+                    # this kernel can't splice from a pty; copy instead
+                    leftover = os.read(route.pipe_r, route.queued) if route.queued else b""
+                    self._close_route_pipe(route)
+                    route.capacity = ROUTE_BUFFER
+                    route.pending = bytearray(leftover)
+                    route.queued = 0
+                    log_event("route_copying", src=src.name, dst=route.dst.name, error=str(e))
+                    return
+                n = 0
+            if not n:
+                route.eof = True
+                return
+            route.queued += n
+            src.last_output = time.monotonic()
+            if not route.room():
+                route.stalls += 1
+            return
+        try:
+            data = os.read(src.fd, route.capacity - len(route.pending))
+        except BlockingIOError:
+            return
+        except OSError:
+            data = b""
+        if not data:
+            route.eof = True
+            return
+        if route.tee:
+            src.reads += 1
+            src.bytes_read += len(data)
+            self._ingest(src, data)
+            self._changed.add(src)
+        else:
+            src.last_output = time.monotonic()
+        route.pending.extend(data)
+        if not route.room():
+            route.stalls += 1
+
+    def _route_push(self, route):
+        """Hand as much of the backlog to the destination as it takes."""
+        try:
+            if route.spliced:
+                n = os.splice(route.pipe_r, route.dst.fd, route.queued, flags=os.SPLICE_F_NONBLOCK)
+                route.queued -= n
+                route.full = False
+            else:
+                n = os.write(route.dst.fd, route.pending)
+                del route.pending[:n]
+        except BlockingIOError:
+            return
+        except OSError:
+            self._deactivate(route)  # the destination hung up
+            return
+        route.bytes += n
+        route.moves += 1
+
+    # asyncio API
+
+    def _attach_loop(self):
+        import asyncio
+        loop = asyncio.get_running_loop()
+        if self._loop is loop:
+            return
+        if self._pipeline:
+            raise RuntimeError("the asyncio API can't be mixed with the worker pipeline")
+        if self.routes:
+            raise RuntimeError("the asyncio API can't be mixed with routes")
+        if self._rings:
+            raise RuntimeError("the asyncio API can't be mixed with shared-memory rings")
+        for app in self.running():
+            if self._loop is None:
+                self._selector.unregister(app.fd)
+            loop.add_reader(app.fd, self._on_readable, app)
+        self._loop = loop
+
+    def _on_readable(self, app):
+        if app.state != RUNNING:
+            return
+        try:
+            data = os.read(app.fd, 65536)
+        except BlockingIOError:
+            return
+        except OSError:
+            data = b""
+        if data:
+            app.bytes_read += len(data)
+            app.reads += 1
+            self._ingest(app, data)
+            return
+        # EOF/EIO: nothing holds the pty open any more, so the app is on its way out.
+        self._loop.remove_reader(app.fd)
+        self._reap_soon(app, app.proc)
+
+    def _reap_soon(self, app, proc):
+        if app.proc is not proc or app.state != RUNNING:
+            return
+        if not self.check_exited(app):
+            self._loop.call_later(0.05, self._reap_soon, app, proc)
+
+    async def start(self, app_name):
+        """Start an app and return its pid. Raises RuntimeError if it can't be started."""
+        self._attach_loop()
+        app = self.start_app(app_name)
+        if app is None:
+            raise RuntimeError(f"could not start {app_name}")
+        return app.pid
+
+    async def write(self, app_name, data):
+        """Write data to the app's terminal, waiting for room instead of blocking."""
+        self._attach_loop()
+        master_fd = self.by_name[app_name].fd
+        view = memoryview(data)
+        while view:
+            try:
+                view = view[os.write(master_fd, view):]
+            except BlockingIOError:
+                ready = self._loop.create_future()
+                self._loop.add_writer(master_fd, ready.set_result, None)
+                try:
+                    await ready
+                finally:
+                    self._loop.remove_writer(master_fd)
+
+    async def output(self, app_name, backlog=False):
+        """Yield the app's output as it arrives until it exits.
+
+        With backlog=True, whatever is already buffered comes first."""
+        self._attach_loop()
+        app = self.by_name[app_name]
+        if app.state != RUNNING:
+            return
+        import asyncio
+        q = asyncio.Queue()
+        self._subscribers.setdefault(app_name, []).append(q)
+        try:
+            if backlog and app.buffer:
+                yield bytes(app.buffer)
+            while True:
+                chunk = await q.get()
+                if chunk is None:
+                    return
+                yield chunk
+        finally:
+            subscribers = self._subscribers.get(app_name)
+            if subscribers and q in subscribers:
+                subscribers.remove(q)
+
+    async def wait(self, app_name):
+        """Wait for the app to exit and return its exit code."""
+        self._attach_loop()
+        app = self.by_name[app_name]
+        if app.state != RUNNING:
+            return app.returncode
+        fut = self._loop.create_future()
+        self._exit_waiters.setdefault(app_name, []).append(fut)
+        return await fut
+
+    async def stop(self, app_name, timeout=2.0):
+        """Terminate an app, killing it if it's still there after timeout seconds."""
+        self._attach_loop()
+        app = self.by_name[app_name]
+        if app.state != RUNNING:
+            return app.returncode
+        import asyncio
+        proc = app.proc
+        self.signal_app(app, signal.SIGTERM)
+        if app.frozen:
+            self.signal_app(app, signal.SIGCONT)
+        deadline = time.monotonic() + timeout
+        while proc.poll() is None and time.monotonic() < deadline:
+            await asyncio.sleep(0.02)
+        if proc.poll() is None:
+            self.signal_app(app, signal.SIGKILL)
+            while proc.poll() is None:
+                await asyncio.sleep(0.01)
+        if app.proc is proc and app.state == RUNNING:
+            self._forget(app)
+            self._exited(app, "app_stop")
+        return proc.returncode
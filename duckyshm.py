@@ -0,0 +1,221 @@
+"""Shared-memory output channel for apps that print a lot.
+
+Duckymux gives an app a ring when it's listed under "shm_rings" in
+duckymux.json. The app writes records into the ring instead of printing them,
+and Duckymux appends them to the app's output as if they had been printed:
+
+    import duckyshm
+
+    duckyshm.write(b"t=12.5 v=3.3\\n")   # through the ring, or stdout without one
+
+    ring = duckyshm.connect()           # None when there's no ring
+    if ring is not None:
+        ring.write(record)
+
+The ring lives in a memfd both sides map; Duckymux passes it and a doorbell
+pipe to the app at launch in $DUCKYMUX_SHM. Writing a record copies it into
+the mapping and moves the write position, without a system call. The doorbell
+is only rung when Duckymux is about to sleep with the ring empty, and
+Duckymux also looks at the ring on every poll, so nothing waits long for it.
+When the ring is full, write() waits for Duckymux to catch up, as a full
+pty would. Each record carries a CRC seeded with its position in the
+stream, so a record whose bytes aren't all visible to Duckymux yet (still
+zeroes, or left from the ring's last lap) is left for the next read, not
+delivered torn.
+
+Ordinary prints still go through the pty, so their order relative to the
+ring's records isn't kept.
+"""
+import mmap
+import os
+import struct
+import sys
+import time
+import zlib
+
+MAGIC = b"DMXR"
+VERSION = 2
+HEAD = 256  # bytes before the data
+WRITE_AT = 64  # u64: bytes ever written, moved by the app
+WAITING = 72  # u32: 1 while Duckymux wants the doorbell rung
+READ_AT = 128  # u64: bytes ever consumed, moved by Duckymux (a cache line away from WRITE_AT)
+HEADER = struct.Struct("<4sIQ")  # magic, version, capacity
+POSITION = struct.Struct("<Q")
+FLAG = struct.Struct("<I")
+RECORD = struct.Struct("<II")  # payload length (never 0), crc32 of the payload seeded with its position
+
+
+class Ring:
+    """One app's ring: the app writes records, Duckymux reads them.
+
+    Each side keeps its own position and only publishes it in the mapping,
+    so there's a single writer and a single reader per position."""
+
+    def __init__(self, fd, bell, bell_r=-1):
+        self.fd = fd
+        self.bell = bell  # doorbell write end
+        self.bell_r = bell_r  # doorbell read end, on Duckymux's side only
+        self.map = mmap.mmap(fd, 0)
+        magic, version, self.capacity = HEADER.unpack_from(self.map, 0)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError("not a Duckymux ring")
+        self.written = POSITION.unpack_from(self.map, WRITE_AT)[0]
+        self.read_at = POSITION.unpack_from(self.map, READ_AT)[0]
+
+    @classmethod
+    def create(cls, size):
+        """A new ring with room for `size` bytes of records (Duckymux's side)."""
+        fd = os.memfd_create("duckymux-ring")
+        try:
+            os.ftruncate(fd, HEAD + size)
+            with mmap.mmap(fd, 0) as m:
+                HEADER.pack_into(m, 0, MAGIC, VERSION, size)
+            bell_r, bell_w = os.pipe()
+        except:
+            os.close(fd)
+            raise
+        os.set_blocking(bell_r, False)
+        os.set_blocking(bell_w, False)
+        return cls(fd, bell_w, bell_r)
+
+    def env(self):
+        """What to add to the app's environment so connect() finds the ring."""
+        return {"DUCKYMUX_SHM": f"{self.fd},{self.bell}"}
+
+    def child_fds(self):
+        return (self.fd, self.bell)
+
+    def close(self):
+        self.map.close()
+        for fd in (self.fd, self.bell, self.bell_r):
+            if fd >= 0:
+                try:
+                    os.close(fd)
+                except OSError:
+                    pass
+        self.fd = self.bell = self.bell_r = -1
+
+    def _put(self, pos, data):
+        offset = pos % self.capacity
+        first = min(len(data), self.capacity - offset)
+        self.map[HEAD + offset:HEAD + offset + first] = data[:first]
+        if first < len(data):
+            self.map[HEAD:HEAD + len(data) - first] = data[first:]
+
+    def _get(self, pos, count):
+        offset = pos % self.capacity
+        first = min(count, self.capacity - offset)
+        if first == count:
+            return self.map[HEAD + offset:HEAD + offset + count]
+        return self.map[HEAD + offset:HEAD + self.capacity] + self.map[HEAD:HEAD + count - first]
+
+    # the app's side
+
+    def write(self, data):
+        """Put data in the ring as one record (several if it's bigger than the ring),
+        waiting while the ring is full."""
+        view = memoryview(data).cast("B")
+        largest = self.capacity - RECORD.size
+        while view:
+            chunk = view[:largest]
+            need = RECORD.size + len(chunk)
+            if self.capacity - (self.written - self.read_at) < need:
+                self._wait_for_room(need)
+            self._put(self.written, RECORD.pack(len(chunk), zlib.crc32(chunk, self.written & 0xFFFFFFFF)))
+            self._put(self.written + RECORD.size, chunk)
+            self.written += need
+            POSITION.pack_into(self.map, WRITE_AT, self.written)
+            if FLAG.unpack_from(self.map, WAITING)[0]:
+                FLAG.pack_into(self.map, WAITING, 0)
+                try:
+                    os.write(self.bell, b"\0")
+                except BlockingIOError:
+                    pass  # it's been rung already
+            view = view[len(chunk):]
+
+    def _wait_for_room(self, need):
+        delay = 0.0001
+        while True:
+            self.read_at = POSITION.unpack_from(self.map, READ_AT)[0]
+            if self.capacity - (self.written - self.read_at) >= need:
+                return
+            try:  # make sure Duckymux hears about what's there
+                os.write(self.bell, b"\0")
+            except BlockingIOError:
+                pass
+            time.sleep(delay)
+            delay = min(delay * 2, 0.01)
+
+    # Duckymux's side
+
+    def read(self):
+        """Every complete record written since the last read, joined, or b""."""
+        written = POSITION.unpack_from(self.map, WRITE_AT)[0]
+        if written == self.read_at:
+            return b""
+        raw = memoryview(self._get(self.read_at, written - self.read_at))
+        records = []
+        pos = 0
+        while pos + RECORD.size <= len(raw):
+            length, crc = RECORD.unpack_from(raw, pos)
+            end = pos + RECORD.size + length
+            if (not length or end > len(raw)
+                    or zlib.crc32(raw[pos + RECORD.size:end], (self.read_at + pos) & 0xFFFFFFFF) != crc):
+                break  # not all of it is visible yet
+            records.append(raw[pos + RECORD.size:end])
+            pos = end
+        if pos:
+            self.read_at += pos
+            POSITION.pack_into(self.map, READ_AT, self.read_at)
+        return b"".join(records)
+
+    def drain(self):
+        """Empty the doorbell, take what's in the ring and ask to be woken for more."""
+        try:
+            while os.read(self.bell_r, 4096):
+                pass
+        except BlockingIOError:
+            pass
+        data = self.read()
+        FLAG.pack_into(self.map, WAITING, 1)
+        return data + self.read()  # whatever came in before the flag was seen
+
+
+_ring = None
+_connected = False
+
+
+def connect():
+    """The ring Duckymux started this process with, or None if there isn't one.
+
+    The ring is this process's alone: the variable is dropped from the
+    environment and the fds aren't inherited, so children it starts don't write
+    into the same ring."""
+    global _ring, _connected
+    if _connected:
+        return _ring
+    _connected = True
+    spec = os.environ.pop("DUCKYMUX_SHM", None)
+    if not spec:
+        return None
+    try:
+        fd, bell = (int(part) for part in spec.split(","))
+        os.set_inheritable(fd, False)
+        os.set_inheritable(bell, False)
+        _ring = Ring(fd, bell)
+    except (OSError, ValueError):
+        _ring = None
+    return _ring
+
+
+def write(data):
+    """Send data (bytes, or str as UTF-8) to Duckymux: through the ring when
+    there is one, otherwise printed to stdout."""
+    if isinstance(data, str):
+        data = data.encode()
+    ring = connect()
+    if ring is not None:
+        ring.write(data)
+    else:
+        sys.stdout.buffer.write(data)
+        sys.stdout.buffer.flush()
@@ -1,15 +1,24 @@
 import curses
 import os
 import logging
-import subprocess
 import signal
 import time
 import sys
-import tty
-import termios
-import select
-import pty
-import fcntl
+import json
+import queue
+import atexit
+import base64
+import zlib
+import re
+import codecs
+import fnmatch
+from collections import deque
+from duckymux import (Mux, App, RUNNING, Histogram, Recorder, MetricsExporter, TimerWheel, Cron, Profile,
+                      Watcher, local_modules, read_cast, read_pty, log_event)
+# socket, select, termios, tty, logging.handlers, subprocess and asyncio are imported
+# when first used, after the first frame is on screen. See --startup-profile.
+startup_start = time.perf_counter()
+startup_phases = []  # (phase, seconds after the imports, unix time), for --startup-profile
 BSTATE_SCROLLUP=65536
 BSTATE_SCROLLDOWN=2097152
 BSTATE_CLICK = 4
@@ -17,7 +26,6 @@ BSTATE_RCLICK = 4096 # right click
 BSTATE_DBLCLICK = 8
 current_index=0
 current_scroll=0
-logging.basicConfig(filename='duckymux.log', level=logging.DEBUG)
 header ="Duckymux 0.0.1 q:quit h:help"
 helptext = """
 Duckymux - manage multiple RPI Pico scripts
@@ -26,8 +34,13 @@ h: show this help or exit help
 
 arrows or j/k or click: move up/down
 
+p: preview pane with the selected app's latest output: bottom, side, off
+
 r or right click:  run current app in background
 
++/-:               add/remove a replica (another instance of the app)
+space:             show/hide the replicas of a replica set
+
 o or double click: open the serial monitor for current app
                    use ^D^X to return to duckymux; use ^D^D to send ^D
 
@@ -35,48 +48,1504 @@ shift+r:           run app in foreground, exiting Duckymux and all other apps
                    with this, restart your Pico to return to duckymux
                    only one app can be run this way
 
-s: force stop current app
+s: force stop current app (and everything it started)
+f: freeze/unfreeze current app (SIGSTOP/SIGCONT to it and everything it started)
+w: watch current app: restart it whenever it or a module next to it is saved
+i: stats screen (loop/render/spawn/monitor timings, bytes read, CPU and memory
+   per app, compile errors of apps marked BROKEN)
+shift+d: dump stats to duckymux_stats.json (or send SIGUSR1)
+shift+p: start/stop cProfile + tracemalloc capture
+shift+l: cycle log level (DEBUG/INFO/WARNING/ERROR)
 q: quit
 
 === PRESS q OR h TO RETURN TO DUCKYMUX ==="""
 use_colors=False
-def print_app_list(apps,states,stdscr):
+mux = None  # the Mux whose apps are on screen
+last_frame = None  # the app list as last recorded, to record only changes
+screen_size = (24, 80)  # (rows, cols) the list is laid out for; only changes when a resize settles
+preview_mode = None  # None, "bottom" or "side"
+preview_tails = {}  # app name -> LineTail
+preview_app = None  # the app the pane is showing
+preview_lines = []  # what the pane shows, rebuilt at most preview.max_fps times a second
+preview_at = 0.0
+preview_selected = None  # the app under the cursor; the pane moves to it once the cursor rests there
+preview_selected_at = 0.0
+config_path = "duckymux.json"
+default_config = {
+    "low_priority": [],  # app names stopped first when memory runs low
+    "pin_replicas": [],  # apps whose replicas (+/- or `ctl scale`) are pinned to CPUs round robin
+    "tags": {},  # app name -> list of tags, for `ctl start --tag ...`
+    "resize_debounce": 0.15,  # seconds a terminal resize has to settle before the layout follows
+    "app_index": "duckymux_index.json",  # cached listing of apps/, so the first frame needn't list it
+    "startup_budget_ms": 100,  # time to the first frame --startup-profile measures against
+    "precompile": {
+        "enabled": True,  # byte-compile apps in the background and flag broken ones
+        "interval": 2.0,  # seconds between checks for changed sources
+    },
+    "pipeline": {
+        "enabled": True,    # read and buffer app output on worker threads
+        "queue_size": 256,  # chunks in flight before readers wait for processing
+    },
+    "control": {
+        "path": "duckymux.sock",  # unix socket for `python3 main.py ctl`
+    },
+    "log": {
+        "path": "duckymux.log",
+        "level": "INFO",
+        "max_bytes": 1048576,  # rotate after this many bytes
+        "backups": 3,
+    },
+    "session": {
+        "path": "duckymux_session.json",
+        "interval": 5.0,        # seconds between checkpoints
+        "scrollback": 16384,    # bytes of output saved per app
+        "restore": True,        # relaunch the saved apps on start (--no-restore skips it)
+    },
+    "preview": {
+        "mode": None,     # start with the preview pane at the "bottom" or "side" (p cycles)
+        "lines": 8,       # height of the bottom pane
+        "max_fps": 10,    # times a second the pane may pick up new output
+    },
+    "record": {
+        "enabled": False,        # also turned on by --record
+        "dir": "recordings",     # each run records into its own timestamped subdirectory
+    },
+    "probes": {},  # app name -> liveness probes, see check_liveness()
+    "watch": {
+        "apps": [],          # apps watched from the start (w toggles it per app)
+        "modules": True,     # also watch the modules in apps/ that an app imports
+        "debounce": 0.3,     # seconds of quiet after a save before the restart
+    },
+    "schedules": {},  # app name -> {"every": seconds} or {"cron": "*/5 * * * *"}, see start_schedules()
+    "profiles": {},  # name -> {"interpreter", "flags", "env", "cwd", "venv"}: ways to launch apps
+    "app_profiles": {},  # app name -> profile name; the rest run with plain python3
+    "routes": [],  # {"from": app, "to": app, "tee": false}: feed one app's output to another's input
+    "metrics": {
+        "enabled": False,        # write an OpenMetrics textfile for node_exporter
+        "path": "duckymux.prom",
+        "interval": 15.0,        # seconds between writes (skipped when nothing changed)
+    },
+    "shm_rings": {},  # app name -> bytes of shared-memory ring it can write output into, see duckyshm.py
+    "memory": {
+        "check_interval": 2.0,       # seconds between pressure readings
+        "psi_threshold": 10.0,       # /proc/pressure/memory "some avg10" percentage
+        "min_available_kb": 32768,   # MemAvailable floor from /proc/meminfo
+        "scrollback_keep": 16384,    # bytes kept per app by compact_scrollback
+        "order": ["compact_scrollback", "evict_scrollback", "stop_low_priority"],
+    },
+}
+config = default_config
+
+def load_config(path=config_path):
+    """Load duckymux.json on top of the defaults, one level deep."""
+    merged = {k: (dict(v) if isinstance(v, dict) else v) for k, v in default_config.items()}
+    try:
+        with open(path) as f:
+            data = json.load(f)
+    except FileNotFoundError:
+        return merged
+    except Exception as e:
+        logging.error(f"Error reading {path}: {e}")
+        return merged
+    for k, v in data.items():
+        if isinstance(v, dict) and isinstance(merged.get(k), dict):
+            merged[k].update(v)
+        else:
+            merged[k] = v
+    return merged
+
+log_levels = ["DEBUG", "INFO", "WARNING", "ERROR"]
+log_listener = None
+
+class EventFormatter(logging.Formatter):
+    """One compact JSON object per line: time, level, event name and its fields."""
+
+    def format(self, record):
+        entry = {"t": round(record.created, 3), "lvl": record.levelname,
+                 "event": getattr(record, "event", "log")}
+        fields = getattr(record, "fields", None)
+        if fields:
+            entry.update(fields)
+        else:
+            entry["msg"] = record.getMessage()
+        if record.exc_text:
+            entry["exc"] = record.exc_text
+        return json.dumps(entry, separators=(",", ":"), default=str)
+
+class EarlyLogs(logging.Handler):
+    """Holds what's logged before setup_logging(), which passes it on, so it
+    doesn't go to stderr (under curses) through logging's last resort handler."""
+
+    def __init__(self):
+        super().__init__()
+        self.records = []
+
+    def emit(self, record):
+        self.records.append(record)
+
+def setup_logging(log_config):
+    """Route all logging through a queue to a rotating file written by a background thread.
+
+    The UI thread only ever does a queue put."""
+    global log_listener
+    import logging.handlers
+    handler = logging.handlers.RotatingFileHandler(
+        log_config["path"], maxBytes=log_config["max_bytes"], backupCount=log_config["backups"])
+    handler.setFormatter(EventFormatter())
+    log_queue = queue.SimpleQueue()
+    root = logging.getLogger()
+    early = [h for h in root.handlers if isinstance(h, EarlyLogs)]
+    for h in root.handlers[:]:
+        root.removeHandler(h)
+    root.addHandler(logging.handlers.QueueHandler(log_queue))
+    root.setLevel(log_config["level"])
+    log_listener = logging.handlers.QueueListener(log_queue, handler)
+    log_listener.start()
+    atexit.register(stop_logging)
+    for h in early:
+        for record in h.records:
+            root.handle(record)
+
+def stop_logging():
+    """Flush whatever is still queued. Call before exiting or exec'ing."""
+    global log_listener
+    if log_listener is not None:
+        log_listener.stop()
+        log_listener = None
+
+def cycle_log_level():
+    """Switch the log level to the next of DEBUG/INFO/WARNING/ERROR at runtime."""
+    logger = logging.getLogger()
+    current = logging.getLevelName(logger.level)
+    level = log_levels[(log_levels.index(current) + 1) % len(log_levels)] if current in log_levels else "INFO"
+    logger.setLevel(level)
+    log_event("log_level", level=logging.ERROR, new_level=level)
+    return level
+
+def read_memory_pressure(psi_path="/proc/pressure/memory", meminfo_path="/proc/meminfo"):
+    """Return (psi_some_avg10, mem_available_kb), None for anything unavailable."""
+    psi = None
+    available = None
+    try:
+        with open(psi_path) as f:
+            for line in f:
+                if line.startswith("some"):
+                    for field in line.split()[1:]:
+                        if field.startswith("avg10="):
+                            psi = float(field[6:])
+    except (OSError, ValueError):
+        pass
+    try:
+        with open(meminfo_path) as f:
+            for line in f:
+                if line.startswith("MemAvailable:"):
+                    available = int(line.split()[1])
+                    break
+    except (OSError, ValueError, IndexError):
+        pass
+    return psi, available
+
+def memory_under_pressure(psi, available, mem_config):
+    """Decide from one pressure reading whether load should be shed."""
+    if psi is not None and psi >= mem_config["psi_threshold"]:
+        return True
+    if available is not None and available < mem_config["min_available_kb"]:
+        return True
+    return False
+
+def shed_memory(step, mux, mem_config, low_priority):
+    """Run one shedding step by name. Returns a description of what was reclaimed."""
+    if step == "compact_scrollback":
+        keep = mem_config["scrollback_keep"]
+        freed = 0
+        with mux.lock:
+            for app in mux.running():
+                if len(app.buffer) > keep:
+                    freed += len(app.buffer) - keep
+                    del app.buffer[:len(app.buffer) - keep]
+        return f"compacted scrollback, {freed} bytes freed"
+    elif step == "evict_scrollback":
+        freed = 0
+        with mux.lock:
+            for app in mux.running():
+                freed += len(app.buffer)
+                app.buffer.clear()
+        for app in list(restored_scrollback):
+            freed += sum(len(part) for _, part in restored_scrollback.pop(app))
+        return f"evicted scrollback, {freed} bytes freed"
+    elif step == "stop_low_priority":
+        stopped = [app.name for app in mux.running() if (app.group or app).name in low_priority]
+        for app_name in stopped:
+            mux.stop_app(app_name, wait=False)  # poll() finishes them off; the UI keeps going
+        return f"stopped low priority apps: {', '.join(stopped) or 'none'}"
+    return f"unknown shedding step {step!r}"
+
+def check_memory(mux, shed_level, reading=None):
+    """Take a pressure reading and escalate one step down the shedding order.
+
+    reading is (psi_some_avg10, mem_available_kb) as read_memory_pressure()
+    returns it, which is called when it's None.
+    Returns the new shed level, which drops back to 0 once pressure clears."""
+    mem_config = config["memory"]
+    psi, available = read_memory_pressure() if reading is None else reading
+    if not memory_under_pressure(psi, available, mem_config):
+        return 0
+    order = mem_config["order"]
+    if shed_level >= len(order):
+        return shed_level
+    result = shed_memory(order[shed_level], mux, mem_config, config["low_priority"])
+    log_event("memory_shed", level=logging.WARNING, psi_avg10=psi, mem_available_kb=available,
+              step=order[shed_level], result=result)
+    return shed_level + 1
+
+timers = TimerWheel(0.1)  # shared by everything periodic; advanced once per main loop
+probe_state = {}  # app name -> what the last liveness probe saw
+
+def check_liveness(app, probe):
+    """Run an app's liveness probes. Returns "ok" or what's wrong.
+
+    probe is its entry in config["probes"]; every check is optional:
+    output_timeout: seconds without output before it counts as hung
+    cpu_stall: seconds spinning (>=90% of a CPU, summed over everything the app
+    started) without output, or with any of its processes stuck in D state
+    heartbeat_file, heartbeat_timeout: a file the app touches, and how stale it may get
+    command, command_timeout: a shell command that exits 0 while the app is fine;
+    it runs in the background and its result counts at the next probe"""
+    now = time.monotonic()
+    state = probe_state.get(app.name)
+    if state is None or state["pid"] != app.pid:
+        drop_probe_state(app.name)
+        state = probe_state[app.name] = {"pid": app.pid, "started": now, "at": now, "cpu": None,
+                                         "bytes": app.bytes_read, "busy_since": None, "d_since": None,
+                                         "command": None, "command_at": 0.0, "command_failed": None}
+    problems = []
+    timeout = probe.get("output_timeout")
+    if timeout and now - app.last_output > timeout:
+        problems.append(f"no output for {now - app.last_output:.0f}s")
+    timeout = probe.get("cpu_stall")
+    usage = mux.usage(app) if timeout else None
+    if usage:
+        cpu = usage["cpu"]
+        if state["cpu"] is not None and now > state["at"]:
+            busy = (cpu - state["cpu"]) / (now - state["at"]) >= 0.9 and app.bytes_read == state["bytes"]
+            state["busy_since"] = (state["busy_since"] or state["at"]) if busy else None
+        state["d_since"] = (state["d_since"] or now) if usage["d_state"] else None
+        state["cpu"], state["at"], state["bytes"] = cpu, now, app.bytes_read
+        if state["busy_since"] is not None and now - state["busy_since"] >= timeout:
+            problems.append(f"spinning without output for {now - state['busy_since']:.0f}s")
+        if state["d_since"] is not None and now - state["d_since"] >= timeout:
+            problems.append(f"stuck in D state for {now - state['d_since']:.0f}s")
+    path = probe.get("heartbeat_file")
+    if path:
+        timeout = probe.get("heartbeat_timeout", 30)
+        try:
+            age = time.time() - os.stat(path).st_mtime
+        except OSError:
+            age = None
+        if now - state["started"] > timeout and (age is None or age > timeout):
+            problems.append("no heartbeat file" if age is None else f"heartbeat {age:.0f}s old")
+    command = probe.get("command")
+    if command:
+        proc = state["command"]
+        if proc is not None and proc.poll() is None:
+            if now - state["command_at"] > probe.get("command_timeout", 5):
+                kill_probe_command(proc)
+                state["command_failed"] = "probe command timed out"
+                state["command"] = proc = None
+            # otherwise it's still going: no new one this round, the last result stands
+        elif proc is not None:
+            state["command_failed"] = f"probe command exited {proc.returncode}" if proc.returncode else None
+            state["command"] = proc = None
+        if proc is None:
+            import subprocess
+            state["command"] = subprocess.Popen(
+                command, shell=True, stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL,
+                stderr=subprocess.DEVNULL, process_group=0,  # not a session: see Mux._reap_orphans()
+                env=dict(os.environ, DUCKYMUX_APP=app.name, DUCKYMUX_PID=str(app.pid)))
+            state["command_at"] = now
+        if state["command_failed"]:
+            problems.append(state["command_failed"])
+    return "; ".join(problems) or "ok"
+
+def kill_probe_command(proc):
+    """Kill a probe command with whatever its shell started."""
+    try:
+        os.killpg(proc.pid, signal.SIGKILL)
+    except OSError:
+        proc.kill()
+    proc.wait()
+
+def drop_probe_state(app_name):
+    state = probe_state.pop(app_name, None)
+    if state is not None and state["command"] is not None and state["command"].poll() is None:
+        kill_probe_command(state["command"])
+
+def run_probe(app, probe):
+    """Probe one app, act on the result and schedule the next round."""
+    timers.schedule(probe.get("interval", 5), run_probe, app, probe)
+    if not app.running:
+        drop_probe_state(app.name)
+        return
+    if app.frozen:
+        return  # stopped on purpose; it would only look hung
+    health = check_liveness(app, probe)
+    if app.health is None or (health == "ok") != (app.health == "ok"):
+        log_event("app_health", level=logging.INFO if health == "ok" else logging.WARNING,
+                  app=app.name, pid=app.pid, health=health)
+    app.health = health
+    action = probe.get("action")
+    if health != "ok" and action in ("restart", "kill"):
+        log_event("probe_action", level=logging.WARNING, app=app.name, pid=app.pid, action=action, health=health)
+        drop_probe_state(app.name)
+        if action == "restart":
+            restart_app(app)
+        else:
+            mux.stop_app(app.name, wait=False)
+
+def start_probes(mux):
+    for app_name, probe in config["probes"].items():
+        if app_name in mux.by_name:
+            timers.schedule(probe.get("interval", 5), run_probe, mux.by_name[app_name], probe)
+
+profiles = {}  # profile name -> Profile, resolved from config["profiles"] once
+
+def load_profiles():
+    """Resolve every profile in the config, logging the ones that can't be used.
+
+    Returns {name: why} for those."""
+    errors = {}
+    for name, spec in config["profiles"].items():
+        try:
+            profiles[name] = Profile(name, spec.get("interpreter"), spec.get("flags", ()), spec.get("env"),
+                                     spec.get("cwd"), spec.get("venv"))
+        except ValueError as e:
+            errors[name] = str(e)
+            log_event("profile_invalid", level=logging.WARNING, profile=name, error=str(e))
+    return errors
+
+def apply_profiles(mux):
+    load_profiles()
+    for app_name, name in config["app_profiles"].items():
+        if app_name in mux.by_name and name in profiles:
+            mux.set_profile(app_name, profiles[name])
+        else:
+            log_event("profile_unused", level=logging.WARNING, app=app_name, profile=name)
+
+schedules = {}  # app name -> scheduler state, see start_schedules()
+
+def start_schedules(mux):
+    """Run apps on the schedules in config["schedules"].
+
+    Each entry has "every" (seconds; the first run is one interval after
+    startup) or "cron" (five fields, local time), and optionally
+    "jitter": up to this many seconds added to each run's start, and
+    "overlap", for when a run is due while the last one is still going:
+    "skip" it (the default), "queue" one more run for when it exits,
+    or "kill" the old run and start a new one."""
+    for app_name, schedule in config["schedules"].items():
+        if app_name not in mux.by_name:
+            log_event("schedule_invalid", level=logging.WARNING, app=app_name, error="no such app")
+            continue
+        try:
+            cron = Cron(schedule["cron"]) if schedule.get("cron") else None
+            if cron is None and not schedule.get("every", 0) > 0:
+                raise ValueError("needs \"every\" or \"cron\"")
+            if schedule.get("overlap", "skip") not in ("skip", "queue", "kill"):
+                raise ValueError(f"unknown overlap policy {schedule['overlap']!r}")
+        except ValueError as e:
+            log_event("schedule_invalid", level=logging.WARNING, app=app_name, error=str(e))
+            continue
+        state = schedules[app_name] = {"schedule": schedule, "cron": cron, "due": time.monotonic(),
+                                       "next": None, "timer": None, "queued": False, "runs": 0, "skipped": 0}
+        plan_run(mux.by_name[app_name], state)
+
+def plan_run(app, state):
+    """Set the timer for an app's next scheduled run."""
+    schedule = state["schedule"]
+    now = time.monotonic()
+    if state["cron"] is not None:
+        at = state["cron"].next_after(time.time())
+        if at is None:
+            state["next"] = None
+            return
+        delay = at - time.time()
+    else:
+        # Runs stay on the grid of intervals from startup, however late one started.
+        every = schedule["every"]
+        state["due"] += ((now - state["due"]) // every + 1) * every
+        delay = state["due"] - now
+    jitter = schedule.get("jitter", 0)
+    if jitter:
+        import random
+        delay += random.uniform(0, jitter)
+    state["next"] = time.time() + delay
+    state["timer"] = timers.schedule(delay, run_scheduled, app, state)
+
+def run_scheduled(app, state):
+    """A scheduled run is due: start the app, or apply the overlap policy if it's still running."""
+    if state["cron"] is not None and time.time() < state["next"] - 1:
+        # the wall clock went back since the timer was set; wait for it to catch up
+        state["timer"] = timers.schedule(state["next"] - time.time(), run_scheduled, app, state)
+        return
+    plan_run(app, state)
+    if app.running:
+        overlap = state["schedule"].get("overlap", "skip")
+        if overlap == "queue":
+            state["queued"] = True
+            return
+        if overlap == "skip":
+            state["skipped"] += 1
+            log_event("schedule_skip", app=app.name, pid=app.pid)
+            return
+        log_event("schedule_kill", level=logging.WARNING, app=app.name, pid=app.pid)
+        state["queued"] = True  # schedule_exited() starts it once the old run is gone
+        mux.stop_app(app.name, wait=False)
+        return
+    start_scheduled(app, state)
+
+def start_scheduled(app, state):
+    state["queued"] = False
+    if mux.start_app(app.name):
+        state["runs"] += 1
+        log_event("schedule_run", app=app.name, pid=app.pid, run=state["runs"])
+
+def schedule_exited(app):
+    """Start the queued run of a scheduled app that just exited."""
+    state = schedules.get(app.name)
+    if state is not None and state["queued"] and not app.running:
+        start_scheduled(app, state)
+
+def format_duration(seconds):
+    return f"{seconds:.1f}s" if seconds < 60 else f"{int(seconds // 60)}m{int(seconds % 60):02d}s"
+
+def schedule_note(app):
+    """What the list shows after a scheduled app's status: next run and how long the last one took."""
+    state = schedules.get(app.name)
+    if state is None:
+        return ""
+    at = state["next"]
+    if at is None:
+        note = "  next -"
+    else:
+        note = "  next " + time.strftime("%H:%M:%S" if at - time.time() < 86400 else "%m-%d %H:%M", time.localtime(at))
+    if state["queued"]:
+        note += " +1 queued"
+    if app.last_duration is not None:
+        note += f"  took {format_duration(app.last_duration)}"
+    return note
+
+def row_note(app):
+    """What the list shows after an app's status."""
+    note = schedule_note(app)
+    if (app.group or app).name in watching:
+        note += "  watch"
+    return note
+
+watcher = None  # the Watcher, once an app is watched
+watching = {}  # app name -> watch state, see watch_app()
+
+def watch_app(app, on=True):
+    """Restart an app (with its replicas) whenever its script, or a local module it
+    imports, is saved; or stop doing that. Watching an app again re-reads its imports."""
+    global watcher
+    base = app.group or app
+    if not on:
+        state = watching.pop(base.name, None)
+        if state is not None:
+            if state["timer"] is not None:
+                state["timer"].cancel()
+            watcher.unwatch(base.name)
+            log_event("watch_off", app=base.name)
+        return
+    if watcher is None:
+        watcher = Watcher()
+    paths = [base.path] + (local_modules(base.path) if config["watch"]["modules"] else [])
+    watcher.watch(base.name, paths)
+    if base.name not in watching:
+        watching[base.name] = {"timer": None, "changed": set(), "restarts": 0}
+        log_event("watch_on", app=base.name, files=len(paths), inotify=watcher.inotify)
+
+def check_watched():
+    """Once per loop: wait for the saves to a watched app's files to settle, then restart it."""
+    if not watching:
+        return
+    for name, paths in watcher.changed().items():
+        state = watching.get(name)
+        if state is None:
+            continue
+        state["changed"].update(paths)
+        if state["timer"] is not None:
+            state["timer"].cancel()  # editors save in bursts; wait for the last one
+        state["timer"] = timers.schedule(config["watch"]["debounce"], restart_watched, mux.by_name[name], state)
+
+def restart_watched(app, state):
+    """A watched app's files changed: restart it on the new code.
+
+    Code that doesn't compile is left alone and the old run goes on (a broken
+    script shows BROKEN; a broken module is only logged).
+    The new run's output starts below the tail of the old run's and a line
+    saying what changed."""
+    state["timer"] = None
+    changed, state["changed"] = state["changed"], set()
+    files = sorted(os.path.relpath(path) for path in changed)
+    watch_app(app)  # it may import other modules now
+    if mux.compile_app(app):
+        log_event("watch_broken", level=logging.WARNING, app=app.name, error=app.error)
+        return
+    for path in changed:
+        try:
+            with open(path, "rb") as f:
+                compile(f.read(), path, "exec")
+        except OSError:
+            pass  # deleted; the app will say so if it needed it
+        except (SyntaxError, ValueError) as e:
+            log_event("watch_broken", level=logging.WARNING, app=app.name, file=os.path.relpath(path), error=str(e))
+            return
+    restart_start = time.perf_counter()
+    separator = f"\r\n--- {time.strftime('%H:%M:%S')} {', '.join(files)} changed, restarted by duckymux ---\r\n"
+    keep = config["session"]["scrollback"]
+    for member in members(app):
+        if member.running:
+            restore_scrollback(member.name, member.buffer)
+            restart_app(member, bytes(member.buffer[-keep:]) + separator.encode())
+        elif mux.start_app(member.name):
+            with mux.lock:
+                member.buffer[0:0] = separator.encode()
+    state["restarts"] += 1
+    log_event("watch_restart", app=app.name, files=files, restarts=state["restarts"],
+              seconds=round(time.perf_counter() - restart_start, 4))
+
+metrics = {name: Histogram() for name in ("loop", "render", "key", "monitor")}
+stats_path = "duckymux_stats.json"
+dump_requested = False
+profiler = None  # cProfile.Profile while profiling is switched on
+exporter = None  # the MetricsExporter, when metrics are enabled
+
+def request_dump(signum, frame):
+    global dump_requested
+    dump_requested = True
+
+def all_metrics():
+    """The UI's histograms followed by the Mux's."""
+    return dict(metrics, **mux.metrics)
+
+def dump_stats(path=stats_path):
+    """Write all histograms and per-app counters as JSON."""
+    data = {
+        "time": time.time(),
+        "histograms": {name: h.to_dict() for name, h in all_metrics().items()},
+        "apps": {app.name: {"bytes": app.bytes_read, "reads": app.reads, "usage": mux.usage(app)}
+                 for app in mux.all_apps() if app.reads or app.running},
+        "routes": [route.stats() for route in mux.routes],
+        "profiling": profiler is not None,
+    }
+    try:
+        with open(path, "w") as f:
+            json.dump(data, f, indent=4)
+        log_event("stats_dump", path=path)
+    except OSError as e:
+        log_event("stats_dump_failed", level=logging.ERROR, path=path, error=str(e))
+
+def toggle_profiling():
+    """Start cProfile + tracemalloc, or stop them and write the captures next to the log."""
+    global profiler
+    import cProfile
+    import tracemalloc
+    if profiler is None:
+        profiler = cProfile.Profile()
+        tracemalloc.start()
+        profiler.enable()
+        log_event("profiling", state="on")
+        return True
+    profiler.disable()
+    profiler.dump_stats("duckymux.prof")
+    snapshot = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+    with open("duckymux_tracemalloc.txt", "w") as f:
+        for stat in snapshot.statistics("lineno")[:50]:
+            f.write(f"{stat}\n")
+    profiler = None
+    log_event("profiling", state="off", files=["duckymux.prof", "duckymux_tracemalloc.txt"])
+    return False
+
+def show_stats(stdscr):
+    """Live stats screen, refreshed twice a second."""
+    stdscr.clear()
+    stdscr.timeout(500)
+    message = ""
+    while True:
+        max_y, max_x = stdscr.getmaxyx()
+        lines = [f"Duckymux stats  i/q:back D:dump JSON P:profiling {'ON' if profiler else 'off'}  {message}", ""]
+        lines.append(f"{'':10}{'count':>10}{'p50 ms':>10}{'p95 ms':>10}{'max ms':>10}{'mean ms':>10}")
+        for name, h in all_metrics().items():
+            lines.append(f"{name:10}{h.count:>10}{h.percentile(50) * 1000:>10.2f}{h.percentile(95) * 1000:>10.2f}"
+                         f"{h.max * 1000:>10.2f}{(h.total / h.count if h.count else 0) * 1000:>10.2f}")
+        lines.append("")
+        lines.append(f"{'app':30}{'bytes':>14}{'reads':>10}{'cpu s':>10}{'rss kB':>10}{'procs':>7}")
+        for app in mux.all_apps():
+            usage = mux.usage(app)
+            if app.reads or usage:
+                tree = f"{usage['cpu']:>10.2f}{usage['rss_kb']:>10}{len(usage['pids']):>7}" if usage else ""
+                lines.append(f"{app.name[:29]:30}{app.bytes_read:>14}{app.reads:>10}{tree}")
+        if mux.routes:
+            lines.append("")
+            lines.append(f"{'route':40}{'mode':>7}{'bytes':>14}{'kB/s':>10}{'stalls':>8}{'backlog':>9}")
+            for route in mux.routes:
+                s = route.stats()
+                name = f"{s['from']} -> {s['to']}"
+                mode = s["mode"] if s["active"] else "idle"
+                lines.append(f"{name[:39]:40}{mode:>7}{s['bytes']:>14}{s['bytes_per_sec'] / 1e3:>10.1f}"
+                             f"{s['stalls']:>8}{s['backlog']:>9}")
+        unwell = [app for app in mux.all_apps() if app.running and app.health not in (None, "ok")]
+        if unwell:
+            lines.append("")
+            lines.append("apps failing their liveness probes:")
+            for app in unwell:
+                lines.append(f"{app.name[:29]:30}{app.health}")
+        broken = [app for app in mux.table if app.error is not None]
+        if broken:
+            lines.append("")
+            lines.append("apps that don't compile:")
+            for app in broken:
+                lines.append(f"{app.name[:29]:30}{app.error}")
+        stdscr.erase()
+        for i, line in enumerate(lines[:max_y]):
+            try:
+                stdscr.addstr(i, 0, line[:max_x - 1])
+            except curses.error:
+                pass
+        stdscr.refresh()
+        key = stdscr.getch()
+        if key == ord('i') or key == ord('q'):
+            break
+        elif key == ord('D'):
+            dump_stats()
+            message = f"wrote {stats_path}"
+        elif key == ord('P'):
+            message = "profiling started" if toggle_profiling() else "wrote duckymux.prof"
+    stdscr.timeout(100)
+    stdscr.clear()
+
+restored_scrollback = {}  # app_name -> saved scrollback parts, decoded on first attach
+last_snapshot_key = None
+session_writes = None  # snapshots waiting for the session writer thread, once it's started
+
+def save_session(mux, force=False, wait=False):
+    """Checkpoint running apps, selection and recent scrollback.
+
+    Only the snapshot is taken here; write_session() compresses and writes it
+    on a background thread, and wait waits for that.
+    Skipped when nothing changed since the last checkpoint unless force is set."""
+    global last_snapshot_key, session_writes
+    session_config = config["session"]
+    running = sorted(mux.running(), key=lambda app: app.index)
+    key = (tuple(app.name for app in running), current_index, current_scroll,
+           tuple(len(app.buffer) for app in running), tuple(watching))
+    if key == last_snapshot_key and not force:
+        return
+    keep = session_config["scrollback"]
+    scrollback = {}
+    for app in running:
+        # Output restored from earlier sessions stays compressed until it's shown;
+        # it's saved as it is, in front of this run's, for as long as it's in reach.
+        parts = list(restored_scrollback.get(app.name, ()))
+        if app.buffer:
+            tail = bytes(app.buffer[-keep:])
+            parts.append([len(tail), tail])  # compressed by write_session()
+        while len(parts) > 1 and sum(length for length, _ in parts[1:]) >= keep:
+            del parts[0]
+        if parts:
+            scrollback[app.name] = parts
+    data = {
+        "version": 1,
+        "time": time.time(),
+        "running": [app.name for app in running],
+        "replicas": {app.name: 1 + len(app.replicas) for app in mux.table if app.replicas},
+        "routes": [{"from": route.src.name, "to": route.dst.name, "tee": route.tee} for route in mux.routes],
+        "watching": list(watching),
+        "current_app": rows[current_index].name if current_index < len(rows) else None,
+        "current_scroll": current_scroll,
+        "scrollback": scrollback,
+    }
+    if session_writes is None:
+        import threading
+        session_writes = queue.Queue()
+        threading.Thread(target=write_session, args=(session_writes,), name="duckymux-session", daemon=True).start()
+    session_writes.put((session_config["path"], data))
+    last_snapshot_key = key
+    if wait:
+        session_writes.join()
+
+def write_session(snapshots):
+    """The session writer thread: compress each snapshot's new scrollback and
+    write it, skipping to the newest when several are waiting.
+
+    Written to a temp file and os.replace()d so a crash never leaves a torn snapshot."""
+    global last_snapshot_key
+    while True:
+        path, data = snapshots.get()
+        try:
+            while True:
+                path, data = snapshots.get_nowait()
+                snapshots.task_done()
+        except queue.Empty:
+            pass
+        for parts in data["scrollback"].values():
+            for part in parts:
+                if isinstance(part[1], bytes):
+                    part[1] = base64.b64encode(zlib.compress(part[1], 1)).decode()
+        tmp_path = f"{path}.tmp"
+        try:
+            with open(tmp_path, "w") as f:
+                json.dump(data, f, separators=(",", ":"))
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, path)
+        except OSError as e:
+            log_event("session_save_failed", level=logging.ERROR, path=path, error=str(e))
+            last_snapshot_key = None  # so the next checkpoint tries again
+        snapshots.task_done()
+
+def load_session():
+    """Read the last snapshot, or None if there is no usable one."""
+    try:
+        with open(config["session"]["path"]) as f:
+            data = json.load(f)
+    except FileNotFoundError:
+        return None
+    except Exception as e:
+        log_event("session_load_failed", level=logging.ERROR, error=str(e))
+        return None
+    if data.get("version") != 1:
+        return None
+    return data
+
+def restore_session(mux, snapshot):
+    """Relaunch every app from the snapshot and queue its scrollback for lazy loading.
+
+    Popen only forks and execs, so the launches overlap instead of waiting on each other."""
+    global current_index
+    global current_scroll
+    restore_start = time.perf_counter()
+    for app_name, count in snapshot.get("replicas", {}).items():
+        if app_name in mux.by_name:
+            mux.scale(app_name, count, pin=app_name in config["pin_replicas"] or None, start=False)
+    add_routes(mux, snapshot.get("routes", []))
+    for app_name in snapshot.get("watching", []):
+        if app_name in mux.by_name:
+            watch_app(mux.by_name[app_name])
+    for app_name in snapshot.get("running", {}):
+        if app_name not in mux.by_name or mux.is_running(app_name):
+            continue
+        if mux.start_app(app_name) and app_name in snapshot.get("scrollback", {}):
+            parts = snapshot["scrollback"][app_name]
+            if isinstance(parts, str):  # saved by an older Duckymux
+                parts = [[config["session"]["scrollback"], parts]]
+            restored_scrollback[app_name] = parts
+    if snapshot.get("current_app") in mux.by_name:
+        app = mux.by_name[snapshot["current_app"]]
+        current_index = (app.group or app).index
+        current_scroll = snapshot.get("current_scroll", 0)
+    log_event("session_restore", apps=[app.name for app in mux.running()],
+              seconds=round(time.perf_counter() - restore_start, 4))
+
+def add_routes(mux, routes):
+    """Set up routes given as {"from": ..., "to": ..., "tee": ...}, skipping ones that don't fit."""
+    for route in routes:
+        try:
+            mux.add_route(route["from"], route["to"], tee=route.get("tee", False))
+        except (KeyError, ValueError) as e:
+            log_event("route_failed", level=logging.WARNING, src=route.get("from"), dst=route.get("to"), error=str(e))
+
+def restore_scrollback(app_name, output_buffer):
+    """Put the previous sessions' output in front of what the app printed since restart."""
+    saved = restored_scrollback.pop(app_name, None)
+    if saved is None:
+        return
+    separator = b"\r\n--- restarted by duckymux ---\r\n"
+    try:
+        old = separator.join(zlib.decompress(base64.b64decode(part)) for _, part in saved)
+    except Exception as e:
+        log_event("scrollback_restore_failed", level=logging.ERROR, app=app_name, error=str(e))
+        return
+    with mux.lock:
+        output_buffer[0:0] = old + separator
+
+def open_control_socket(path):
+    """Listen on a non-blocking unix socket. Returns None if it can't be created."""
+    import socket
+    try:
+        if os.path.exists(path):
+            os.unlink(path)
+        server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        server.bind(path)
+        server.listen(8)
+        server.setblocking(False)
+        return server
+    except OSError as e:
+        log_event("control_socket_failed", level=logging.ERROR, path=path, error=str(e))
+        return None
+
+def close_control_socket(server, clients):
+    for client in clients:
+        client.close()
+    clients.clear()
+    if server is not None:
+        server.close()
+        try:
+            os.unlink(config["control"]["path"])
+        except OSError:
+            pass
+
+CONTROL_REQUEST_MAX = 1 << 20  # bytes of a request line before its client is dropped
+CONTROL_BACKLOG_MAX = 1 << 20  # bytes of unsent responses before a client's requests wait
+
+def serve_control(server, clients, mux, stdscr):
+    """Accept and answer whatever control requests are waiting, without blocking.
+
+    Requests and responses are one JSON object per line. clients maps each
+    socket to (request bytes so far, response bytes not sent yet); responses go
+    out as fast as the client takes them, and a client that has stopped
+    taking them isn't read from until it catches up."""
+    if server is None:
+        return
+    import select
+    readers = [server] + [sock for sock, (_, out) in clients.items() if len(out) < CONTROL_BACKLOG_MAX]
+    writers = [sock for sock, (_, out) in clients.items() if out]
+    readable, writable, _ = select.select(readers, writers, [], 0)
+    for sock in writable:
+        flush_control(sock, clients)
+    for sock in readable:
+        if sock is server:
+            try:
+                client, _ = server.accept()
+                client.setblocking(False)
+                clients[client] = (bytearray(), bytearray())
+            except OSError:
+                pass
+            continue
+        if sock not in clients:
+            continue  # dropped while writing
+        try:
+            data = sock.recv(65536)
+        except OSError:
+            data = b""
+        if not data:
+            drop_control(sock, clients)
+            continue
+        pending, out = clients[sock]
+        pending.extend(data)
+        while b"\n" in pending:
+            line, _, rest = bytes(pending).partition(b"\n")
+            pending[:] = rest
+            try:
+                response = handle_control(json.loads(line), mux, stdscr)
+            except Exception as e:
+                response = {"ok": False, "error": str(e)}
+            out.extend(json.dumps(response).encode() + b"\n")
+        if len(pending) > CONTROL_REQUEST_MAX:
+            log_event("control_request_too_long", level=logging.WARNING, bytes=len(pending))
+            drop_control(sock, clients)
+        elif out:
+            flush_control(sock, clients)
+
+def flush_control(sock, clients):
+    """Send as much of a client's waiting responses as its socket takes now."""
+    out = clients[sock][1]
+    try:
+        del out[:sock.send(out)]
+    except BlockingIOError:
+        pass
+    except OSError:
+        drop_control(sock, clients)
+
+def drop_control(sock, clients):
+    sock.close()
+    del clients[sock]
+
+def match_apps(mux, request):
+    """Apps named by a control request: a glob in "match" and/or a tag in "tag"."""
+    pattern = request.get("match", "*")
+    tag = request.get("tag")
+    return [app for app in mux.all_apps() if fnmatch.fnmatchcase(app.name, pattern)
+            and (tag is None or tag in config["tags"].get((app.group or app).name, []))]
+
+def app_status(app):
+    usage = mux.usage(app)
+    return {
+        "app": app.name,
+        "running": app.running,
+        "pid": app.pid if app.running else None,
+        "returncode": app.returncode,
+        "starts": app.starts,
+        "bytes_read": app.bytes_read,
+        "buffered": len(app.buffer) if app.running else 0,
+        "error": app.error,
+        "health": app.health if app.running else None,
+        "tags": config["tags"].get((app.group or app).name, []),
+        "replica": app.replica,
+        "cpus": sorted(app.cpus) if app.cpus else None,
+        "profile": (app.group or app).profile.name if (app.group or app).profile else None,
+        "frozen": app.frozen if app.running else False,
+        "watching": (app.group or app).name in watching,
+        "next_run": schedules[app.name]["next"] if app.name in schedules else None,
+        "last_duration": app.last_duration,
+        "cpu_seconds": round(usage["cpu"], 2) if usage else None,
+        "rss_kb": usage["rss_kb"] if usage else None,
+        "pids": usage["pids"] if usage else [],
+    }
+
+pending_restarts = {}  # app name -> output to put ahead of its next run, for apps restart_app() stopped
+
+def restart_app(app, prefix=b""):
+    """Stop an app without waiting for it; finish_restart() starts it again once it's exited."""
+    pending_restarts[app.name] = prefix
+    mux.stop_app(app.name, wait=False)
+
+def finish_restart(app):
+    """Exit hook: start an app restart_app() stopped, with its prefix ahead of the new output."""
+    prefix = pending_restarts.pop(app.name, None)
+    if prefix is not None and mux.start_app(app.name) and prefix:
+        with mux.lock:
+            app.buffer[0:0] = prefix
+
+def handle_control(request, mux, stdscr):
+    """Run one control command. See ctl_main() for the commands."""
+    cmd = request.get("cmd")
+    if cmd in ("list", "status"):
+        return {"ok": True, "apps": [app_status(app) for app in match_apps(mux, request)]}
+    elif cmd in ("start", "stop", "restart"):
+        # Stopping only sends SIGTERM; the main loop's poll() finishes the stops
+        # (and finish_restart(), an exit hook, starts the restarted apps again)
+        # so the UI never waits on an app.
+        done = []
+        for app in match_apps(mux, request):
+            if cmd == "restart" and app.running:
+                restart_app(app)
+                done.append(app.name)
+            elif cmd == "stop" and app.running:
+                mux.stop_app(app.name, wait=False)
+                done.append(app.name)
+            elif cmd in ("start", "restart") and not app.running:
+                if mux.start_app(app.name):
+                    done.append(app.name)
+        return {"ok": True, cmd: done}
+    elif cmd in ("freeze", "thaw"):
+        done = []
+        for app in match_apps(mux, request):
+            if app.running and app.frozen != (cmd == "freeze"):
+                mux.freeze_app(app.name)
+                done.append(app.name)
+        return {"ok": True, cmd: done}
+    elif cmd in ("watch", "unwatch"):
+        done = []
+        for app in match_apps(mux, request):
+            if app.group is None and (app.name in watching) != (cmd == "watch"):
+                watch_app(app, cmd == "watch")
+                done.append(app.name)
+        return {"ok": True, cmd: done}
+    elif cmd == "scale":
+        global rows_changed
+        app = request["app"]
+        if app not in mux.by_name:
+            return {"ok": False, "error": f"no app {app}"}
+        pin = request.get("pin")
+        if pin is None and app in config["pin_replicas"]:
+            pin = True
+        running = mux.scale(app, request["count"], pin=pin, wait=False)
+        rows_changed = True
+        return {"ok": True, "running": [member.name for member in running]}
+    elif cmd == "route":
+        try:
+            route = mux.add_route(request["from"], request["to"], tee=request.get("tee", False))
+        except KeyError as e:
+            return {"ok": False, "error": f"no app {e}"}
+        except ValueError as e:
+            return {"ok": False, "error": str(e)}
+        return {"ok": True, "route": route.stats()}
+    elif cmd == "unroute":
+        route = mux.remove_route(request["from"], request["to"])
+        if route is None:
+            return {"ok": False, "error": f"no route from {request['from']} to {request['to']}"}
+        return {"ok": True, "route": route.stats()}
+    elif cmd == "routes":
+        return {"ok": True, "routes": [route.stats() for route in mux.routes]}
+    elif cmd == "send":
+        app = request["app"]
+        if not mux.is_running(app):
+            return {"ok": False, "error": f"{app} is not running"}
+        mux.write_app(app, request["data"].encode(errors="surrogateescape"))
+        return {"ok": True}
+    elif cmd == "capture":
+        app = request.get("app")
+        if app is None:
+            max_y, max_x = stdscr.getmaxyx()
+            screen = [stdscr.instr(row, 0, max_x).decode(errors="replace").rstrip() for row in range(max_y)]
+            return {"ok": True, "lines": screen}
+        if not mux.is_running(app):
+            return {"ok": False, "error": f"{app} is not running"}
+        output_buffer = mux.by_name[app].buffer
+        restore_scrollback(app, output_buffer)
+        lines = output_buffer.decode(errors="replace").replace("\r\n", "\n").split("\n")
+        return {"ok": True, "lines": lines[-request.get("lines", 24):]}
+    return {"ok": False, "error": f"unknown command {cmd!r}"}
+
+def unescape(text):
+    """Decode the backslash escapes (\\n, \\x1b, ...) in text and nothing else.
+    Bytes that aren't UTF-8 (e.g. from \\xff) come back as surrogates, which
+    handle_control()'s "send" turns back into those bytes."""
+    import codecs
+    return codecs.escape_decode(text.encode())[0].decode(errors="surrogateescape")
+
+def ctl_main(argv):
+    """`python3 main.py ctl ...`: talk to a running Duckymux over its control socket."""
+    import argparse
+    import socket
+    parser = argparse.ArgumentParser(prog="main.py ctl", description="Control a running Duckymux.")
+    parser.add_argument("--socket", default=None, help="control socket (default: from duckymux.json)")
+    sub = parser.add_subparsers(dest="cmd", required=True)
+    for name in ("list", "status", "start", "stop", "restart", "freeze", "thaw", "watch", "unwatch"):
+        p = sub.add_parser(name, help=f"{name} apps matching a glob and/or tag")
+        p.add_argument("match", nargs="?", default="*", help="app name glob, e.g. 'test_*'")
+        p.add_argument("--tag", help="only apps with this tag")
+    p = sub.add_parser("scale", help="run N replicas of an app (0 stops them all)")
+    p.add_argument("app")
+    p.add_argument("count", type=int)
+    p.add_argument("--pin", action="store_true", default=None, help="pin replicas to CPUs round robin")
+    p.add_argument("--no-pin", dest="pin", action="store_false", help="let replicas run on any CPU")
+    p = sub.add_parser("route", help="feed one app's output into another app's input")
+    p.add_argument("src")
+    p.add_argument("dst")
+    p.add_argument("--tee", action="store_true", help="keep the output in the source's scrollback too")
+    p = sub.add_parser("unroute", help="stop feeding one app into another")
+    p.add_argument("src")
+    p.add_argument("dst")
+    sub.add_parser("routes", help="every route with its throughput counters")
+    p = sub.add_parser("send", help="send keys to an app (backslash escapes like \\n are decoded)")
+    p.add_argument("app")
+    p.add_argument("data")
+    p = sub.add_parser("capture", help="last lines of an app's output, or the Duckymux screen")
+    p.add_argument("app", nargs="?")
+    p.add_argument("-n", "--lines", type=int, default=24)
+    args = parser.parse_args(argv)
+
+    request = {"cmd": args.cmd}
+    if args.cmd in ("list", "status", "start", "stop", "restart", "freeze", "thaw", "watch", "unwatch"):
+        request["match"] = args.match
+        if args.tag:
+            request["tag"] = args.tag
+    elif args.cmd == "scale":
+        request.update(app=args.app, count=args.count, pin=args.pin)
+    elif args.cmd in ("route", "unroute"):
+        request.update({"from": args.src, "to": args.dst})
+        if args.cmd == "route":
+            request["tee"] = args.tee
+    elif args.cmd == "send":
+        request["app"] = args.app
+        request["data"] = unescape(args.data)
+    elif args.cmd == "capture":
+        if args.app:
+            request["app"] = args.app
+        request["lines"] = args.lines
+
+    path = args.socket or load_config()["control"]["path"]
+    try:
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+            sock.connect(path)
+            sock.sendall(json.dumps(request).encode() + b"\n")
+            response = bytearray()
+            while not response.endswith(b"\n"):
+                data = sock.recv(65536)
+                if not data:
+                    break
+                response.extend(data)
+    except OSError as e:
+        print(f"Can't reach Duckymux at {path}: {e}", file=sys.stderr)
+        return 2
+    response = json.loads(response)
+    if args.cmd == "capture" and response.get("ok"):
+        print("\n".join(response["lines"]))
+    else:
+        print(json.dumps(response, indent=4))
+    return 0 if response.get("ok") else 1
+
+def positive_float(text):
+    """argparse type for a number above 0."""
+    import argparse
+    try:
+        value = float(text)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"not a number: {text!r}") from None
+    if not value > 0:
+        raise argparse.ArgumentTypeError(f"must be more than 0: {text!r}")
+    return value
+
+def replay_main(argv):
+    """`python3 main.py replay FILE.cast`: play a recording back through the app read path.
+
+    The recorded output is written into a pty at its recorded pace (or faster)
+    and read back into an App buffer with read_pty(), which Mux.read_app() uses
+    for a running app's output, then drawn on the terminal like the serial monitor does.
+    Prints how long that took and how fast it went."""
+    import argparse
+    import pty
+    import select
+    import threading
+    import tty
+    parser = argparse.ArgumentParser(prog="main.py replay", description="Replay an asciicast recording.")
+    parser.add_argument("file", help="a .cast file from a --record run")
+    speed = parser.add_mutually_exclusive_group()
+    speed.add_argument("--speed", type=positive_float, default=1.0, help="playback speed, e.g. 2 for 2x (default 1)")
+    speed.add_argument("--max", action="store_true", help="no delays: as fast as it can be read")
+    parser.add_argument("--quiet", action="store_true", help="don't draw, only read (measures the read path alone)")
+    args = parser.parse_args(argv)
+
+    header, events = read_cast(args.file)
+    master_fd, slave_fd = pty.openpty()
+    tty.setraw(slave_fd)
+    os.set_blocking(master_fd, False)
+    app = App(0, header.get("title", os.path.basename(args.file)), args.file)
+    app.state = RUNNING
+    app.fd = master_fd
+    app.buffer = bytearray()
+
+    def feed():
+        start = time.monotonic()
+        for t, data in events:
+            if not args.max:
+                delay = start + t / args.speed - time.monotonic()
+                if delay > 0:
+                    time.sleep(delay)
+            view = memoryview(data)
+            while view:
+                view = view[os.write(slave_fd, view):]
+        os.close(slave_fd)
+
+    render = Histogram()
+    wall_start = time.perf_counter()
+    threading.Thread(target=feed, daemon=True).start()
+    while True:
+        select.select([master_fd], [], [])
+        alive = read_pty(app)
+        if app.buffer:
+            render_start = time.perf_counter()
+            if not args.quiet:
+                sys.stdout.buffer.write(app.buffer)
+                sys.stdout.buffer.flush()
+            app.buffer.clear()
+            render.add(time.perf_counter() - render_start)
+        if not alive:
+            break
+    wall = time.perf_counter() - wall_start
+    os.close(master_fd)
+
+    recorded = events[-1][0] if events else 0.0
+    print(f"\r\n{args.file}: {len(events)} events, {app.bytes_read} bytes, {app.reads} reads", file=sys.stderr)
+    print(f"recorded {recorded:.3f}s, replayed in {wall:.3f}s "
+          f"({app.bytes_read / wall / 1e3 if wall else 0:.1f} kB/s)", file=sys.stderr)
+    if not args.quiet:
+        print(f"draw per read: p50 {render.percentile(50) * 1000:.3f} ms, p95 {render.percentile(95) * 1000:.3f} ms, "
+              f"max {render.max * 1000:.3f} ms", file=sys.stderr)
+    return 0
+
+def compare_main(argv):
+    """`python3 main.py compare APP PROFILE [PROFILE]`: run an app under two launch profiles.
+
+    Each run gets the app to itself, on a pty like in Duckymux, until it
+    exits or --seconds pass. CPU time is what the app and everything it
+    started used (from getrusage() of the reaped children); throughput is
+    the output it printed per second and per CPU second. With --repeat the
+    profiles take turns, so drift in the machine's load hits both alike."""
+    import argparse
+    import resource
+    import select
+    parser = argparse.ArgumentParser(prog="main.py compare", description="Compare an app under two launch profiles.")
+    parser.add_argument("app", help="app name, as in the list")
+    parser.add_argument("profiles", nargs="+", metavar="PROFILE",
+                        help='profile names from duckymux.json; "default" is plain python3')
+    parser.add_argument("--seconds", type=positive_float, default=10.0, help="stop each run after this long (default 10)")
+    parser.add_argument("--repeat", type=int, default=1, help="runs per profile (default 1)")
+    args = parser.parse_args(argv)
+    if len(args.profiles) > 2:
+        parser.error("compare takes one or two profiles")
+
+    global config
+    config = load_config()
+    compare_mux = Mux("apps")
+    if args.app not in compare_mux.by_name:
+        print(f"no app {args.app} in apps/", file=sys.stderr)
+        return 2
+    errors = load_profiles()
+    names = args.profiles if len(args.profiles) == 2 else ["default", args.profiles[0]]
+    for name in names:
+        if name != "default" and name not in profiles:
+            print(errors.get(name, f"no profile {name!r} in {config_path}"), file=sys.stderr)
+            return 2
+    app = compare_mux.by_name[args.app]
+    results = {name: {"runs": 0, "wall": 0.0, "cpu": 0.0, "bytes": 0, "rss_kb": 0, "codes": []} for name in names}
+    for _ in range(args.repeat):
+        for name in names:
+            compare_mux.set_profile(args.app, profiles.get(name))
+            before = resource.getrusage(resource.RUSAGE_CHILDREN)
+            start = time.monotonic()
+            bytes_before = app.bytes_read
+            if compare_mux.start_app(args.app) is None:
+                print(f"{args.app} didn't start under {name}", file=sys.stderr)
+                return 1
+            peak = 0
+            while app.running and time.monotonic() - start < args.seconds:
+                select.select([app.fd], [], [], 0.2)
+                compare_mux.poll()
+                if app.buffer:
+                    app.buffer.clear()
+                usage = compare_mux.usage(app, 0.2)
+                if usage:
+                    peak = max(peak, usage["rss_kb"])
+            wall = time.monotonic() - start
+            if app.running:
+                compare_mux.stop_app(args.app)
+            after = resource.getrusage(resource.RUSAGE_CHILDREN)
+            result = results[name]
+            result["runs"] += 1
+            result["wall"] += wall
+            result["cpu"] += (after.ru_utime + after.ru_stime) - (before.ru_utime + before.ru_stime)
+            result["bytes"] += app.bytes_read - bytes_before
+            result["rss_kb"] = max(result["rss_kb"], peak)
+            result["codes"].append(app.returncode)
+
+    print(f"{args.app}: {args.repeat} run(s) per profile, up to {args.seconds:g}s each")
+    print(f"{'profile':16}{'wall s':>10}{'cpu s':>10}{'out kB/s':>12}{'kB/cpu s':>12}{'peak rss kB':>13}  exit")
+    for name, result in results.items():
+        runs = result["runs"]
+        wall, cpu = result["wall"] / runs, result["cpu"] / runs
+        kb = result["bytes"] / runs / 1e3
+        print(f"{name[:15]:16}{wall:>10.3f}{cpu:>10.3f}{kb / wall if wall else 0:>12.1f}"
+              f"{kb / cpu if cpu else 0:>12.1f}{result['rss_kb']:>13}  {','.join(str(c) for c in result['codes'])}")
+    first, second = (results[name] for name in names)
+    if first["cpu"] and second["cpu"]:
+        print(f"{names[1]} uses {second['cpu'] / first['cpu']:.2f}x the CPU time of {names[0]}")
+    if first["bytes"] and second["bytes"] and first["wall"] and second["wall"]:
+        ratio = (second["bytes"] / second["wall"]) / (first["bytes"] / first["wall"])
+        print(f"{names[1]} prints {ratio:.2f}x as much per second as {names[0]}")
+    return 0
+
+ANSI_ESCAPE = re.compile(r"\x1b(\[[0-?]*[ -/]*[@-~]|\][^\x07\x1b]*(\x07|\x1b\\)?|[ -/]*[0-~])|[\x00-\x08\x0b-\x1f\x7f]")
+TAIL_LINES = 256
+
+class LineTail:
+    """The last lines an app printed, kept current from App.bytes_read.
+
+    Each update() only decodes the bytes that arrived since the last one, read
+    off the end of the app's buffer, so the buffer is never scanned from the start."""
+    __slots__ = ("lines", "partial", "seen", "decoder")
+
+    def __init__(self):
+        self.lines = deque(maxlen=TAIL_LINES)
+        self.partial = ""
+        self.seen = 0
+        self.decoder = codecs.getincrementaldecoder("utf-8")("replace")
+
+    def update(self, app):
+        """Take in the app's new output. Returns True if there was any."""
+        with mux.lock:
+            new = app.bytes_read - self.seen
+            if new <= 0 or not app.buffer:
+                self.seen = app.bytes_read
+                return False
+            keep = min(new, len(app.buffer), TAIL_LINES * 256)
+            data = bytes(app.buffer[-keep:])
+            self.seen = app.bytes_read
+        if keep < new:
+            self.partial = ""  # we skipped ahead, so this starts mid-line
+            self.decoder.reset()
+        parts = (self.partial + self.decoder.decode(data)).split("\n")
+        self.partial = parts.pop()[-4096:]
+        self.lines.extend(parts)
+        return True
+
+    def render(self, count, width):
+        lines = list(self.lines)[-count:]
+        if self.partial:
+            lines = lines[1 - count:] + [self.partial] if count > 1 else [self.partial]
+        shown = []
+        for line in lines:
+            line = line.rstrip("\r").rsplit("\r", 1)[-1]  # a bare \r redraws the line
+            shown.append(ANSI_ESCAPE.sub("", line).expandtabs()[:width])
+        return shown
+
+def cycle_preview():
+    global preview_mode, preview_app
+    modes = [None, "bottom", "side"]
+    preview_mode = modes[(modes.index(preview_mode) + 1) % len(modes)]
+    preview_app = None  # redraw on the next frame
+
+def preview_height(max_y):
+    return max(1, min(config["preview"]["lines"], (max_y - 3) // 2))
+
+def list_size(stdscr):
+    """Rows and columns of the app list, which shares the screen with the preview pane."""
+    max_y, max_x = screen_size
+    if preview_mode == "bottom" and max_y >= 6:
+        return max_y - 2 - preview_height(max_y), max_x
+    if preview_mode == "side" and max_x >= 40:
+        return max_y - 1, max_x - max_x * 2 // 5 - 1
+    return max_y - 1, max_x
+
+def draw_preview(stdscr, app, visible_count, list_x):
+    """Draw the latest output of the selected app next to or under the list."""
+    global preview_app, preview_lines, preview_at, preview_selected, preview_selected_at
+    max_y, max_x = screen_size
+    if list_x < max_x:  # side: a column of "|" then the pane, under a title row
+        title_y, top, left, width = 1, 2, list_x + 1, max_x - list_x - 1
+    else:  # bottom: a title row under the list, then the pane
+        title_y, top, left, width = visible_count + 1, visible_count + 2, 0, max_x
+    rows = max_y - top
+    now = time.monotonic()
+    interval = 1.0 / config["preview"]["max_fps"]
+    if app is not preview_selected:
+        preview_selected, preview_selected_at = app, now
+    # Scrolling through the list only decodes the app the cursor stops on.
+    if preview_app is None or (now - preview_at >= interval
+                               and (app is preview_app or now - preview_selected_at >= interval)):
+        tail = preview_tails.get(app.name)
+        if tail is None:
+            tail = preview_tails[app.name] = LineTail()
+        if tail.update(app) or app is not preview_app or len(preview_lines) > rows:
+            preview_lines = tail.render(rows, width)
+        preview_app = app
+        preview_at = now
+    try:
+        if list_x < max_x:
+            for row in range(1, max_y):
+                stdscr.addstr(row, list_x, "|")
+        stdscr.addstr(title_y, left, ("-- " + preview_app.name + " ").ljust(width, "-")[:width])
+    except curses.error:
+        pass
+    for i in range(rows):
+        line = preview_lines[i] if i < len(preview_lines) else ""
+        try:
+            stdscr.addstr(top + i, left, line.ljust(width)[:width - 1 if top + i == max_y - 1 else width])
+        except curses.error:
+            pass
+
+def record_frame(lines):
+    """Record the app list as terminal output, if it changed since the last frame."""
+    global last_frame
+    frame = "\x1b[H" + "\r\n".join(line.rstrip() + "\x1b[K" for line in lines) + "\x1b[J"
+    if frame != last_frame:
+        last_frame = frame
+        mux.recorder.write("terminal", frame.encode())
+
+def apply_resize(stdscr):
+    """Lay out for the terminal's current size and pass it on to every app's pty."""
+    global screen_size, preview_app
+    curses.update_lines_cols()
+    screen_size = stdscr.getmaxyx()
+    mux.set_winsize(*screen_size)
+    preview_app = None
+    stdscr.clear()
+
+rows = []  # what the list shows: every app, plus the replicas of expanded replica sets
+expanded = set()  # names of the replica sets shown one row per replica
+rows_changed = False  # set when replica sets change, so the rows get rebuilt
+
+def refresh_rows():
+    """Rebuild the list rows, keeping the same app selected."""
+    global current_index, rows_changed
+    selected = rows[current_index] if current_index < len(rows) else None
+    rows[:] = [row for app in mux.table
+               for row in ((app, *app.replicas) if app.name in expanded else (app,))]
+    if selected is not None:
+        if selected not in rows:
+            selected = selected.group  # a replica that's gone or folded away
+        current_index = rows.index(selected) if selected in rows else 0
+    rows_changed = False
+
+def members(app):
+    """The apps a list row acts on: the whole replica set for a set's first row."""
+    return [app, *app.replicas]
+
+def row_label(app):
+    """The name and the 7-character status column of a list row."""
+    group = members(app)
+    up = sum(1 for member in group if member.running)
+    if app.replicas:
+        name = f"{app.name} [{'-' if app.name in expanded else '+'}{len(group)}]"
+    elif app.group is not None:
+        name = "  " + app.name
+    else:
+        name = app.name
+    if any(member.frozen for member in group if member.running):
+        status = "FROZEN "
+    elif up and any(member.health not in (None, "ok") for member in group if member.running):
+        status = "HUNG   "
+    elif up == len(group):
+        status = "RUNNING"
+    elif up:
+        status = f"{up}/{len(group)}".ljust(7)
+    elif (app.group or app).error is not None:
+        status = "BROKEN "
+    else:
+        status = "       "
+    return name, status
+
+def start_row(app):
+    for member in members(app):
+        mux.start_app(member.name)
+
+def stop_row(app):
+    for member in members(app):
+        if member.running:
+            mux.stop_app(member.name)
+
+def scale_row(app, step):
+    """Add or remove one replica of the app under the cursor."""
+    base = app.group or app
+    count = 1 + len(base.replicas) + step
+    if count >= 1:
+        mux.scale(base.name, count, pin=True if base.name in config["pin_replicas"] else None)
+        refresh_rows()
+
+def print_app_list(table,stdscr):
     global current_index
     global current_scroll
     global use_colors
     global header
-    max_y, max_x = stdscr.getmaxyx()
-    ststr=["RUNNING" if s else "       " for s in states]
-    visible_count = max_y - 1  # subtract 1 for header
-    max_scroll = max(0, len(apps) - visible_count)
+    render_start = time.perf_counter()
+    max_y, full_x = screen_size
+    visible_count, max_x = list_size(stdscr)  # header row and preview pane taken off
+    max_scroll = max(0, len(table) - visible_count)
     current_scroll = max(0, min(current_scroll, max_scroll))
     if current_index < current_scroll:
         current_scroll = current_index
     if current_index >= current_scroll + visible_count:
         current_scroll = current_index - visible_count + 1
     app_list = []
-    for i in range(current_scroll, min(current_scroll + visible_count, len(apps))):
+    for i in range(current_scroll, min(current_scroll + visible_count, len(table))):
         prefix = "> " if i == current_index else "  "
-        app_name = apps[i]
-        status = ststr[i]
-        action_btn = "stop " if states[i] else "start"
+        app = table[i]
+        app_name, status = row_label(app)
+        note = row_note(app)
+        action_btn = "stop " if status.strip() and status != "BROKEN " else "start"
         buttons = f"{action_btn} open exec"
-        base_len = len(prefix) + len(app_name) + 1 + len(status)
+        base_len = len(prefix) + len(app_name) + 1 + len(status) + len(note)
         buttons_len = len(buttons) + 1  
         if base_len + buttons_len + 3 <= max_x: 
             padding_len = max_x - base_len - buttons_len - 1
-            line = f"{prefix}{app_name} {status}" + " " * padding_len + buttons
+            line = f"{prefix}{app_name} {status}{note}" + " " * padding_len + buttons
         else:
             available_for_name = max_x - len(prefix) - 1 - len(status) - 1
             if len(app_name) > available_for_name:
                 app_name = app_name[:available_for_name-3] + "..."
             line = f"{prefix}{app_name} {status}"
         app_list.append(line[:max_x].ljust(max_x))
+    if mux.recorder is not None:
+        record_frame([header[:full_x]] + app_list)
     if use_colors:
-        header_line = (header[:max_x]).ljust(max_x)
+        header_line = (header[:full_x]).ljust(full_x)
         stdscr.addstr(0, 0, header_line, curses.color_pair(1))
     else:
-        stdscr.addstr(0, 0, header[:max_x])
+        stdscr.addstr(0, 0, header[:full_x])
     for i, e in enumerate(app_list):
         row = i + 1
         if row < max_y:
@@ -91,22 +1560,25 @@ def print_app_list(apps,states,stdscr):
             except curses.error:
                 pass
     
-    for row in range(len(app_list) + 1, max_y):
+    for row in range(len(app_list) + 1, visible_count + 1):
         try:
-            if row == max_y - 1:
+            if row == max_y - 1 and max_x == full_x:
                 stdscr.addstr(row, 0, " " * (max_x - 1))
             else:
                 stdscr.addstr(row, 0, " " * max_x)
         except curses.error:
             pass
     
+    if preview_mode is not None and (visible_count < max_y - 1 or max_x < full_x):
+        draw_preview(stdscr, table[current_index], visible_count, max_x)
+    
     stdscr.refresh()
+    metrics["render"].add(time.perf_counter() - render_start)
 
-def handle_click(mx,my,bstate,apps,states,stdscr):
+def handle_click(mx,my,bstate,table,stdscr):
     global current_index
     global current_scroll
-    max_y, max_x = stdscr.getmaxyx()
-    visible_count = max_y - 1  # subtract 1 for header
+    visible_count, max_x = list_size(stdscr)
     
     if bstate & BSTATE_SCROLLUP:
         if current_index > 0:
@@ -115,20 +1587,19 @@ def handle_click(mx,my,bstate,apps,states,stdscr):
                 current_scroll = current_index
         return None
     elif bstate & BSTATE_SCROLLDOWN:
-        if current_index < len(apps) - 1:
+        if current_index < len(table) - 1:
             current_index += 1
             if current_index >= current_scroll + visible_count:
                 current_scroll = current_index - visible_count + 1
         return None
     
-    if my >= 1:
+    if 1 <= my <= visible_count and mx < max_x:
         clicked_index = current_scroll + (my - 1)
-        if clicked_index < len(apps):
-            app_name = apps[clicked_index]
-            status = "RUNNING" if states[clicked_index] else "       "
-            action_btn = "stop " if states[clicked_index] else "start"
+        if clicked_index < len(table):
+            app_name, status = row_label(table[clicked_index])
+            action_btn = "stop " if status.strip() and status != "BROKEN " else "start"
             
-            base_len = 2 + len(app_name) + 1 + len(status)
+            base_len = 2 + len(app_name) + 1 + len(status) + len(row_note(table[clicked_index]))
             buttons = f"{action_btn} open exec"
             buttons_len = len(buttons) + 1
             
@@ -183,38 +1654,35 @@ def handle_click(mx,my,bstate,apps,states,stdscr):
 def addpad(s, width):
     return s[:width].ljust(width)
 
-def run_app_background(app_path):
-    try:
-        master_fd, slave_fd = pty.openpty()
-        
-        flags = fcntl.fcntl(master_fd, fcntl.F_GETFL)
-        fcntl.fcntl(master_fd, fcntl.F_SETFL, flags | os.O_NONBLOCK)
-        
-        proc = subprocess.Popen(
-            ['python3', app_path],
-            stdin=slave_fd,
-            stdout=slave_fd,
-            stderr=slave_fd,
-            close_fds=True
-        )
-        
-        os.close(slave_fd)
-        
-        return (proc, master_fd, bytearray())  # proc, master_fd, output_buffer
-    except Exception as e:
-        logging.error(f"Error starting app: {e}")
-        return None
-
-def run_app_foreground(app_path):
+def run_app_foreground(app):
     """Run app in foreground, replacing current process."""
-    os.execvp('python3', ['python3', app_path])
+    profile = (app.group or app).profile
+    log_event("app_exec", app=app.name, profile=profile.name if profile else None)
+    if mux is not None and mux.recorder is not None:
+        mux.recorder.close()
+    if exporter is not None:
+        exporter.close()
+    stop_logging()
+    if profile is None:
+        os.execvp('python3', ['python3', app.path])
+    command = profile.command(app.path)
+    if profile.cwd:
+        os.chdir(profile.cwd)
+    os.execve(command[0], command, profile.env or os.environ)
 
-def open_serial_monitor(stdscr, app_path, proc_tuple):
+def open_serial_monitor(stdscr, app):
     """Open serial monitor mode for an app - works like 'screen'."""
-    if proc_tuple is None:
+    if app is None:
         return None
+    import select
+    import termios
+    import tty
     
-    proc, master_fd, output_buffer = proc_tuple
+    global last_frame
+    proc, master_fd, output_buffer = app.proc, app.fd, app.buffer
+    recorder = mux.recorder
+    monitor_start = time.perf_counter()
+    log_event("attach", app=app.name, pid=proc.pid)
     
     curses.endwin()
     
@@ -227,11 +1695,22 @@ def open_serial_monitor(stdscr, app_path, proc_tuple):
         if output_buffer:
             sys.stdout.buffer.write(output_buffer)
             sys.stdout.buffer.flush()
+            if recorder is not None:
+                recorder.write("terminal", output_buffer)
             output_buffer.clear()
         
         ctrl_d_pressed = False
+        size_checked = time.monotonic()
         
         while proc.poll() is None:
+            if time.monotonic() - size_checked >= 0.25:
+                # curses isn't looking at SIGWINCH while we're attached, so poll for resizes
+                size_checked = time.monotonic()
+                try:
+                    cols, rows = os.get_terminal_size(stdin_fd)
+                    mux.set_winsize(rows, cols)
+                except OSError:
+                    pass
             readable, _, _ = select.select([sys.stdin, master_fd], [], [], 0.1)
             
             if master_fd in readable:
@@ -240,6 +1719,10 @@ def open_serial_monitor(stdscr, app_path, proc_tuple):
                     if data:
                         sys.stdout.buffer.write(data)
                         sys.stdout.buffer.flush()
+                        app.last_output = time.monotonic()
+                        if recorder is not None:
+                            recorder.write(app.name, data)
+                            recorder.write("terminal", data)
                 except OSError:
                     pass
             
@@ -274,6 +1757,9 @@ def open_serial_monitor(stdscr, app_path, proc_tuple):
                     if data:
                         sys.stdout.buffer.write(data)
                         sys.stdout.buffer.flush()
+                        if recorder is not None:
+                            recorder.write(app.name, data)
+                            recorder.write("terminal", data)
                     else:
                         break
             except:
@@ -283,8 +1769,25 @@ def open_serial_monitor(stdscr, app_path, proc_tuple):
     
     finally:
         termios.tcsetattr(stdin_fd, termios.TCSADRAIN, old_settings)
+        metrics["monitor"].add(time.perf_counter() - monitor_start)
+        log_event("detach", app=app.name, pid=proc.pid, running=proc.poll() is None)
+        last_frame = None  # the app list gets redrawn from scratch
     
-    return proc_tuple
+    return app
+
+def open_app(stdscr, table):
+    """Open the serial monitor for the selected app, starting it first if needed."""
+    app = mux.start_app(table[current_index].name)
+    if app:
+        mux.pause_reading(app)
+        restore_scrollback(app.name, app.buffer)
+        open_serial_monitor(stdscr, app)
+        if app.running and not mux.check_exited(app):
+            mux.resume_reading(app)
+    
+    stdscr.clear()
+    stdscr.refresh()
+    print_app_list(table, stdscr)
 
 def show_help(stdscr):
     """Display help text with scrolling support."""
@@ -335,12 +1838,82 @@ def show_help(stdscr):
     
     stdscr.clear()
 
+def startup_phase(name):
+    startup_phases.append((name, time.perf_counter() - startup_start, time.time()))
+
+def startup_profile_main(argv):
+    """`python3 main.py --startup-profile`: time a cold start up to the first frame.
+
+    Runs Duckymux once under `python3 -X importtime` (without restoring the
+    session), lets it paint and get ready, and reports where the time went:
+    the imports, then each startup phase. The budget (startup_budget_ms) is
+    checked against the wall time from launching python3 to the first frame,
+    which also covers starting the interpreter and compiling main.py."""
+    import subprocess
+    env = dict(os.environ, DUCKYMUX_STARTUP_PROFILE="1")
+    args = [a for a in argv if a != "--startup-profile"] + ["--no-restore"]
+    launched = time.time()
+    proc = subprocess.run([sys.executable, "-X", "importtime", os.path.abspath(__file__)] + args,
+                          env=env, stderr=subprocess.PIPE, text=True)
+    with open(os.path.abspath(__file__)) as f:
+        source = f.read()
+    compile_start = time.perf_counter()
+    compile(source, __file__, "exec")
+    main_compile = time.perf_counter() - compile_start
+    imports = []  # (cumulative us, module) for modules imported at the top level
+    phases = None
+    for line in proc.stderr.splitlines():
+        if line.startswith("import time:") and not line.endswith("package"):
+            _, cumulative, name = line[len("import time:"):].split("|")
+            if name.startswith(" ") and not name.startswith("  "):
+                imports.append((int(cumulative), name.strip()))
+        elif line.startswith("duckymux-startup "):
+            phases = json.loads(line[len("duckymux-startup "):])
+    if phases is None:
+        print(proc.stderr, file=sys.stderr)
+        print("Duckymux didn't get to its first frame", file=sys.stderr)
+        return 1
+    budget = load_config()["startup_budget_ms"] / 1000
+    import_total = sum(us for us, _ in imports) / 1e6
+    print(f"Duckymux startup (budget: first frame within {budget * 1000:.0f} ms)")
+    print(f"  {'compile main.py':16}{main_compile * 1000:8.1f} ms  (python3 never caches the script it runs)")
+    print(f"  {'imports':16}{import_total * 1000:8.1f} ms  (-X importtime, which adds some overhead)")
+    previous = 0.0
+    first_frame = None
+    for name, at, wall in phases:
+        print(f"  {name:16}{(at - previous) * 1000:8.1f} ms")
+        previous = at
+        if name == "first frame":
+            first_frame = wall - launched
+    if first_frame is None:
+        # e.g. an empty apps/ directory: main() shows a notice and returns early
+        print(f"  {'= first frame':16}      -- never painted (phases: {', '.join(name for name, _, _ in phases)})")
+        return 1
+    print(f"  {'= first frame':16}{first_frame * 1000:8.1f} ms after launch  "
+          + ("within budget" if first_frame <= budget else f"OVER BUDGET by {(first_frame - budget) * 1000:.1f} ms"))
+    print(f"  {'= ready':16}{(phases[-1][2] - launched) * 1000:8.1f} ms after launch")
+    print("slowest imports (cumulative):")
+    for us, name in sorted(imports, reverse=True)[:12]:
+        print(f"  {name:32}{us / 1000:8.1f} ms")
+    return 0 if first_frame <= budget else 1
+
 def main(stdscr):
     global header
     global use_colors
     global current_index
     global current_scroll
+    global config
+    global dump_requested
+    global mux
+    global preview_mode
+    global screen_size
+    global exporter
     
+    logging.getLogger().addHandler(EarlyLogs())  # e.g. a bad duckymux.json, until setup_logging()
+    config = load_config()
+    preview_mode = config["preview"]["mode"]
+    profiling_startup = "DUCKYMUX_STARTUP_PROFILE" in os.environ
+    startup_phase("config")
     curses.cbreak()
     try:
         curses.curs_set(0)
@@ -363,155 +1936,211 @@ def main(stdscr):
 
     curses.mousemask(curses.ALL_MOUSE_EVENTS | curses.REPORT_MOUSE_POSITION)
     stdscr.keypad(True)
+    startup_phase("curses")
 
-    apps = sorted([f for f in os.listdir("apps") if f.endswith('.py')])
-    if not apps:
+    mux = Mux("apps", index_path=config["app_index"])
+    mux.exit_hooks += [schedule_exited, finish_restart]
+    table = rows
+    refresh_rows()
+    screen_size = stdscr.getmaxyx()
+    mux.set_winsize(*screen_size)
+    startup_phase("app index")
+    if not table:
         stdscr.addstr(0, 0, "No apps found in 'apps' directory. Press any key to exit.")
         stdscr.refresh()
-        stdscr.getch()
+        if not profiling_startup:
+            stdscr.getch()
         return
     
-    processes = {}  # app_name -> (process, master_fd, output_buffer)
-    states = [False] * len(apps)  # running state for each app
     current_index = 0
     current_scroll = 0
+    print_app_list(table, stdscr)
+    startup_phase("first frame")
+    
+    # Everything below can wait until the list is on screen.
+    setup_logging(config["log"])
+    log_event("mux_start", pid=os.getpid())
+    startup_phase("logging")
+    if config["pipeline"]["enabled"]:
+        mux.start_pipeline(config["pipeline"]["queue_size"])
+    if config["precompile"]["enabled"]:
+        mux.start_compiler(config["precompile"]["interval"])
+    apply_profiles(mux)
+    mux.ring_sizes.update(config["shm_rings"])
+    start_probes(mux)
+    start_schedules(mux)
+    add_routes(mux, config["routes"])
+    for app_name in config["watch"]["apps"]:
+        if app_name in mux.by_name:
+            watch_app(mux.by_name[app_name])
+    if config["record"]["enabled"] or "--record" in sys.argv:
+        max_y, max_x = stdscr.getmaxyx()
+        record_dir = os.path.join(config["record"]["dir"], time.strftime("%Y%m%d-%H%M%S"))
+        mux.recorder = Recorder(record_dir, max_x, max_y)
+        log_event("recording", dir=record_dir)
+    if config["metrics"]["enabled"]:
+        exporter = MetricsExporter(mux, config["metrics"]["path"], config["metrics"]["interval"], all_metrics)
+    startup_phase("workers")
     
-    print_app_list(apps, states, stdscr)
+    if config["session"]["restore"] and "--no-restore" not in sys.argv:
+        snapshot = load_session()
+        if snapshot:
+            restore_session(mux, snapshot)
+    last_checkpoint = time.monotonic()
+    startup_phase("session")
+    control_server = open_control_socket(config["control"]["path"])
+    control_clients = {}  # socket -> (partial request bytes, unsent response bytes), see serve_control()
+    startup_phase("control socket")
+    
+    shed_level = 0
+    last_memory_check = time.monotonic()
+    
+    print_app_list(table, stdscr)
+    startup_phase("ready")
+    if profiling_startup:
+        mux.stop_pipeline()
+        mux.stop_compiler()
+        close_control_socket(control_server, control_clients)
+        stop_logging()
+        return
     stdscr.timeout(100)  # 100ms timeout for non-blocking getch
 
+    signal.signal(signal.SIGUSR1, request_dump)
+    key_start = None
+    resize_at = None  # when the last of a burst of KEY_RESIZEs came in
+    resizes = 0
+
     while True:
-        for i, app in enumerate(apps):
-            if app in processes:
-                proc_tuple = processes[app]
-                proc, master_fd, output_buffer = proc_tuple
-                
-                if proc.poll() is not None:
-                    try:
-                        os.close(master_fd)
-                    except:
-                        pass
-                    del processes[app]
-                    states[i] = False
-                else:
-                    states[i] = True
-                    try:
-                        while True:
-                            data = os.read(master_fd, 4096)
-                            if data:
-                                output_buffer.extend(data)
-                            else:
-                                break
-                    except (OSError, BlockingIOError):
-                        pass
-            else:
-                states[i] = False
+        loop_start = time.perf_counter()
+        if key_start is not None:
+            metrics["key"].add(loop_start - key_start)
+            key_start = None
+        now = time.monotonic()
+        if now - last_memory_check >= config["memory"]["check_interval"]:
+            last_memory_check = now
+            shed_level = check_memory(mux, shed_level)
+        if dump_requested:
+            dump_requested = False
+            dump_stats()
+        if now - last_checkpoint >= config["session"]["interval"]:
+            last_checkpoint = now
+            save_session(mux)
+        
+        if resize_at is not None and now - resize_at >= config["resize_debounce"]:
+            apply_resize(stdscr)
+            log_event("resize", level=logging.DEBUG, rows=screen_size[0], cols=screen_size[1], events=resizes)
+            resize_at = None
+            resizes = 0
         
-        print_app_list(apps, states, stdscr)
+        check_watched()
+        timers.advance()
+        mux.poll()
+        serve_control(control_server, control_clients, mux, stdscr)
+        if rows_changed:
+            refresh_rows()
+        if resize_at is None:  # mid-resize the old layout may not fit; draw once it settles
+            print_app_list(table, stdscr)
+        metrics["loop"].add(time.perf_counter() - loop_start)
         
         key = stdscr.getch()
         if key == -1:
             continue
+        if key == curses.KEY_RESIZE:
+            resize_at = time.monotonic()
+            resizes += 1
+            continue
+        key_start = time.perf_counter()
         
         if key == ord('q'):
-            for proc_tuple in processes.values():
-                proc, master_fd, _ = proc_tuple
-                try:
-                    proc.terminate()
-                    os.close(master_fd)
-                except:
-                    pass
+            save_session(mux, force=True, wait=True)
+            log_event("mux_quit", apps=[app.name for app in mux.running()])
+            mux.terminate_all()
+            mux.stop_pipeline()
+            mux.stop_compiler()
+            for app_name in list(probe_state):
+                drop_probe_state(app_name)
+            if mux.recorder is not None:
+                mux.recorder.close()
+            if exporter is not None:
+                exporter.close()
+            close_control_socket(control_server, control_clients)
+            stop_logging()
             break
         
         elif key == ord('h'):
             show_help(stdscr)
-            print_app_list(apps, states, stdscr)
+            print_app_list(table, stdscr)
+            key_start = None
+        
+        elif key == ord('i'):
+            show_stats(stdscr)
+            print_app_list(table, stdscr)
+            key_start = None
+        
+        elif key == ord('D'):
+            dump_stats()
+        
+        elif key == ord('P'):
+            toggle_profiling()
+        
+        elif key == ord('L'):
+            cycle_log_level()
+        
+        elif key == ord('p'):
+            cycle_preview()
         
         elif key == curses.KEY_UP or key == ord('k'):
             if current_index > 0:
                 current_index -= 1
-                max_y = stdscr.getmaxyx()[0]
-                visible_count = max_y - 1
                 if current_index < current_scroll:
                     current_scroll = current_index
         
         elif key == curses.KEY_DOWN or key == ord('j'):
-            if current_index < len(apps) - 1:
+            if current_index < len(table) - 1:
                 current_index += 1
-                max_y = stdscr.getmaxyx()[0]
-                visible_count = max_y - 1
+                visible_count = list_size(stdscr)[0]
                 if current_index >= current_scroll + visible_count:
                     current_scroll = current_index - visible_count + 1
         
         elif key == ord('r'):
-            app_path = os.path.join("apps", apps[current_index])
-            proc_tuple = run_app_background(app_path)
-            if proc_tuple:
-                processes[apps[current_index]] = proc_tuple
-                states[current_index] = True
+            start_row(table[current_index])
         
         elif key == ord('R'):
             # Kill all other apps first
-            for proc_tuple in processes.values():
-                proc, master_fd, _ = proc_tuple
-                try:
-                    proc.terminate()
-                    os.close(master_fd)
-                except:
-                    pass
-            app_path = os.path.join("apps", apps[current_index])
+            mux.terminate_all()
             curses.endwin()
-            run_app_foreground(app_path)
+            run_app_foreground(table[current_index])
         
         elif key == ord('o'):
-            app_name = apps[current_index]
-            app_path = os.path.join("apps", app_name)
-            
-            if app_name not in processes:
-                proc_tuple = run_app_background(app_path)
-                if proc_tuple:
-                    processes[app_name] = proc_tuple
-                    states[current_index] = True
-            else:
-                proc_tuple = processes[app_name]
-            
-            proc_tuple = open_serial_monitor(stdscr, app_path, proc_tuple)
-            
-            if proc_tuple:
-                proc, master_fd, _ = proc_tuple
-                if proc.poll() is None:
-                    processes[app_name] = proc_tuple
-                    states[current_index] = True
-                else:
-                    try:
-                        os.close(master_fd)
-                    except:
-                        pass
-                    if app_name in processes:
-                        del processes[app_name]
-                    states[current_index] = False
-            
-            stdscr.clear()
-            stdscr.refresh()
-            print_app_list(apps, states, stdscr)
+            open_app(stdscr, table)
+            key_start = None  # time spent attached is in metrics["monitor"]
         
         elif key == ord('s'):
-            app_name = apps[current_index]
-            if app_name in processes:
-                proc, master_fd, _ = processes[app_name]
-                try:
-                    proc.terminate()
-                    proc.wait(timeout=2)
-                except:
-                    try:
-                        proc.kill()
-                    except:
-                        pass
-                try:
-                    os.close(master_fd)
-                except:
-                    pass
-                del processes[app_name]
-                states[current_index] = False
+            stop_row(table[current_index])
+        
+        elif key == ord('w'):
+            app = table[current_index]
+            watch_app(app, (app.group or app).name not in watching)
+        
+        elif key == ord('f'):
+            group = [member for member in members(table[current_index]) if member.running]
+            freeze = not any(member.frozen for member in group)
+            for member in group:
+                if member.frozen != freeze:
+                    mux.freeze_app(member.name)
+        
+        elif key == ord('+'):
+            scale_row(table[current_index], 1)
+        
+        elif key == ord('-'):
+            scale_row(table[current_index], -1)
+        
+        elif key == ord(' '):
+            app = table[current_index]
+            app = app.group or app
+            if app.replicas:
+                expanded.symmetric_difference_update({app.name})
+                refresh_rows()
         
         elif key == curses.KEY_MOUSE:
             try:
@@ -519,81 +2148,36 @@ def main(stdscr):
             except curses.error:
                 continue
             
-            action = handle_click(mx, my, bstate, apps, states, stdscr)
+            action = handle_click(mx, my, bstate, table, stdscr)
             if action == 'toggle_run':
-                app_name = apps[current_index]
-                app_path = os.path.join("apps", app_name)
+                app = table[current_index]
                 
-                if states[current_index]:
-                    if app_name in processes:
-                        proc, master_fd, _ = processes[app_name]
-                        try:
-                            proc.terminate()
-                            proc.wait(timeout=2)
-                        except:
-                            try:
-                                proc.kill()
-                            except:
-                                pass
-                        try:
-                            os.close(master_fd)
-                        except:
-                            pass
-                        del processes[app_name]
-                        states[current_index] = False
+                if any(member.running for member in members(app)):
+                    stop_row(app)
                 else:
-                    proc_tuple = run_app_background(app_path)
-                    if proc_tuple:
-                        processes[app_name] = proc_tuple
-                        states[current_index] = True
+                    start_row(app)
             
             elif action == 'run_bg':
-                app_path = os.path.join("apps", apps[current_index])
-                proc_tuple = run_app_background(app_path)
-                if proc_tuple:
-                    processes[apps[current_index]] = proc_tuple
-                    states[current_index] = True
+                start_row(table[current_index])
             
             elif action == 'exec_fg':
-                for proc_tuple in processes.values():
-                    proc, master_fd, _ = proc_tuple
-                    try:
-                        proc.terminate()
-                        os.close(master_fd)
-                    except:
-                        pass
-                app_path = os.path.join("apps", apps[current_index])
+                mux.terminate_all()
                 curses.endwin()
-                run_app_foreground(app_path)
+                run_app_foreground(table[current_index])
             
             elif action == 'monitor':
-                app_name = apps[current_index]
-                app_path = os.path.join("apps", app_name)
-                if app_name not in processes:
-                    proc_tuple = run_app_background(app_path)
-                    if proc_tuple:
-                        processes[app_name] = proc_tuple
-                        states[current_index] = True
-                else:
-                    proc_tuple = processes[app_name]
-                proc_tuple = open_serial_monitor(stdscr, app_path, proc_tuple)
-                
-                if proc_tuple:
-                    proc, master_fd, _ = proc_tuple
-                    if proc.poll() is None:
-                        processes[app_name] = proc_tuple
-                        states[current_index] = True
-                    else:
-                        try:
-                            os.close(master_fd)
-                        except:
-                            pass
-                        if app_name in processes:
-                            del processes[app_name]
-                        states[current_index] = False
-                
-                stdscr.clear()
-                stdscr.refresh()
-                print_app_list(apps, states, stdscr)
+                open_app(stdscr, table)
+                key_start = None
 
-curses.wrapper(main)
+if __name__ == '__main__':
+    if sys.argv[1:2] == ['ctl']:
+        sys.exit(ctl_main(sys.argv[2:]))
+    if sys.argv[1:2] == ['replay']:
+        sys.exit(replay_main(sys.argv[2:]))
+    if sys.argv[1:2] == ['compare']:
+        sys.exit(compare_main(sys.argv[2:]))
+    if "--startup-profile" in sys.argv:
+        sys.exit(startup_profile_main(sys.argv[1:]))
+    curses.wrapper(main)
+    if "DUCKYMUX_STARTUP_PROFILE" in os.environ:
+        print("duckymux-startup " + json.dumps(startup_phases), file=sys.stderr)
@@ -0,0 +1,42 @@
+import os
+import sys
+import time
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from duckymux import Mux  # noqa: E402
+
+
+@pytest.fixture
+def make_mux(tmp_path):
+    """make_mux({"name.py": source, ...}) -> a Mux over a scratch apps directory."""
+    muxes = []
+
+    def make(apps, **kwargs):
+        apps_dir = tmp_path / "apps"
+        apps_dir.mkdir(exist_ok=True)
+        for name, source in apps.items():
+            (apps_dir / name).write_text(source)
+        mux = Mux(str(apps_dir), **kwargs)
+        muxes.append(mux)
+        return mux
+
+    yield make
+    for mux in muxes:
+        for app in mux.running():
+            mux.stop_app(app.name)
+        mux.stop_pipeline()
+
+
+def wait_until(condition, timeout=5.0, mux=None):
+    """Poll the mux (if any) until condition() is true. Returns whether it became true."""
+    end = time.monotonic() + timeout
+    while time.monotonic() < end:
+        if mux is not None:
+            mux.poll()
+        if condition():
+            return True
+        time.sleep(0.01)
+    return False
@@ -0,0 +1,163 @@
+import json
+import socket
+import time
+
+import main
+from conftest import wait_until
+
+STUBBORN = ("import signal, time\nsignal.signal(signal.SIGTERM, lambda *a: (time.sleep(0.5), exit(0)))\n"
+            "print('up', flush=True)\nwhile True:\n    time.sleep(1)\n")
+
+
+def setup_main(monkeypatch, mux):
+    monkeypatch.setattr(main, "config", dict(main.default_config))
+    monkeypatch.setattr(main, "mux", mux)
+    monkeypatch.setattr(main, "pending_restarts", {})
+    mux.exit_hooks.append(main.finish_restart)
+
+
+def test_stop_does_not_wait_for_the_app(make_mux, monkeypatch):
+    mux = make_mux({"a.py": STUBBORN, "b.py": STUBBORN})
+    setup_main(monkeypatch, mux)
+    apps = [mux.start_app("a.py"), mux.start_app("b.py")]
+    assert wait_until(lambda: all(b"up" in app.buffer for app in apps), mux=mux)
+    start = time.monotonic()
+    assert main.handle_control({"cmd": "stop", "match": "*"}, mux, None) == {"ok": True, "stop": ["a.py", "b.py"]}
+    assert time.monotonic() - start < 0.2
+    assert wait_until(lambda: not any(app.running for app in apps), mux=mux)
+
+
+def test_restart_starts_the_app_once_it_exited(make_mux, monkeypatch):
+    mux = make_mux({"a.py": STUBBORN})
+    setup_main(monkeypatch, mux)
+    app = mux.start_app("a.py")
+    assert wait_until(lambda: b"up" in app.buffer, mux=mux)
+    old_pid = app.pid
+    start = time.monotonic()
+    assert main.handle_control({"cmd": "restart", "match": "a.py"}, mux, None)["restart"] == ["a.py"]
+    assert time.monotonic() - start < 0.2
+    assert app.running and app.pid == old_pid  # still shutting down
+    assert wait_until(lambda: app.pid != old_pid, mux=mux)
+    assert app.running
+    assert app.starts == 2
+
+
+def test_probe_restart_does_not_wait_for_the_app(make_mux, monkeypatch):
+    mux = make_mux({"a.py": STUBBORN})
+    setup_main(monkeypatch, mux)
+    monkeypatch.setattr(main, "timers", main.TimerWheel(0.1))
+    monkeypatch.setattr(main, "probe_state", {})
+    app = mux.start_app("a.py")
+    assert wait_until(lambda: b"up" in app.buffer, mux=mux)
+    old_pid = app.pid
+    time.sleep(0.05)
+    start = time.monotonic()
+    main.run_probe(app, {"output_timeout": 0.01, "action": "restart"})
+    assert time.monotonic() - start < 0.2
+    assert app.health.startswith("no output")
+    assert wait_until(lambda: app.pid != old_pid, mux=mux)
+    assert app.running and app.starts == 2
+
+
+def test_overlapping_scheduled_run_kills_without_waiting(make_mux, monkeypatch):
+    mux = make_mux({"a.py": STUBBORN})
+    setup_main(monkeypatch, mux)
+    monkeypatch.setattr(main, "config", dict(main.default_config, schedules={"a.py": {"every": 3600, "overlap": "kill"}}))
+    monkeypatch.setattr(main, "timers", main.TimerWheel(0.1))
+    monkeypatch.setattr(main, "schedules", {})
+    mux.exit_hooks.append(main.schedule_exited)
+    main.start_schedules(mux)
+    state = main.schedules["a.py"]
+    app = mux.start_app("a.py")
+    assert wait_until(lambda: b"up" in app.buffer, mux=mux)
+    old_pid = app.pid
+    start = time.monotonic()
+    main.run_scheduled(app, state)
+    assert time.monotonic() - start < 0.2
+    assert wait_until(lambda: app.pid != old_pid, mux=mux)
+    assert app.running and state["runs"] == 1
+
+
+def test_watch_restart_does_not_wait_for_the_app(make_mux, monkeypatch):
+    mux = make_mux({"a.py": STUBBORN})
+    setup_main(monkeypatch, mux)
+    monkeypatch.setattr(main, "watch_app", lambda app, on=True: None)
+    app = mux.start_app("a.py")
+    assert wait_until(lambda: b"up" in app.buffer, mux=mux)
+    old_pid = app.pid
+    start = time.monotonic()
+    main.restart_watched(app, {"timer": None, "changed": {app.path}, "restarts": 0})
+    assert time.monotonic() - start < 0.2
+    assert wait_until(lambda: app.pid != old_pid, mux=mux)
+    assert wait_until(lambda: bytes(app.buffer).count(b"up") == 2, mux=mux)
+    assert b"a.py changed, restarted by duckymux" in app.buffer
+
+
+def test_send_keeps_non_ascii_text(make_mux, monkeypatch):
+    mux = make_mux({"echo.py": "import sys\nprint(repr(sys.stdin.buffer.readline()), flush=True)\n"
+                               "import time\ntime.sleep(60)\n"})
+    setup_main(monkeypatch, mux)
+    app = mux.start_app("echo.py")
+    data = main.unescape("é \\xff\\t\\n")
+    assert data.startswith("é \udcff\t")
+    assert main.handle_control(json.loads(json.dumps({"cmd": "send", "app": "echo.py", "data": data})), mux, None)["ok"]
+    assert wait_until(lambda: b"\\xc3\\xa9 \\xff\\t\\n'" in app.buffer, mux=mux)
+
+
+def serve(tmp_path, monkeypatch, mux):
+    setup_main(monkeypatch, mux)
+    path = str(tmp_path / "ctl.sock")
+    server = main.open_control_socket(path)
+    client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    client.connect(path)
+    return server, client
+
+
+def test_a_client_that_stops_reading_does_not_block_serving(make_mux, tmp_path, monkeypatch):
+    mux = make_mux({f"app{i}.py": "" for i in range(20)})
+    server, client = serve(tmp_path, monkeypatch, mux)
+    clients = {}
+    requests = 200  # a few MB of replies, more than the socket holds
+    client.sendall(b'{"cmd": "list"}\n' * requests)
+    slowest = 0.0
+    for _ in range(50):
+        start = time.monotonic()
+        main.serve_control(server, clients, mux, None)
+        slowest = max(slowest, time.monotonic() - start)
+    assert slowest < 0.5
+    (pending, out), = clients.values()
+    assert out  # waiting for the client
+    client.setblocking(False)
+    received = bytearray()
+    end = time.monotonic() + 10
+    while received.count(b"\n") < requests and time.monotonic() < end:
+        main.serve_control(server, clients, mux, None)
+        try:
+            received.extend(client.recv(1 << 20))
+        except BlockingIOError:
+            pass
+    responses = received.decode().splitlines()
+    assert len(responses) == requests
+    assert all(json.loads(line)["ok"] for line in responses)
+    main.close_control_socket(server, clients)
+    client.close()
+
+
+def test_an_endless_request_drops_the_client(make_mux, tmp_path, monkeypatch):
+    mux = make_mux({})
+    server, client = serve(tmp_path, monkeypatch, mux)
+    clients = {}
+    assert wait_until(lambda: main.serve_control(server, clients, mux, None) or clients)
+    client.setblocking(False)
+    sent = 0
+    while clients and sent < 10 * main.CONTROL_REQUEST_MAX:
+        try:
+            sent += client.send(b"x" * 65536)
+        except BlockingIOError:
+            pass
+        except OSError:
+            break  # dropped
+        main.serve_control(server, clients, mux, None)
+    assert not clients
+    main.close_control_socket(server, clients)
+    client.close()
@@ -0,0 +1,111 @@
+import os
+import random
+import signal
+import threading
+import time
+
+import pytest
+
+import duckyshm
+from duckyshm import POSITION, RECORD, WRITE_AT, Ring
+
+
+@pytest.fixture
+def ring_pair():
+    """(Duckymux's side, the app's side) of a 64-byte ring."""
+    reader = Ring.create(64)
+    writer = Ring(reader.fd, reader.bell)
+    yield reader, writer
+    writer.map.close()
+    reader.close()
+
+
+def test_records_come_out_in_order_across_laps(ring_pair):
+    reader, writer = ring_pair
+    rng = random.Random(3)
+    sent, got = [], []
+    for i in range(500):
+        record = bytes(rng.randrange(256) for _ in range(rng.randrange(1, 40)))
+        if writer.capacity - (writer.written - reader.read_at) < RECORD.size + len(record):
+            got.append(reader.read())
+            writer.read_at = reader.read_at
+        writer.write(record)
+        sent.append(record)
+    got.append(reader.read())
+    assert b"".join(got) == b"".join(sent)
+    assert reader.read_at == writer.written > 10 * reader.capacity
+
+
+def test_zeroed_header_is_not_a_record(ring_pair):
+    reader, writer = ring_pair
+    # the write position is visible before the record's bytes are
+    POSITION.pack_into(writer.map, WRITE_AT, RECORD.size)
+    assert reader.read() == b""
+    assert reader.read_at == 0
+    writer.write(b"hello")
+    assert reader.read() == b"hello"
+
+
+def test_last_laps_record_is_not_read_again(ring_pair):
+    reader, writer = ring_pair
+    writer.write(b"x" * 24)
+    writer.write(b"y" * 24)
+    assert reader.read() == b"x" * 24 + b"y" * 24
+    # a lap later, the old record is still where the next one goes
+    POSITION.pack_into(writer.map, WRITE_AT, writer.written + RECORD.size + 24)
+    assert reader.read() == b""
+    assert reader.read_at == 64
+    writer.read_at = reader.read_at
+    writer.write(b"z" * 24)
+    assert reader.read() == b"z" * 24
+
+
+def test_torn_record_waits_for_the_rest(ring_pair):
+    reader, writer = ring_pair
+    writer.write(b"abcdef")
+    saved = writer.map[duckyshm.HEAD + RECORD.size + 3]
+    writer.map[duckyshm.HEAD + RECORD.size + 3] = 0
+    assert reader.read() == b""
+    writer.map[duckyshm.HEAD + RECORD.size + 3] = saved
+    assert reader.read() == b"abcdef"
+
+
+def test_a_record_may_fill_the_ring_and_empty_ones_are_skipped(ring_pair):
+    reader, writer = ring_pair
+    writer.write(b"a" * (reader.capacity - RECORD.size))
+    assert reader.read() == b"a" * (reader.capacity - RECORD.size)
+    writer.read_at = reader.read_at
+    writer.write(b"")
+    assert reader.read() == b""
+
+
+def chatty(go):
+    return (f"import duckyshm, os, time\nwhile not os.path.exists({str(go)!r}):\n    time.sleep(0.01)\n"
+            "for i in range(20000):\n    duckyshm.write(b'record %d\\n' % i)\n"
+            "    if i % 100 == 0:\n        print('printed', i, flush=True)\n"
+            "duckyshm.write(b'end\\n')\nwhile True:\n    time.sleep(1)\n")
+
+
+def test_pipeline_with_a_full_queue_keeps_going(make_mux, tmp_path):
+    go = tmp_path / "go"
+    names = [f"chatty{i}.py" for i in range(4)]
+    mux = make_mux({name: chatty(go) for name in names})
+    for name in names:
+        mux.ring_sizes[name] = 1024
+    mux.start_pipeline(queue_size=2)
+    apps = [mux.start_app(name) for name in names]
+    assert all(app.ring is not None for app in apps)
+    go.touch()
+    end = time.monotonic() + 20
+    while not all(b"end" in app.buffer for app in apps) and time.monotonic() < end:
+        if not mux.lock.acquire(timeout=2):
+            for app in apps:
+                os.killpg(app.pid, signal.SIGKILL)
+            # keep the queue empty so the reader gets unstuck and the apps can be stopped
+            threading.Thread(target=lambda: [mux._chunks.task_done() for _ in iter(mux._chunks.get, None)],
+                             daemon=True).start()
+            pytest.fail("the reader thread got stuck holding the lock")
+        mux.lock.release()
+        time.sleep(0.001)
+    for app in apps:
+        assert bytes(app.buffer).count(b"record") == 20000
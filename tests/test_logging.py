@@ -0,0 +1,26 @@
+import json
+import logging
+
+import main
+
+
+def test_config_errors_wait_for_the_log_file(tmp_path, capfd):
+    root = logging.getLogger()
+    saved = root.handlers[:], root.level
+    bad = tmp_path / "duckymux.json"
+    bad.write_text("{not json")
+    try:
+        root.handlers[:] = [main.EarlyLogs()]
+        config = main.load_config(str(bad))
+        assert config["log"] == main.default_config["log"]
+        assert capfd.readouterr().err == ""  # nothing under the curses screen
+        log_path = tmp_path / "duckymux.log"
+        main.setup_logging(dict(config["log"], path=str(log_path)))
+        main.stop_logging()
+        entries = [json.loads(line) for line in log_path.read_text().splitlines()]
+        assert any(entry["lvl"] == "ERROR" and "duckymux.json" in entry["msg"] for entry in entries)
+    finally:
+        for h in root.handlers[:]:
+            root.removeHandler(h)
+        root.handlers[:], level = saved
+        root.setLevel(level)
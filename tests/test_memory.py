@@ -0,0 +1,50 @@
+import time
+
+import main
+from conftest import wait_until
+
+SLEEPER = "import time\nprint('up', flush=True)\nwhile True:\n    time.sleep(1)\n"
+STUBBORN = ("import signal, time\nsignal.signal(signal.SIGTERM, signal.SIG_IGN)\n"
+            "print('up', flush=True)\nwhile True:\n    time.sleep(1)\n")
+
+
+def test_read_memory_pressure(tmp_path):
+    psi = tmp_path / "memory"
+    psi.write_text("some avg10=12.50 avg60=3.00 avg300=1.00 total=1\nfull avg10=1.00 avg60=0 avg300=0 total=1\n")
+    meminfo = tmp_path / "meminfo"
+    meminfo.write_text("MemTotal:  1000000 kB\nMemFree:  5000 kB\nMemAvailable:  20000 kB\n")
+    assert main.read_memory_pressure(str(psi), str(meminfo)) == (12.5, 20000)
+    assert main.read_memory_pressure(str(tmp_path / "missing"), str(tmp_path / "missing")) == (None, None)
+
+
+def test_thresholds():
+    mem_config = main.default_config["memory"]
+    assert not main.memory_under_pressure(None, None, mem_config)
+    assert not main.memory_under_pressure(1.0, 10 ** 6, mem_config)
+    assert main.memory_under_pressure(mem_config["psi_threshold"], 10 ** 6, mem_config)
+    assert main.memory_under_pressure(None, mem_config["min_available_kb"] - 1, mem_config)
+
+
+def test_shedding_escalates_and_resets(make_mux, monkeypatch):
+    mux = make_mux({"keep.py": SLEEPER, "spare.py": STUBBORN})
+    monkeypatch.setattr(main, "config", dict(main.default_config, low_priority=["spare.py"]))
+    keep, spare = mux.start_app("keep.py"), mux.start_app("spare.py")
+    assert wait_until(lambda: b"up" in keep.buffer and b"up" in spare.buffer, mux=mux)
+    keep.buffer.extend(b"x" * 100000)
+    calm, pressed = (0.0, 10 ** 6), (50.0, 1000)
+
+    assert main.check_memory(mux, 0, calm) == 0
+    assert main.check_memory(mux, 0, pressed) == 1  # compact_scrollback
+    assert len(keep.buffer) == main.config["memory"]["scrollback_keep"]
+    assert main.check_memory(mux, 1, pressed) == 2  # evict_scrollback
+    assert len(keep.buffer) == 0
+
+    start = time.monotonic()
+    assert main.check_memory(mux, 2, pressed) == 3  # stop_low_priority
+    assert time.monotonic() - start < 0.5, "shedding waited for the app to stop"
+    assert spare.running and keep.running
+    assert wait_until(lambda: not spare.running, mux=mux)  # SIGKILLed after the grace period
+    assert keep.running
+
+    assert main.check_memory(mux, 3, pressed) == 3  # nothing left to shed
+    assert main.check_memory(mux, 3, calm) == 0
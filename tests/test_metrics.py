@@ -0,0 +1,97 @@
+import os
+import re
+
+from conftest import wait_until
+from duckymux import Histogram, MetricsExporter, _label
+
+IDLE = "import time\nwhile True:\n    time.sleep(1)\n"
+SAMPLE = re.compile(r'^([a-z_]+)(\{[a-z]+="(?:[^"\\]|\\.)*"\})? (\S+)$')
+
+
+def families(text):
+    """{family: (type, [(name, labels, value)])}, checking the layout on the way."""
+    assert text.endswith("# EOF\n")
+    lines = text[:-1].split("\n")
+    assert lines.pop() == "# EOF"
+    found = {}
+    current = None
+    for line in lines:
+        if line.startswith("# HELP "):
+            current = line.split()[2]
+            assert current not in found
+        elif line.startswith("# TYPE "):
+            assert line.split()[2] == current
+            found[current] = (line.split()[3], [])
+        else:
+            name, labels, value = SAMPLE.match(line).groups()
+            kind, samples = found[current]
+            suffixes = {"counter": ("_total",), "gauge": ("",), "histogram": ("_bucket", "_count", "_sum")}[kind]
+            assert name in {current + suffix for suffix in suffixes}
+            samples.append((name, labels, float(value)))
+    return found
+
+
+def test_render_layout(make_mux, tmp_path):
+    mux = make_mux({"up.py": IDLE, "quits.py": "exit(3)\n"})
+    mux.start_app("up.py")
+    quits = mux.start_app("quits.py")
+    assert wait_until(lambda: not quits.running, mux=mux)
+    exporter = MetricsExporter(mux, str(tmp_path / "duckymux.prom"), interval=3600)
+    try:
+        found = families(exporter.render())
+    finally:
+        exporter.close()
+    kind, samples = found["duckymux_app_up"]
+    assert kind == "gauge"
+    assert sorted(samples) == [("duckymux_app_up", '{app="quits.py"}', 0.0), ("duckymux_app_up", '{app="up.py"}', 1.0)]
+    assert found["duckymux_app_exit_code"][1] == [("duckymux_app_exit_code", '{app="quits.py"}', 3.0)]
+    kind, samples = found["duckymux_app_starts"]
+    assert kind == "counter"
+    assert sorted(samples) == [("duckymux_app_starts_total", '{app="quits.py"}', 1.0),
+                               ("duckymux_app_starts_total", '{app="up.py"}', 1.0)]
+    assert found["duckymux_app_processes"][1][0][2] >= 1
+
+
+def test_labels_are_escaped():
+    assert _label('a"b\\c\nd') == 'a\\"b\\\\c\\nd'
+
+
+def test_histogram_buckets_are_cumulative(make_mux, tmp_path):
+    mux = make_mux({"a.py": IDLE})
+    loop = Histogram()
+    for seconds in (0.000003, 0.000003, 0.0005, 2.0):
+        loop.add(seconds)
+    exporter = MetricsExporter(mux, str(tmp_path / "duckymux.prom"), interval=3600, histograms=lambda: {"loop": loop})
+    try:
+        kind, samples = families(exporter.render())["duckymux_loop_seconds"]
+    finally:
+        exporter.close()
+    assert kind == "histogram"
+    buckets = [(labels, value) for name, labels, value in samples if name.endswith("_bucket")]
+    assert buckets[-1] == ('{le="+Inf"}', 4.0)
+    counts = [value for _, value in buckets]
+    assert counts == sorted(counts)
+    bounds = {float(labels[5:-2]): value for labels, value in buckets[:-1]}
+    assert bounds[0.000002] == 0 and bounds[0.000004] == 2
+    assert bounds[0.001024] == 3 and bounds[2.097152] == 4
+    assert ("duckymux_loop_seconds_count", None, 4.0) in samples
+    assert [value for name, _, value in samples if name.endswith("_sum")] == [loop.total]
+
+
+def test_file_is_only_rewritten_when_something_changed(make_mux, tmp_path):
+    mux = make_mux({"a.py": IDLE})
+    path = tmp_path / "duckymux.prom"
+    exporter = MetricsExporter(mux, str(path), interval=3600)
+    try:
+        assert exporter.write()
+        assert not exporter.write()
+        assert path.read_text() == exporter.render()
+        mux.start_app("a.py")
+        assert exporter.write()
+        assert 'duckymux_app_up{app="a.py"} 1' in path.read_text()
+    finally:
+        mux.stop_app("a.py")
+        exporter.close()
+    assert exporter.writes == 3  # the last one on close, with a.py down again
+    assert 'duckymux_app_up{app="a.py"} 0' in path.read_text()
+    assert sorted(os.listdir(tmp_path)) == ["apps", "duckymux.prom"]  # no temporary files left
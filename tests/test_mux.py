@@ -0,0 +1,107 @@
+import os
+
+import pytest
+
+from duckymux import App, Mux, RUNNING, STOPPED
+from conftest import wait_until
+
+IDLE = "import time\nwhile True:\n    time.sleep(1)\n"
+ECHO = "import sys\nfor line in sys.stdin:\n    print('got', line.strip(), flush=True)\n"
+QUICK = "print('bye')\n"
+
+
+def test_app_records_are_slotted():
+    app = App(0, "a.py", "apps/a.py")
+    assert not hasattr(app, "__dict__")
+    with pytest.raises(AttributeError):
+        app.colour = "red"
+
+
+def test_table_is_indexed_by_position_name_and_fd(make_mux):
+    mux = make_mux({"b.py": IDLE, "a.py": IDLE, "notes.txt": ""})
+    assert [app.name for app in mux.table] == ["a.py", "b.py"]
+    assert [app.index for app in mux.table] == [0, 1]
+    assert mux.by_name["b.py"] is mux.table[1]
+    assert mux.by_fd == {} and mux.running() == []
+    app = mux.start_app("b.py")
+    assert app.state == RUNNING and mux.by_fd == {app.fd: app}
+    assert mux.running() == [app]
+    fd = app.fd
+    mux.stop_app("b.py")
+    assert app.state == STOPPED and app.fd == -1 and app.buffer is None
+    assert mux.by_fd == {}
+    with pytest.raises(OSError):
+        os.fstat(fd)
+
+
+def test_index_cache(tmp_path, make_mux):
+    index = str(tmp_path / "index.json")
+    mux = make_mux({"a.py": IDLE}, index_path=index)
+    assert os.path.exists(index)
+    os.rename(os.path.join(mux.apps_dir, "a.py"), os.path.join(mux.apps_dir, "c.py"))
+    assert Mux(mux.apps_dir, index_path=index).list_apps() == ["c.py"]  # the rename moved the mtime
+
+
+@pytest.mark.parametrize("pipeline", [False, True])
+def test_poll_touches_only_apps_with_output(make_mux, pipeline):
+    mux = make_mux({"echo.py": ECHO, "idle.py": IDLE, "quick.py": QUICK})
+    if pipeline:
+        mux.start_pipeline()
+    echo, idle = mux.start_app("echo.py"), mux.start_app("idle.py")
+    mux.poll()
+    mux.write_app("echo.py", b"hi\n")
+    seen = set()
+    assert wait_until(lambda: seen.update(mux.changed) or b"got hi" in echo.buffer, mux=mux)
+    assert echo in seen and idle not in seen
+    assert echo.bytes_read >= len(b"got hi") and idle.bytes_read == 0
+
+    quick = mux.start_app("quick.py")
+    exited = []
+    assert wait_until(lambda: exited.extend(mux.poll()) or quick in exited, timeout=5)
+    assert quick.state == STOPPED and quick.returncode == 0
+    assert idle.running and echo.running
+
+
+def collect_until(mux, app_name, text, timeout=5.0):
+    """Output of the app (read through the asyncio API) until text turns up in it."""
+    import asyncio
+
+    async def collect():
+        got = bytearray()
+        async for chunk in mux.output(app_name, backlog=True):
+            got.extend(chunk)
+            if text in got:
+                break
+        return bytes(got)
+    return asyncio.wait_for(collect(), timeout)
+
+
+def test_asyncio_start_write_read_stop(make_mux):
+    import asyncio
+    mux = make_mux({"echo.py": ECHO})
+
+    async def session():
+        pid = await mux.start("echo.py")
+        assert mux.by_name["echo.py"].pid == pid
+        await mux.write("echo.py", b"hello\n")
+        got = await collect_until(mux, "echo.py", b"got hello")
+        await mux.stop("echo.py")
+        return got
+    got = asyncio.run(session())
+    assert b"got hello" in got
+    assert mux.by_name["echo.py"].state == STOPPED
+
+
+def test_asyncio_output_split_across_chunks_and_exit(make_mux):
+    import asyncio
+    lines = 5000
+    mux = make_mux({"many.py": f"for i in range({lines}):\n    print('line', i)\nprint('end')\nexit(4)\n"})
+
+    async def session():
+        await mux.start("many.py")
+        got = await collect_until(mux, "many.py", b"end")
+        return got, await asyncio.wait_for(mux.wait("many.py"), 5)
+    got, code = asyncio.run(session())
+    assert code == 4
+    assert got.replace(b"\r\n", b"\n").split(b"\n")[:lines] == [b"line %d" % i for i in range(lines)]
+    assert mux.by_name["many.py"].reads > 1  # it did come in pieces
@@ -0,0 +1,53 @@
+import threading
+import time
+
+import main
+from duckymux import App
+
+
+class Screen:
+    def addstr(self, *args):
+        pass
+
+
+def make_app(i):
+    app = App(i, f"app{i}.py", f"apps/app{i}.py")
+    app.buffer = bytearray(b"line\n" * 1000)
+    app.bytes_read = len(app.buffer)
+    return app
+
+
+class FakeMux:
+    lock = threading.Lock()
+
+
+def test_scrolling_through_apps_decodes_only_where_the_cursor_rests(monkeypatch):
+    monkeypatch.setattr(main, "mux", FakeMux())
+    monkeypatch.setattr(main, "config", dict(main.default_config, preview=dict(main.default_config["preview"], max_fps=10)))
+    for name in ("preview_tails", "preview_lines"):
+        monkeypatch.setattr(main, name, type(getattr(main, name))())
+    monkeypatch.setattr(main, "preview_app", None)
+    monkeypatch.setattr(main, "preview_selected", None)
+    decoded = []
+    update = main.LineTail.update
+    monkeypatch.setattr(main.LineTail, "update", lambda tail, app: decoded.append(app) or update(tail, app))
+    apps = [make_app(i) for i in range(100)]
+    screen = Screen()
+
+    main.draw_preview(screen, apps[0], 10, 80)
+    assert decoded == [apps[0]]  # an empty pane is filled right away
+    time.sleep(0.11)
+    start = time.monotonic()
+    for app in apps[1:]:
+        main.draw_preview(screen, app, 10, 80)
+    assert time.monotonic() - start < 0.1, "the loop was too slow for this test"
+    assert decoded == [apps[0]]
+    assert main.preview_app is apps[0]
+
+    time.sleep(0.11)
+    main.draw_preview(screen, apps[-1], 10, 80)
+    assert decoded == [apps[0], apps[-1]]
+    assert main.preview_lines[-1] == "line"
+
+    main.draw_preview(screen, apps[-1], 10, 80)  # same app, within the frame budget
+    assert len(decoded) == 2
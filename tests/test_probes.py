@@ -0,0 +1,62 @@
+import os
+import subprocess
+import time
+
+import main
+from conftest import wait_until
+
+IDLE = "import time\nwhile True:\n    time.sleep(1)\n"
+
+
+def test_slow_probe_command_is_not_started_again_while_it_runs(make_mux, tmp_path, monkeypatch):
+    mux = make_mux({"a.py": IDLE})
+    monkeypatch.setattr(main, "mux", mux)
+    monkeypatch.setattr(main, "probe_state", {})
+    app = mux.start_app("a.py")
+    spawned = []
+    popen = subprocess.Popen
+    monkeypatch.setattr(subprocess, "Popen", lambda *a, **kw: spawned.append(popen(*a, **kw)) or spawned[-1])
+    marker = tmp_path / "child.pid"
+    probe = {"command": f"sleep 60 & echo $! > {marker}; wait", "command_timeout": 0.5}
+
+    assert main.check_liveness(app, probe) == "ok"
+    for _ in range(3):  # rounds while it's still going
+        assert main.check_liveness(app, probe) == "ok"
+    assert len(spawned) == 1
+
+    assert wait_until(marker.exists)
+    child = int(marker.read_text())
+    time.sleep(0.6)
+    assert main.check_liveness(app, probe) == "probe command timed out"
+    assert len(spawned) == 2  # the next round's
+    assert wait_until(lambda: not os.path.exists(f"/proc/{child}") or open(f"/proc/{child}/stat").read().split()[2] == "Z")
+    main.drop_probe_state("a.py")
+    assert spawned[1].poll() is not None
+
+
+def test_probe_command_result_counts_at_the_next_round(make_mux, monkeypatch):
+    mux = make_mux({"a.py": IDLE})
+    monkeypatch.setattr(main, "mux", mux)
+    monkeypatch.setattr(main, "probe_state", {})
+    app = mux.start_app("a.py")
+    probe = {"command": "exit 3"}
+    assert main.check_liveness(app, probe) == "ok"
+    assert wait_until(lambda: main.probe_state["a.py"]["command"].poll() is not None)
+    assert main.check_liveness(app, probe) == "probe command exited 3"
+    main.drop_probe_state("a.py")
+
+
+def test_failing_probe_command_fails_with_the_orphan_reaper_running(make_mux, monkeypatch):
+    mux = make_mux({"a.py": IDLE})
+    monkeypatch.setattr(main, "mux", mux)
+    monkeypatch.setattr(main, "probe_state", {})
+    app = mux.start_app("a.py")  # which makes Duckymux a subreaper
+    probe = {"command": "exit 3"}
+    assert main.check_liveness(app, probe) == "ok"
+    proc = main.probe_state["a.py"]["command"]
+    # exited but not waited for, when the reaper gets a look at it
+    assert wait_until(lambda: open(f"/proc/{proc.pid}/stat").read().rsplit(")", 1)[1].split()[0] == "Z")
+    mux._reap_orphans()
+    assert wait_until(lambda: proc.poll() is not None)
+    assert main.check_liveness(app, probe) == "probe command exited 3"
+    main.drop_probe_state("a.py")
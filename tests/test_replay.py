@@ -0,0 +1,28 @@
+import json
+
+import pytest
+
+import main
+
+
+def cast(tmp_path, events):
+    path = tmp_path / "app.cast"
+    lines = [json.dumps({"version": 2, "width": 80, "height": 24, "title": "app.py"})]
+    lines += [json.dumps([t, "o", text]) for t, text in events]
+    path.write_text("\n".join(lines) + "\n")
+    return str(path)
+
+
+@pytest.mark.parametrize("speed", ["0", "-1", "nan", "fast"])
+def test_replay_speed_must_be_above_zero(tmp_path, speed, capsys):
+    with pytest.raises(SystemExit) as exit:
+        main.replay_main([cast(tmp_path, []), "--speed", speed])
+    assert exit.value.code == 2
+    assert "--speed" in capsys.readouterr().err
+
+
+def test_replay_reads_everything_back(tmp_path, capsys):
+    texts = ["hello\n", "é" * 3000, "bye\n"]
+    path = cast(tmp_path, [(i * 0.01, text) for i, text in enumerate(texts)])
+    assert main.replay_main([path, "--speed", "4", "--quiet"]) == 0
+    assert f"3 events, {len(''.join(texts).encode())} bytes" in capsys.readouterr().err
@@ -0,0 +1,64 @@
+import termios
+
+import pytest
+
+from conftest import wait_until
+
+LINES = 2000
+
+
+def apps(tmp_path):
+    go, got = tmp_path / "go", tmp_path / "got"
+    src = (f"import os, time\nwhile not os.path.exists({str(go)!r}):\n    time.sleep(0.01)\n"
+           f"for i in range({LINES}):\n    print('line', i)\nimport sys\nsys.stdout.flush()\n"
+           "while True:\n    time.sleep(1)\n")
+    dst = (f"import sys\nprint('ready', flush=True)\nwith open({str(got)!r}, 'w') as f:\n"
+           "    for line in sys.stdin:\n        f.write(repr(line) + '\\n')\n        f.flush()\n")
+    return {"src.py": src, "dst.py": dst}, go, got
+
+
+@pytest.mark.parametrize("tee", [False, True])
+def test_routed_lines_arrive_once(make_mux, tmp_path, tee):
+    sources, go, got = apps(tmp_path)
+    mux = make_mux(sources)
+    src, dst = mux.start_app("src.py"), mux.start_app("dst.py")
+    assert wait_until(lambda: b"ready" in dst.buffer, mux=mux)
+    route = mux.add_route("src.py", "dst.py", tee=tee)
+    go.touch()
+    assert wait_until(lambda: route.bytes >= sum(len(f"line {i}\n") for i in range(LINES)), mux=mux)
+    assert wait_until(lambda: got.exists() and got.read_text().count("\n") >= LINES, mux=mux)
+    lines = got.read_text().splitlines()
+    assert lines == [repr(f"line {i}\n") for i in range(LINES)]
+    assert b"line 0" not in dst.buffer  # no echo into the destination's own output
+    if tee:
+        assert bytes(src.buffer).count(b"\n") == LINES
+
+
+def test_unroute_restores_the_terminals(make_mux, tmp_path):
+    sources, go, got = apps(tmp_path)
+    mux = make_mux(sources)
+    src, dst = mux.start_app("src.py"), mux.start_app("dst.py")
+    assert wait_until(lambda: b"ready" in dst.buffer, mux=mux)
+    before = termios.tcgetattr(src.fd), termios.tcgetattr(dst.fd)
+    mux.add_route("src.py", "dst.py")
+    assert not termios.tcgetattr(src.fd)[1] & termios.OPOST
+    assert not termios.tcgetattr(dst.fd)[0] & termios.ICRNL
+    assert not termios.tcgetattr(dst.fd)[3] & termios.ECHO
+    mux.remove_route("src.py", "dst.py")
+    assert (termios.tcgetattr(src.fd), termios.tcgetattr(dst.fd)) == before
+
+
+def test_two_routes_into_one_app_restore_it_after_the_last(make_mux, tmp_path):
+    sources, go, got = apps(tmp_path)
+    sources["other.py"] = sources["src.py"]
+    mux = make_mux(sources)
+    for name in sources:
+        mux.start_app(name)
+    dst = mux.by_name["dst.py"]
+    assert wait_until(lambda: b"ready" in dst.buffer, mux=mux)
+    mux.add_route("src.py", "dst.py")
+    mux.add_route("other.py", "dst.py")
+    mux.remove_route("src.py", "dst.py")
+    assert not termios.tcgetattr(dst.fd)[3] & termios.ECHO
+    mux.remove_route("other.py", "dst.py")
+    assert termios.tcgetattr(dst.fd)[3] & termios.ECHO
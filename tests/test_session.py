@@ -0,0 +1,90 @@
+import json
+import threading
+
+import main
+from conftest import wait_until
+
+PRINTER = "import sys, time\nprint(sys.argv[0].split('/')[-1], 'run', flush=True)\nwhile True:\n    time.sleep(1)\n"
+
+
+def setup_main(monkeypatch, mux, tmp_path):
+    session = dict(main.default_config["session"], path=str(tmp_path / "session.json"))
+    monkeypatch.setattr(main, "config", dict(main.default_config, session=session))
+    monkeypatch.setattr(main, "mux", mux)
+    monkeypatch.setattr(main, "rows", list(mux.table))
+    monkeypatch.setattr(main, "restored_scrollback", {})
+    monkeypatch.setattr(main, "last_snapshot_key", None)
+
+
+def test_scrollback_stays_compressed_across_sessions(make_mux, tmp_path, monkeypatch):
+    mux = make_mux({"a.py": PRINTER})
+    setup_main(monkeypatch, mux, tmp_path)
+    app = mux.start_app("a.py")
+    assert wait_until(lambda: b"run" in app.buffer, mux=mux)
+    main.save_session(mux, force=True, wait=True)
+    with open(main.config["session"]["path"]) as f:
+        snapshot = json.load(f)
+    assert snapshot["running"] == ["a.py"]
+    mux.stop_app("a.py")
+
+    # next session: saving must not decode what was restored
+    main.restore_session(mux, snapshot)
+    assert wait_until(lambda: b"run" in app.buffer, mux=mux)
+    decoded = []
+    real = main.zlib.decompress
+    monkeypatch.setattr(main.zlib, "decompress", lambda data: decoded.append(data) or real(data))
+    main.save_session(mux, force=True, wait=True)
+    assert decoded == []
+    assert len(main.restored_scrollback["a.py"]) == 1
+    with open(main.config["session"]["path"]) as f:
+        snapshot = json.load(f)
+    assert len(snapshot["scrollback"]["a.py"]) == 2  # last session's output, then this one's
+
+    # the session after: both earlier runs come back, oldest first
+    mux.stop_app("a.py")
+    main.restored_scrollback.clear()
+    main.restore_session(mux, snapshot)
+    assert wait_until(lambda: b"run" in app.buffer, mux=mux)
+    main.restore_scrollback("a.py", app.buffer)
+    assert bytes(app.buffer).count(b"a.py run") == 3
+    assert bytes(app.buffer).count(b"--- restarted by duckymux ---") == 2
+
+
+def test_old_parts_drop_out_once_new_output_fills_the_scrollback(make_mux, tmp_path, monkeypatch):
+    mux = make_mux({"a.py": PRINTER})
+    setup_main(monkeypatch, mux, tmp_path)
+    app = mux.start_app("a.py")
+    main.restored_scrollback["a.py"] = [[5, "old"]]
+    app.buffer.extend(b"x" * main.config["session"]["scrollback"])
+    main.save_session(mux, force=True, wait=True)
+    with open(main.config["session"]["path"]) as f:
+        parts = json.load(f)["scrollback"]["a.py"]
+    assert [length for length, _ in parts] == [main.config["session"]["scrollback"]]
+
+
+def test_old_style_snapshot_is_restored(make_mux, tmp_path, monkeypatch):
+    mux = make_mux({"a.py": PRINTER})
+    setup_main(monkeypatch, mux, tmp_path)
+    saved = main.base64.b64encode(main.zlib.compress(b"from before")).decode()
+    main.restore_session(mux, {"version": 1, "running": {"a.py": ["python3", "a.py"]},
+                               "scrollback": {"a.py": saved}})
+    app = mux.by_name["a.py"]
+    main.restore_scrollback("a.py", app.buffer)
+    assert bytes(app.buffer).startswith(b"from before\r\n--- restarted by duckymux ---")
+
+
+def test_checkpoint_is_compressed_and_written_off_the_calling_thread(make_mux, tmp_path, monkeypatch):
+    mux = make_mux({"a.py": PRINTER})
+    setup_main(monkeypatch, mux, tmp_path)
+    app = mux.start_app("a.py")
+    assert wait_until(lambda: b"run" in app.buffer, mux=mux)
+    threads = []
+    compress, fsync = main.zlib.compress, main.os.fsync
+    monkeypatch.setattr(main.zlib, "compress", lambda *a: threads.append(threading.current_thread()) or compress(*a))
+    monkeypatch.setattr(main.os, "fsync", lambda fd: threads.append(threading.current_thread()) or fsync(fd))
+    main.save_session(mux)
+    main.save_session(mux, force=True, wait=True)
+    assert threads and threading.main_thread() not in threads
+    with open(main.config["session"]["path"]) as f:
+        parts = json.load(f)["scrollback"]["a.py"]
+    assert main.zlib.decompress(main.base64.b64decode(parts[-1][1])).startswith(b"a.py run")
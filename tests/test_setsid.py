@@ -0,0 +1,27 @@
+import os
+
+from conftest import wait_until
+
+CTTY = "import os\nprint('ctty', os.tcgetpgrp(0) == os.getpgrp(), flush=True)\nimport time\ntime.sleep(60)\n"
+SESSION = "import os\nprint('leader', os.getsid(0) == os.getpid(), flush=True)\nimport time\ntime.sleep(60)\n"
+
+
+def test_apps_get_their_pty_as_controlling_terminal(make_mux):
+    mux = make_mux({"a.py": CTTY})
+    app = mux.start_app("a.py")
+    if not mux._setsid:
+        return  # no usable setsid here; covered by the next test
+    assert wait_until(lambda: b"ctty True" in app.buffer, mux=mux)
+
+
+def test_a_setsid_without_c_is_not_used(make_mux, tmp_path, monkeypatch):
+    bin_dir = tmp_path / "bin"
+    bin_dir.mkdir()
+    fake = bin_dir / "setsid"
+    fake.write_text('#!/bin/sh\necho "setsid: unrecognized option $1" >&2\nexit 1\n')
+    fake.chmod(0o755)
+    monkeypatch.setenv("PATH", f"{bin_dir}{os.pathsep}{os.environ['PATH']}")
+    mux = make_mux({"a.py": SESSION})
+    app = mux.start_app("a.py")
+    assert mux._setsid == ""
+    assert wait_until(lambda: b"leader True" in app.buffer, mux=mux)
@@ -0,0 +1,128 @@
+import datetime
+import random
+import time
+
+import pytest
+
+import main
+from conftest import wait_until
+from duckymux import Cron, TimerWheel
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    """time.monotonic() that only moves when told to."""
+    now = [1000.0]
+    monkeypatch.setattr(time, "monotonic", lambda: now[0])
+    return now
+
+
+def test_timers_cascade_down_to_their_own_tick(clock):
+    wheel = TimerWheel()
+    fired = []
+    # one per wheel, and one past the top wheel's lap (64**4 ticks, 19.4 days)
+    delays = [0.05, 6.5, 500.0, 30000.0, 2e6]
+    timers = [wheel.schedule(delay, lambda i=i: fired.append((i, wheel.current))) for i, delay in enumerate(delays)]
+    for i, (delay, timer) in enumerate(zip(delays, timers)):
+        assert 0 <= timer.tick * wheel.tick - (clock[0] + delay) < wheel.tick + 1e-6
+        assert wheel.advance((timer.tick - 1) * wheel.tick + wheel.tick / 2) == 0
+        assert wheel.advance((timer.tick + 0.5) * wheel.tick) == 1
+        assert fired == [(i, timer.tick)]
+        fired.clear()
+    assert wheel.count == 0 and not any(wheel.filed)
+
+
+def test_every_timer_runs_once_at_its_tick(clock):
+    rng = random.Random(7)
+    wheel = TimerWheel()
+    fired = {}
+    timers = []
+    for i in range(2000):
+        delay = rng.choice([rng.uniform(0, 10), rng.uniform(0, 1000), rng.uniform(0, 100000), rng.uniform(0, 3e6)])
+        timers.append(wheel.schedule(delay, lambda i=i: fired.setdefault(i, []).append(wheel.current)))
+    cancelled = set(rng.sample(range(len(timers)), 200))
+    for i in cancelled:
+        timers[i].cancel()
+    now = clock[0]
+    while now < clock[0] + 3.1e6:
+        now += rng.choice([0.05, 3.0, 700.0, 40000.0])
+        wheel.advance(now)
+    assert set(fired) == set(range(len(timers))) - cancelled
+    for i, ticks in fired.items():
+        assert ticks == [timers[i].tick]
+    assert wheel.count == 0
+
+
+def test_timer_scheduled_from_a_callback_runs_later(clock):
+    wheel = TimerWheel()
+    fired = []
+    wheel.schedule(1.0, lambda: wheel.schedule(1.0, fired.append, wheel.current))
+    wheel.advance(clock[0] + 1.05)
+    assert fired == []
+    wheel.advance(clock[0] + 2.05)
+    assert len(fired) == 1
+
+
+@pytest.fixture
+def utc(monkeypatch):
+    monkeypatch.setenv("TZ", "UTC")
+    time.tzset()
+    yield
+    monkeypatch.undo()
+    time.tzset()
+
+
+def at(*fields):
+    return datetime.datetime(*fields).timestamp()
+
+
+def test_cron_day_fields_or_when_both_are_set(utc):
+    first_or_monday = Cron("0 0 1 * 1")
+    assert first_or_monday.next_after(at(2026, 10, 27, 12, 0)) == at(2026, 11, 1)  # a Sunday
+    assert first_or_monday.next_after(at(2026, 11, 1, 0, 0)) == at(2026, 11, 2)  # a Monday
+    assert Cron("0 0 1 * *").next_after(at(2026, 10, 27)) == at(2026, 11, 1)
+    assert Cron("0 0 * * 1").next_after(at(2026, 10, 27)) == at(2026, 11, 2)
+    assert Cron("0 0 * * 7").next_after(at(2026, 10, 27)) == at(2026, 11, 1)  # 7 is Sunday too
+
+
+def test_cron_feb_29_waits_for_a_leap_year(utc):
+    assert Cron("0 12 29 2 *").next_after(at(2026, 3, 1)) == at(2028, 2, 29, 12, 0)
+    assert Cron("0 12 29 2 *").next_after(at(2028, 2, 29, 12, 0)) == at(2032, 2, 29, 12, 0)
+
+
+def test_cron_impossible_dates_never_run(utc):
+    assert Cron("0 0 30 2 *").next_after(at(2026, 1, 1)) is None
+    assert Cron("0 0 31 4,6,9,11 *").next_after(at(2026, 1, 1)) is None
+    # an impossible day of the month still runs on the weekday it's OR'ed with
+    assert Cron("0 0 30 2 1").next_after(at(2026, 2, 1)) == at(2026, 2, 2)
+
+
+def test_cron_rolls_over_the_end_of_the_year(utc):
+    assert Cron("59 23 31 12 *").next_after(at(2026, 12, 31, 23, 59)) == at(2027, 12, 31, 23, 59)
+    assert Cron("*/15 * * * *").next_after(at(2026, 12, 31, 23, 50)) == at(2027, 1, 1, 0, 0)
+
+
+@pytest.mark.parametrize("expr", ["* * * *", "60 * * * *", "* * 0 * *", "*/0 * * * *", "a * * * *"])
+def test_cron_rejects_bad_expressions(expr):
+    with pytest.raises(ValueError):
+        Cron(expr)
+
+
+def test_queued_run_starts_on_any_exit_the_mux_sees(make_mux, monkeypatch):
+    mux = make_mux({"a.py": "import sys\nsys.stdin.readline()\n"})
+    monkeypatch.setattr(main, "config", dict(main.default_config, schedules={"a.py": {"every": 3600, "overlap": "queue"}}))
+    monkeypatch.setattr(main, "mux", mux)
+    monkeypatch.setattr(main, "schedules", {})
+    monkeypatch.setattr(main, "timers", TimerWheel(0.1))
+    mux.exit_hooks.append(main.schedule_exited)
+    main.start_schedules(mux)
+    state = main.schedules["a.py"]
+    app = mux.start_app("a.py")
+    old_pid = app.pid
+    main.run_scheduled(app, state)
+    assert state["queued"]
+    mux.write_app("a.py", b"done\n")
+    # seen by check_exited(), as when leaving the serial monitor, not poll()
+    assert wait_until(lambda: mux.check_exited(app) or not app.running or app.pid != old_pid)
+    assert app.running and app.pid != old_pid
+    assert state["runs"] == 1 and not state["queued"]